@@ -0,0 +1,214 @@
+"""Benchmarks the core stages on synthetic (or real) corpora and writes machine-readable results.
+
+python benchmarks/bench.py --scales 1000,10000,100000 --output results.json
+python benchmarks/bench.py --scales 100000 --compare results.json --threshold 1.25
+python benchmarks/bench.py --corpus-dir Modules/MyMod/ModuleData
+
+Each stage is timed over --repeat runs (min and median seconds). peak_rss_mb is the process's
+peak resident memory after the stage; every scale runs in its own process unless --no-isolate
+is given, so it is the peak of that scale alone. --trace-memory adds the peak Python heap
+allocation of each stage (tracemalloc; lxml's own memory is not included, and timings are
+slower while tracing). With --compare, stages slower than --threshold times the baseline
+median make the run exit with status 1.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lxml import etree
+import xml_refactor as core
+from xml_refactor.profiling import max_rss_mb
+from corpus import generate_corpus
+
+STAGES = ('parse', 'find_ids', 'load', 'load_streaming', 'refactor', 'refactor_broad_scan',
+          'batch_refactor', 'render_output', 'create_zip')
+
+def revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+class StageContext:
+    """State shared by the stages of one corpus; stages build on the results of earlier ones."""
+
+    def __init__(self, file_contents):
+        self.file_contents = file_contents
+        self.xml_data = None
+        self.index = None
+        self.journal = core.ChangeJournal()
+        self.outputs = None
+
+    def loaded(self):
+        if self.index is None: self.xml_data, self.index, _ = core.load_xml_files(self.file_contents)
+        return self.xml_data, self.index
+
+    def rename_targets(self, count):
+        """The first `count` defined IDs that have references, in a stable order."""
+        _, index = self.loaded()
+        return [base_id for base_id in sorted(index.definitions) if index.references.get(base_id)][:count]
+
+def _rename_and_revert(context, old_base_id, value_index):
+    """Runs one perform_refactor and reverts it outside the timed region. Returns (seconds, edits)."""
+    xml_data, index = context.loaded()
+    change_set = []
+    start = time.perf_counter()
+    core.perform_refactor(old_base_id, old_base_id + '_bench', xml_data, index.definitions, index.references, change_set, value_index)
+    index.apply_changes(change_set)
+    elapsed = time.perf_counter() - start
+    core.apply_attribute_changes(change_set, reverse=True)
+    index.apply_changes(core.invert_changes(change_set))
+    return elapsed, len(change_set)
+
+def run_stage(stage, context):
+    """Runs one stage once. Returns (seconds, details)."""
+    files = context.file_contents
+    if stage == 'parse':
+        start = time.perf_counter()
+        trees = {name: core.parse_xml_bytes(content) for name, content in files.items()}
+        return time.perf_counter() - start, {'files': len(trees)}
+    if stage == 'find_ids':
+        xml_data, _ = context.loaded()
+        start = time.perf_counter()
+        index = core.ReferenceIndex.build(xml_data)
+        return time.perf_counter() - start, {'definitions': len(index.definitions), 'references': sum(map(len, index.references.values()))}
+    if stage in ('load', 'load_streaming'):
+        start = time.perf_counter()
+        core.load_xml_files(files, streaming=stage == 'load_streaming')
+        return time.perf_counter() - start, {}
+    if stage == 'refactor':
+        _, index = context.loaded()
+        elapsed, edits = _rename_and_revert(context, context.rename_targets(1)[0], index.values)
+        return elapsed, {'edits': edits}
+    if stage == 'refactor_broad_scan':
+        elapsed, edits = _rename_and_revert(context, context.rename_targets(1)[0], None)
+        return elapsed, {'edits': edits}
+    if stage == 'batch_refactor':
+        xml_data, index = context.loaded()
+        if context.journal.undo_stack: context.journal.undo(index) # Start every repeat from the original values
+        targets = context.rename_targets(max(10, len(index.definitions) // 100))
+        mapping = {old_base_id: old_base_id + '_bench' for old_base_id in targets}
+        change_set = []
+        start = time.perf_counter()
+        core.perform_batch_refactor(mapping, xml_data, index.definitions, index.references, change_set, index.values)
+        index.apply_changes(change_set)
+        elapsed = time.perf_counter() - start
+        context.journal.record("bench batch", change_set)
+        return elapsed, {'ids': len(mapping), 'edits': len(change_set)}
+    if stage == 'render_output':
+        xml_data, index = context.loaded()
+        start = time.perf_counter()
+        context.outputs, reserialized = core.render_output_files(list(files), xml_data, files, index, context.journal)
+        return time.perf_counter() - start, {'reserialized': len(reserialized)}
+    if stage == 'create_zip':
+        if context.outputs is None: run_stage('render_output', context)
+        rendered = {name: (content, core.OUTPUT_SPLICED) for name, content in context.outputs.items()}
+        start = time.perf_counter()
+        zip_bytes = core.create_zip(rendered)
+        return time.perf_counter() - start, {'zip_mb': round(len(zip_bytes) / 1e6, 2)}
+    raise ValueError(f"Unknown stage '{stage}'")
+
+def benchmark_corpus(file_contents, stages, repeat, trace_memory, label):
+    """Results of every stage on one corpus, as a list of dicts."""
+    context = StageContext(file_contents)
+    element_count = sum(1 for content in file_contents.values() for _ in etree.fromstring(content).iter(etree.Element))
+    results = []
+    for stage in stages:
+        timings, details, traced_peak = [], {}, None
+        for _ in range(repeat):
+            if trace_memory: tracemalloc.start()
+            elapsed, details = run_stage(stage, context)
+            if trace_memory:
+                traced_peak = max(traced_peak or 0, tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+            timings.append(elapsed)
+        result = {
+            'corpus': label, 'elements': element_count, 'bytes': sum(len(content) for content in file_contents.values()),
+            'stage': stage, 'repeat': repeat, 'min_s': round(min(timings), 6), 'median_s': round(statistics.median(timings), 6),
+            'peak_rss_mb': max_rss_mb(), 'details': details,
+        }
+        if trace_memory: result['traced_peak_mb'] = round(traced_peak / 1e6, 1)
+        results.append(result)
+        print(f"{label:>12} {stage:<20} {result['median_s']:>10.4f}s  (min {result['min_s']:.4f}s)", file=sys.stderr)
+    return results
+
+def compare(results, baseline, threshold):
+    """Prints median ratios against baseline results. Returns the number of regressions."""
+    baseline_medians = {(entry['corpus'], entry['stage']): entry['median_s'] for entry in baseline['results']}
+    regressions = 0
+    for entry in results:
+        before = baseline_medians.get((entry['corpus'], entry['stage']))
+        if not before: continue
+        ratio = entry['median_s'] / before
+        flag = "  REGRESSION" if ratio > threshold else ""
+        if flag: regressions += 1
+        print(f"{entry['corpus']:>12} {entry['stage']:<20} {before:>10.4f}s -> {entry['median_s']:>10.4f}s  x{ratio:.2f}{flag}")
+    return regressions
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Benchmark the refactor core on synthetic or real corpora.")
+    parser.add_argument('--scales', default='1000,10000', help="Comma separated corpus sizes in elements (e.g. 1000,10000,100000,1000000).")
+    parser.add_argument('--corpus-dir', help="Benchmark the XML files of this directory instead of synthetic corpora.")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--stages', default=','.join(STAGES), help="Comma separated subset of: " + ', '.join(STAGES))
+    parser.add_argument('--trace-memory', action='store_true', help="Also record each stage's peak Python heap allocation.")
+    parser.add_argument('--no-isolate', dest='isolate', action='store_false', help="Run all scales in this process.")
+    parser.add_argument('--output', help="Write the JSON results to this file (default: stdout).")
+    parser.add_argument('--compare', metavar='BASELINE', help="Compare against earlier JSON results.")
+    parser.add_argument('--threshold', type=float, default=1.25, help="Slowdown ratio counted as a regression by --compare.")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    stages = [stage for stage in args.stages.split(',') if stage]
+    unknown = set(stages) - set(STAGES)
+    if unknown: sys.exit(f"Unknown stages: {', '.join(sorted(unknown))}")
+    core.set_reporter(core.CollectingReporter()) # Keep the core's messages out of the timings and the output
+
+    results = []
+    if args.corpus_dir:
+        label = os.path.basename(os.path.normpath(args.corpus_dir))
+        results = benchmark_corpus(core.read_xml_directory(args.corpus_dir), stages, args.repeat, args.trace_memory, label)
+    else:
+        scales = [int(scale) for scale in args.scales.split(',') if scale]
+        for scale in scales:
+            if args.isolate and len(scales) > 1:
+                with tempfile.TemporaryDirectory() as temp_dir:
+                    scale_output = os.path.join(temp_dir, 'scale.json')
+                    command = [sys.executable, os.path.abspath(__file__), '--scales', str(scale), '--seed', str(args.seed),
+                               '--repeat', str(args.repeat), '--stages', ','.join(stages), '--output', scale_output]
+                    if args.trace_memory: command.append('--trace-memory')
+                    subprocess.run(command, check=True)
+                    with open(scale_output) as f: results.extend(json.load(f)['results'])
+            else:
+                results.extend(benchmark_corpus(generate_corpus(scale, args.seed), stages, args.repeat, args.trace_memory, str(scale)))
+
+    report = {
+        'meta': {
+            'revision': revision(), 'python': platform.python_version(), 'lxml': etree.__version__,
+            'platform': platform.platform(), 'cpu_count': os.cpu_count(), 'seed': args.seed,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f: json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    if args.compare:
+        with open(args.compare) as f: baseline = json.load(f)
+        if compare(results, baseline, args.threshold): sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Deterministic synthetic Bannerlord module generator for the benchmarks.
+
+python benchmarks/corpus.py OUTPUT_DIR --elements 100000 [--seed 1]
+
+Generates cultures (spcultures.xml) with troop, party template and `template name=`
+references, NPCCharacters with equipment sets and upgrade targets, equipment rosters, items
+and party templates, all cross-referencing each other like a real mod. --elements is the
+approximate total number of XML elements. Every plain ID is defined once, but, as in real mods,
+troops share upgrade targets: each id="NPCCharacter.x" of an upgrade_target is indexed as a
+dotted definition, and its repeats as duplicates of it (find_ids() without a duplicates dict
+warns about each one). check_integrity() counts those as references, not duplicates.
+"""
+import argparse
+import os
+import random
+
+# Rough number of elements each generated object contributes (used to size the corpus)
+_CULTURE_ELEMENTS = 12
+_TROOP_ELEMENTS = 10 # NPCCharacter + equipment set with slots + upgrade targets
+_ROSTER_ELEMENTS = 6
+_ITEM_ELEMENTS = 1
+_PARTY_TEMPLATE_ELEMENTS = 6
+TROOPS_PER_FILE = 5000
+
+def corpus_counts(elements):
+    """Number of cultures, troops, rosters, items and party templates for about `elements` elements."""
+    cultures = max(1, min(64, elements // 2000))
+    per_unit = _TROOP_ELEMENTS + _ROSTER_ELEMENTS / 4 + _ITEM_ELEMENTS * 2 + _PARTY_TEMPLATE_ELEMENTS / 8
+    troops = max(cultures * 4, int((elements - cultures * _CULTURE_ELEMENTS) / per_unit))
+    return {
+        'cultures': cultures, 'troops': troops, 'rosters': max(cultures, troops // 4),
+        'items': max(cultures * 4, troops * 2), 'party_templates': max(cultures, troops // 8),
+    }
+
+def _document(root_tag, body):
+    return f'<?xml version="1.0" encoding="utf-8"?>\n<{root_tag}>\n{body}</{root_tag}>\n'.encode('utf-8')
+
+def generate_corpus(elements, seed=1):
+    """{file_name: bytes} of a synthetic module with about `elements` elements."""
+    rng = random.Random(seed)
+    counts = corpus_counts(elements)
+    cultures = [f"culture_{c}" for c in range(counts['cultures'])]
+    culture_of = lambda n: cultures[n % len(cultures)]
+    troops = [f"{culture_of(t)}_troop_{t}" for t in range(counts['troops'])]
+    items = [f"{culture_of(i)}_item_{i}" for i in range(counts['items'])]
+    rosters = [f"{culture_of(r)}_roster_{r}" for r in range(counts['rosters'])]
+    party_templates = [f"{culture_of(p)}_party_{p}" for p in range(counts['party_templates'])]
+    troops_by_culture = {culture: troops[c::len(cultures)] for c, culture in enumerate(cultures)}
+    files = {}
+
+    lines = []
+    for c, culture in enumerate(cultures):
+        own_troops = troops_by_culture[culture]
+        own_templates = party_templates[c::len(cultures)] or party_templates
+        lines.append(
+            f'  <Culture id="{culture}" name="{{=!}}{culture.title()}" is_main_culture="true"'
+            f' basic_troop="NPCCharacter.{own_troops[0]}" elite_basic_troop="NPCCharacter.{own_troops[1]}"'
+            f' villager="NPCCharacter.{own_troops[2]}" caravan_master="NPCCharacter.{own_troops[3]}"'
+            f' default_party_template="PartyTemplate.{own_templates[0]}" villager_party_template="PartyTemplate.{own_templates[-1]}"'
+            f' default_battle_equipment_roster="EquipmentRoster.{rosters[c % len(rosters)]}">\n'
+            f'    <notable_and_wanderer_templates>\n'
+            + ''.join(f'      <template name="NPCCharacter.{rng.choice(own_troops)}" />\n' for _ in range(3)) +
+            '    </notable_and_wanderer_templates>\n'
+            '    <lord_templates>\n'
+            + ''.join(f'      <template name="NPCCharacter.{rng.choice(own_troops)}" />\n' for _ in range(2)) +
+            '    </lord_templates>\n'
+            '  </Culture>\n')
+    files['spcultures.xml'] = _document('Cultures', ''.join(lines))
+
+    for first in range(0, len(troops), TROOPS_PER_FILE):
+        lines = []
+        for t in range(first, min(first + TROOPS_PER_FILE, len(troops))):
+            culture = culture_of(t)
+            own_troops = troops_by_culture[culture]
+            slots = ''.join(f'        <equipment slot="Item{s}" id="Item.{rng.choice(items)}" />\n' for s in range(4))
+            upgrades = ''.join(f'      <upgrade_target id="NPCCharacter.{rng.choice(own_troops)}" />\n' for _ in range(2))
+            lines.append(
+                f'  <NPCCharacter id="{troops[t]}" default_group="Infantry" level="{rng.randint(1, 31)}" culture="Culture.{culture}"'
+                f' skill_template="SkillSet.skills_{culture}">\n'
+                f'    <equipmentSet>\n      <EquipmentSet id="{troops[t]}_set">\n{slots}      </EquipmentSet>\n    </equipmentSet>\n'
+                f'    <upgrade_targets>\n{upgrades}    </upgrade_targets>\n'
+                f'  </NPCCharacter>\n')
+        files[f"npccharacters_{first // TROOPS_PER_FILE}.xml"] = _document('NPCCharacters', ''.join(lines))
+
+    lines = []
+    for r, roster in enumerate(rosters):
+        slots = ''.join(f'      <Equipment slot="Item{s}" id="Item.{rng.choice(items)}" />\n' for s in range(4))
+        lines.append(f'  <EquipmentRoster id="{roster}" culture="Culture.{culture_of(r)}">\n    <EquipmentSet>\n{slots}    </EquipmentSet>\n  </EquipmentRoster>\n')
+    files['equipment_rosters.xml'] = _document('EquipmentRosters', ''.join(lines))
+
+    lines = [f'  <Item id="{item}" name="{{=!}}{item}" culture="Culture.{culture_of(i)}" weight="{rng.randint(1, 20)}" />\n' for i, item in enumerate(items)]
+    files['items.xml'] = _document('Items', ''.join(lines))
+
+    lines = []
+    for p, party_template in enumerate(party_templates):
+        own_troops = troops_by_culture[culture_of(p)]
+        stacks = ''.join(f'      <PartyTemplateStack min_value="1" max_value="{rng.randint(2, 20)}" troop="NPCCharacter.{rng.choice(own_troops)}" />\n' for _ in range(4))
+        lines.append(f'  <MBPartyTemplate id="{party_template}">\n    <stacks>\n{stacks}    </stacks>\n  </MBPartyTemplate>\n')
+    files['partyTemplates.xml'] = _document('partyTemplates', ''.join(lines))
+    return files
+
+def write_corpus(directory, files):
+    os.makedirs(directory, exist_ok=True)
+    for file_name, content in files.items():
+        with open(os.path.join(directory, file_name), 'wb') as f: f.write(content)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a synthetic Bannerlord module for benchmarking.")
+    parser.add_argument('output_dir')
+    parser.add_argument('--elements', type=int, default=100000, help="Approximate number of XML elements.")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+    files = generate_corpus(args.elements, args.seed)
+    write_corpus(args.output_dir, files)
+    print(f"Wrote {len(files)} files ({sum(len(content) for content in files.values()) / 1e6:.1f} MB) to {args.output_dir}")
+
+if __name__ == '__main__':
+    main()
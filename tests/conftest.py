@@ -0,0 +1,89 @@
+"""A small module (cultures, troops, party templates) written the way mods write them."""
+import pytest
+
+from xml_refactor import load_xml_files, render_output_files
+
+MODULE_FILES = {
+    'spcultures.xml': b'''<?xml version="1.0" encoding="utf-8"?>
+<!-- cultures -->
+<Cultures>
+  <Culture id="empire" name="{=empire}Empire" basic_troop="NPCCharacter.imperial_recruit" elite_basic_troop='NPCCharacter.imperial_vigla_recruit'
+           default_party_template="PartyTemplate.kingdom_hero_party_empire_template" villager="NPCCharacter.villager_empire">
+    <lord_templates>
+      <template name="NPCCharacter.spc_empire_lord_template" />
+    </lord_templates>
+  </Culture>
+  <Culture id="vlandia" basic_troop="NPCCharacter.vlandian_recruit" text="Knights &amp; crossbows" />
+</Cultures>
+''',
+    'troops.xml': b'''<?xml version="1.0" encoding="utf-8"?>
+<NPCCharacters>
+  <NPCCharacter id="imperial_recruit" culture="Culture.empire" default_group="Infantry">
+    <upgrade_targets>
+      <upgrade_target id="NPCCharacter.imperial_infantryman" />
+    </upgrade_targets>
+    <Equipments>
+      <EquipmentRoster>
+        <equipment slot="Item0" id="Item.imperial_sword" />
+      </EquipmentRoster>
+      <EquipmentSet id="imperial_recruit_set" civilian="true" />
+    </Equipments>
+  </NPCCharacter>
+  <NPCCharacter id="imperial_infantryman" culture="Culture.empire" /><NPCCharacter id="imperial_vigla_recruit" culture="Culture.empire" />
+  <NPCCharacter id="villager_empire" culture="Culture.empire" />
+  <NPCCharacter id="spc_empire_lord_template" culture="Culture.empire" />
+  <NPCCharacter id="vlandian_recruit" culture="Culture.vlandia" />
+</NPCCharacters>
+''',
+    'partyTemplates.xml': b'''<?xml version="1.0" encoding="utf-8"?>
+<partyTemplates>
+  <MBPartyTemplate id="kingdom_hero_party_empire_template">
+    <stacks>
+      <PartyTemplateStack min_value="1" max_value="4" troop="NPCCharacter.imperial_recruit" />
+      <PartyTemplateStack troop="NPCCharacter.imperial_infantryman" />
+    </stacks>
+  </MBPartyTemplate>
+</partyTemplates>
+''',
+    'items.xml': b'''<?xml version="1.0" encoding="utf-8"?>
+<Items>
+  <Item id="imperial_sword" culture="Culture.empire" />
+</Items>
+''',
+}
+
+def renamed(content, old_id, new_id):
+    """content with every quoted old_id (plain or NPCCharacter.-prefixed) replaced by new_id."""
+    for quote in (b'"', b"'"):
+        for prefix in (b'', b'NPCCharacter.'):
+            content = content.replace(quote + prefix + old_id.encode() + quote, quote + prefix + new_id.encode() + quote)
+    return content
+
+def load_module(module_files):
+    """(xml_data, index) of module_files, which must load without errors."""
+    xml_data, index, errors = load_xml_files(module_files)
+    assert not errors
+    return xml_data, index
+
+def render_all(module_files, xml_data, index, journal):
+    """{file_name: output bytes} of every file, as downloaded."""
+    return render_output_files(list(module_files), xml_data, module_files, index, journal)[0]
+
+def index_summary(index):
+    """What an index resolves, comparable with a rebuilt index: definitions, references per ID, value counts."""
+    return (
+        {base_id: (info['file_name'], info['element']) for base_id, info in index.definitions.items()},
+        {base_id: sorted((ref['file_name'], ref['attribute_name']) for ref in refs) for base_id, refs in index.references.items() if refs},
+        {key: len(locations) for key, locations in index.values.items() if locations},
+    )
+
+@pytest.fixture
+def module_files():
+    return dict(MODULE_FILES)
+
+@pytest.fixture
+def module_dir(tmp_path):
+    directory = tmp_path / 'ModuleData'
+    directory.mkdir()
+    for file_name, content in MODULE_FILES.items(): (directory / file_name).write_bytes(content)
+    return directory
@@ -0,0 +1,36 @@
+"""Browsing a file's references: document order, facets and ID search."""
+from conftest import MODULE_FILES
+from xml_refactor import NO_PREFIX, ReferenceBrowser, group_references_by_file, load_xml_files
+
+def _browser(index, file_name):
+    return ReferenceBrowser(file_name, group_references_by_file(index).get(file_name, []))
+
+def test_rows_follow_document_order(module_files):
+    _, index, _ = load_xml_files(module_files)
+    assert {file_name: len(refs) for file_name, refs in group_references_by_file(index).items()} == {
+        'spcultures.xml': 6, 'troops.xml': 7, 'partyTemplates.xml': 2, 'items.xml': 1}
+    browser = _browser(index, 'spcultures.xml')
+    assert [(ref['element'].get('id') or ref['element'].tag, ref['attribute_name']) for ref in browser.rows] == [
+        ('empire', 'basic_troop'), ('empire', 'elite_basic_troop'), ('empire', 'default_party_template'),
+        ('empire', 'villager'), ('template', 'name'), ('vlandia', 'basic_troop')]
+    _, streamed, _ = load_xml_files(module_files, streaming=True)
+    assert [ref['base_id'] for ref in _browser(streamed, 'spcultures.xml').rows] == [ref['base_id'] for ref in browser.rows]
+
+def test_search_combines_facets_and_text(module_files):
+    _, index, _ = load_xml_files(module_files)
+    browser = _browser(index, 'troops.xml')
+    assert browser.search() == list(range(7))
+    assert browser.search(text=' IMP') == [1] # Start of the base ID, any case
+    assert browser.search(text='emp') == [0, 2, 3, 4, 5]
+    assert browser.search(text='sword', anywhere=True) == [1] and browser.search(text='sword') == [] # Any part of the value
+    assert browser.search(tags=['equipment']) == [1] and browser.search(prefixes=['Item.']) == [1]
+    assert browser.search(attributes=['culture'], text='vlandia') == [6]
+    assert browser.search(attributes=['culture'], prefixes=['Item.']) == []
+    assert browser.search(prefixes=[NO_PREFIX]) == []
+
+def test_base_files_are_not_browsed(module_files):
+    _, base_index, _ = load_xml_files({'items.xml': MODULE_FILES['items.xml']})
+    module_files.pop('items.xml')
+    _, index, _ = load_xml_files(module_files, base_index=base_index)
+    assert set(group_references_by_file(index)) == {'spcultures.xml', 'troops.xml', 'partyTemplates.xml'}
+    assert len(_browser(index, 'troops.xml').rows) == 7
@@ -0,0 +1,27 @@
+"""Attribute classification rules."""
+from xml_refactor import ATTR_DEFINITION, ATTR_NOT_REFERENCE, ATTR_REFERENCE, classify_attribute, value_index_key
+
+def test_definitions_and_configured_prefixes():
+    assert classify_attribute('NPCCharacter', 'id', 'imperial_recruit') == (ATTR_DEFINITION, None, 'imperial_recruit')
+    assert classify_attribute('Culture', 'basic_troop', 'NPCCharacter.imperial_recruit') == (ATTR_REFERENCE, 'NPCCharacter.', 'imperial_recruit')
+    assert classify_attribute('NPCCharacter', 'culture', 'Culture.empire') == (ATTR_REFERENCE, 'Culture.', 'empire')
+    # A configured attribute only references through its own prefix
+    assert classify_attribute('Culture', 'basic_troop', 'imperial_recruit') == (ATTR_NOT_REFERENCE, None, None)
+    assert classify_attribute('Culture', 'basic_troop', 'NPCCharacter.') == (ATTR_NOT_REFERENCE, None, None)
+    assert classify_attribute('NPCCharacter', 'id', '') == (ATTR_NOT_REFERENCE, None, None)
+
+def test_equipment_templates_and_unconfigured_attributes():
+    assert classify_attribute('equipment', 'id', 'Item.imperial_sword') == (ATTR_REFERENCE, 'Item.', 'imperial_sword')
+    assert classify_attribute('Equipment', 'id', 'imperial_sword') == (ATTR_REFERENCE, None, 'imperial_sword')
+    assert classify_attribute('template', 'name', 'NPCCharacter.spc_empire_lord_template') == (ATTR_REFERENCE, 'NPCCharacter.', 'spc_empire_lord_template')
+    assert classify_attribute('Culture', 'name', '{=empire}Empire') == (ATTR_NOT_REFERENCE, None, None)
+    # Unconfigured attributes need a multi-letter uppercase prefix
+    assert classify_attribute('Hero', 'spouse', 'Hero.lord_1_1') == (ATTR_REFERENCE, 'Hero.', 'lord_1_1')
+    assert classify_attribute('Hero', 'spouse', 'A.lord_1_1') == (ATTR_NOT_REFERENCE, None, None)
+    assert classify_attribute('Hero', 'text', 'version 1.2') == (ATTR_NOT_REFERENCE, None, None)
+
+def test_value_index_keys():
+    assert value_index_key('Culture', 'basic_troop', 'NPCCharacter.imperial_recruit') == 'imperial_recruit'
+    assert value_index_key('Culture', 'basic_troop', 'imperial_recruit') == 'imperial_recruit' # Likely reference attribute
+    assert value_index_key('Hero', 'text', 'imperial_recruit') is None
+    assert value_index_key('Hero', 'text', 'Hero.x') == 'x'
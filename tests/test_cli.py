@@ -0,0 +1,80 @@
+"""The command line: written diffs, reports and exit codes."""
+import json
+
+from conftest import MODULE_FILES, renamed
+from xml_refactor import EXIT_CONFLICT, EXIT_INPUT_ERROR, EXIT_OK
+from xml_refactor.cli import main
+
+def test_rename_writes_only_the_renamed_values(module_dir, tmp_path):
+    output_dir, report_path = tmp_path / 'out', tmp_path / 'report.json'
+    exit_code = main([str(module_dir), '--rename', 'imperial_recruit=imperial_levy', '--output-dir', str(output_dir),
+                      '--copy-unchanged', '--report', str(report_path), '-q'])
+    assert exit_code == EXIT_OK
+    for file_name, content in MODULE_FILES.items():
+        assert (output_dir / file_name).read_bytes() == renamed(content, 'imperial_recruit', 'imperial_levy'), file_name
+    report = json.loads(report_path.read_text(encoding='utf-8'))
+    assert report['mapping'] == {'imperial_recruit': 'imperial_levy'}
+    assert sorted((change['file'], change['line'], change['attribute'], change['old'], change['new']) for change in report['changes']) == [
+        ('partyTemplates.xml', 5, 'troop', 'NPCCharacter.imperial_recruit', 'NPCCharacter.imperial_levy'),
+        ('spcultures.xml', 5, 'basic_troop', 'NPCCharacter.imperial_recruit', 'NPCCharacter.imperial_levy'),
+        ('troops.xml', 3, 'id', 'imperial_recruit', 'imperial_levy'),
+    ]
+    assert {entry['file']: entry['output'] for entry in report['files'] if entry['edits']} == {
+        'partyTemplates.xml': 'spliced', 'spcultures.xml': 'spliced', 'troops.xml': 'spliced'}
+
+def test_prefix_rename_in_place(module_dir):
+    assert main([str(module_dir), '--prefix', 'imperial_', 'roman_', '--in-place', '-q']) == EXIT_OK
+    troops = (module_dir / 'troops.xml').read_bytes()
+    assert b'id="roman_recruit"' in troops and b'id="roman_recruit_set"' in troops and b'imperial_' not in troops
+    assert b"elite_basic_troop='NPCCharacter.roman_vigla_recruit'" in (module_dir / 'spcultures.xml').read_bytes()
+
+def test_dry_run_writes_nothing(module_dir, tmp_path):
+    assert main([str(module_dir), '--rename', 'empire=vakken', '--dry-run', '-q']) == EXIT_OK
+    assert all((module_dir / file_name).read_bytes() == content for file_name, content in MODULE_FILES.items())
+
+def test_conflicting_rename_exits_with_conflict(module_dir, tmp_path):
+    output_dir = tmp_path / 'out'
+    assert main([str(module_dir), '--rename', 'imperial_recruit=vlandian_recruit', '--output-dir', str(output_dir), '-q']) == EXIT_CONFLICT
+    assert main([str(module_dir), '--rename', 'empire=vakken', '--rename', 'vlandia=vakken', '--output-dir', str(output_dir), '-q']) == EXIT_CONFLICT
+    assert not output_dir.exists()
+
+def test_rename_of_base_corpus_id_exits_with_conflict(module_dir, tmp_path):
+    base_dir = tmp_path / 'Modules'
+    base_dir.mkdir()
+    (module_dir / 'items.xml').rename(base_dir / 'items.xml')
+    output_dir = tmp_path / 'out'
+    exit_code = main([str(module_dir), '--rename', 'imperial_sword=gladius', '--base-dir', str(base_dir), '--output-dir', str(output_dir), '-q'])
+    assert exit_code == EXIT_CONFLICT
+    assert not output_dir.exists()
+
+def test_input_errors_exit_with_input_error(module_dir, tmp_path):
+    output_dir = str(tmp_path / 'out')
+    assert main([str(tmp_path / 'missing'), '--rename', 'a=b', '--output-dir', output_dir, '-q']) == EXIT_INPUT_ERROR
+    assert main([str(module_dir), '--rename', 'no_equals_sign', '--output-dir', output_dir, '-q']) == EXIT_INPUT_ERROR
+    assert main([str(module_dir), '--regex', '(', 'x', '--output-dir', output_dir, '-q']) == EXIT_INPUT_ERROR
+    (module_dir / 'broken.xml').write_bytes(b'<Items><Item id="x"></Items>')
+    assert main([str(module_dir), '--rename', 'empire=vakken', '--output-dir', output_dir, '-q']) == EXIT_INPUT_ERROR
+
+def test_invalid_option_values_exit_with_input_error(module_dir, capsys):
+    for jobs in ('0', '-1', 'many'):
+        assert main([str(module_dir), '--rename', 'empire=vakken', '--dry-run', '--jobs', jobs]) == EXIT_INPUT_ERROR
+        assert f"argument --jobs: expected a positive number, got '{jobs}'" in capsys.readouterr().err
+    assert main([str(module_dir), '--rename', 'empire=vakken', '--dry-run', '-q', '--jobs', '2']) == EXIT_OK
+
+def test_failed_rename_writes_nothing(module_dir, tmp_path, monkeypatch):
+    # Let an ID lxml cannot set past the conflict checks, as a rename error would get past them
+    for module in ('xml_refactor.batch', 'xml_refactor.refactor'):
+        monkeypatch.setattr(f'{module}.find_rename_conflicts', lambda mapping, definitions: [])
+    output_dir, report_path = tmp_path / 'out', tmp_path / 'report.json'
+    exit_code = main([str(module_dir), '--rename', 'imperial_recruit=bad\x01id', '--output-dir', str(output_dir),
+                      '--report', str(report_path), '-q'])
+    assert exit_code == EXIT_INPUT_ERROR
+    assert not output_dir.exists()
+    report = json.loads(report_path.read_text(encoding='utf-8'))
+    assert report['status'] == 'rename_error' and report['errors'] and not report['files']
+
+def test_unwritable_report_exits_with_input_error(module_dir, tmp_path, capsys):
+    output_dir, report_path = tmp_path / 'out', tmp_path / 'missing' / 'report.json'
+    assert main([str(module_dir), '--rename', 'empire=vakken', '--output-dir', str(output_dir), '--report', str(report_path)]) == EXIT_INPUT_ERROR
+    assert f"error: Cannot write '{report_path}'" in capsys.readouterr().err
+    assert not output_dir.exists()
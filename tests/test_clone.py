@@ -0,0 +1,26 @@
+"""Cloning a definition with its dependency closure, and undoing the clone."""
+from conftest import MODULE_FILES, index_summary, load_module, render_all
+from xml_refactor import ChangeJournal, ReferenceGraph, ReferenceIndex, apply_clone, plan_clone
+
+def test_clone_then_undo(module_files):
+    xml_data, index = load_module(module_files)
+    plan = plan_clone('empire', 'vakken', xml_data, index, ReferenceGraph.build(index))
+    assert not plan['errors']
+    assert plan['mapping']['empire'] == 'vakken' and plan['mapping']['imperial_recruit'] == 'vakken_imperial_recruit'
+    insertions = []
+    apply_clone(plan, xml_data, index, insertions)
+    journal = ChangeJournal()
+    journal.record('clone', [], insertions)
+    cloned = render_all(module_files, xml_data, index, journal)
+    assert b'<Culture id="vakken"' in cloned['spcultures.xml']
+    assert b'basic_troop="NPCCharacter.vakken_imperial_recruit"' in cloned['spcultures.xml']
+    assert cloned['troops.xml'].startswith(MODULE_FILES['troops.xml'][:-len(b'</NPCCharacters>\n')]) # Appended, originals untouched
+    assert index.definitions['vakken_imperial_recruit']['file_name'] == 'troops.xml'
+    assert index_summary(index) == index_summary(ReferenceIndex.build(xml_data))
+
+    assert journal.undo(index) == 'clone'
+    assert render_all(module_files, xml_data, index, journal) == MODULE_FILES
+    assert not any(base_id.startswith('vakken') for base_id in index.definitions)
+    assert index_summary(index) == index_summary(ReferenceIndex.build(xml_data))
+    journal.redo(index)
+    assert render_all(module_files, xml_data, index, journal) == cloned
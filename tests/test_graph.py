@@ -0,0 +1,28 @@
+"""The reference graph: who uses an ID, directly or transitively."""
+from conftest import MODULE_FILES
+from xml_refactor import ReferenceGraph, load_xml_files
+
+def test_dependents_and_dependencies(module_files):
+    _, index, _ = load_xml_files(module_files)
+    graph = ReferenceGraph.build(index)
+    # The upgrade_target of imperial_recruit and a party template stack use imperial_infantryman
+    assert graph.dependents('imperial_infantryman', max_depth=1) == {'imperial_recruit': 1, 'kingdom_hero_party_empire_template': 1}
+    assert graph.dependents('imperial_infantryman')['empire'] == 2
+    # A nested definition (the EquipmentSet) is contained by its owner
+    assert graph.dependencies('imperial_recruit', 1) == {'empire': 1, 'imperial_sword': 1, 'imperial_infantryman': 1, 'imperial_recruit_set': 1}
+    assert graph.dependents(['imperial_recruit', 'empire'], 1) == {
+        'kingdom_hero_party_empire_template': 1, 'imperial_vigla_recruit': 1, 'imperial_infantryman': 1,
+        'villager_empire': 1, 'spc_empire_lord_template': 1, 'imperial_sword': 1}
+
+def test_streamed_and_layered_graphs_match(module_files):
+    _, index, _ = load_xml_files(module_files)
+    expected = ReferenceGraph.build(index).dependents('imperial_sword')
+    _, streamed, _ = load_xml_files(module_files, streaming=True)
+    assert ReferenceGraph.build(streamed).dependents('imperial_sword') == expected
+
+    _, base_index, _ = load_xml_files({'items.xml': MODULE_FILES['items.xml']})
+    base_graph = ReferenceGraph.build(base_index)
+    module_files.pop('items.xml')
+    _, session_index, _ = load_xml_files(module_files, base_index=base_index)
+    assert ReferenceGraph.build(session_index, base_graph).dependents('imperial_sword') == expected
+    assert base_graph.used_by == {'empire': {'imperial_sword'}} # The base graph is never modified
@@ -0,0 +1,80 @@
+"""Incremental index updates."""
+from xml_refactor import AttributeChange, ReferenceIndex, load_xml_files, materialize_files, rebuild_index
+
+DUPLICATE_FILE = b'''<?xml version="1.0" encoding="utf-8"?>
+<NPCCharacters>
+  <NPCCharacter id="vlandian_recruit" culture="Culture.vlandia" name="second" />
+  <NPCCharacter id="vlandian_recruit" culture="Culture.vlandia" name="third" />
+</NPCCharacters>
+'''
+
+def _rename(index, def_info, new_id):
+    element = def_info['element']
+    change = AttributeChange(def_info['file_name'], element, 'id', element.get('id'), new_id)
+    element.set('id', new_id)
+    index.apply_changes([change])
+
+def test_removing_a_definition_promotes_its_duplicate(module_files):
+    module_files['more_troops.xml'] = DUPLICATE_FILE
+    xml_data, index, errors = load_xml_files(module_files)
+    assert not errors
+    first = index.definitions['vlandian_recruit']
+    assert first['file_name'] == 'troops.xml'
+    assert [dup['element'].get('name') for dup in index.duplicates['vlandian_recruit']] == ['second', 'third']
+
+    _rename(index, first, 'vlandian_levy')
+    assert index.definitions['vlandian_levy']['element'] is first['element']
+    assert index.definitions['vlandian_recruit']['element'].get('name') == 'second'
+    assert [dup['element'].get('name') for dup in index.duplicates['vlandian_recruit']] == ['third']
+
+    _rename(index, index.duplicates['vlandian_recruit'][0], 'vlandian_squire') # A shadowed one goes quietly
+    assert index.definitions['vlandian_recruit']['element'].get('name') == 'second'
+    assert 'vlandian_recruit' not in index.duplicates
+    rebuilt = ReferenceIndex.build(xml_data)
+    assert {base_id: info['element'] for base_id, info in index.definitions.items()} == {base_id: info['element'] for base_id, info in rebuilt.definitions.items()}
+
+def test_base_layer_is_never_modified(module_files):
+    base_files = {'items.xml': module_files.pop('items.xml')}
+    _, base_index, _ = load_xml_files(base_files)
+    base_definitions = dict(base_index.definitions)
+    xml_data, index, errors = load_xml_files(module_files, base_index=base_index)
+    assert not errors and index.definitions['imperial_sword']['file_name'] == 'items.xml'
+    _rename(index, index.definitions['imperial_recruit'], 'imperial_levy')
+    assert dict(base_index.definitions) == base_definitions
+    assert 'imperial_levy' not in base_index.definitions and 'imperial_levy' in index.definitions
+
+def test_streamed_files_bind_on_materialize(module_files):
+    xml_data, index, errors = load_xml_files(module_files, streaming=True)
+    assert not errors and not xml_data and set(index.unbound) == set(module_files)
+    def_info = index.definitions['imperial_infantryman']
+    assert def_info['element'] is None and def_info['sourceline'] == 14
+    assert materialize_files(['troops.xml'], xml_data, index, module_files) == []
+    assert def_info['element'] is not None and def_info['element'].get('id') == 'imperial_infantryman'
+    assert def_info['element'].sourceline == 14
+
+def test_rebuild_keeps_unmaterialized_streamed_files(module_files):
+    xml_data, index, errors = load_xml_files(module_files, streaming=True)
+    assert not errors and materialize_files(['troops.xml'], xml_data, index, module_files) == []
+    rebuilt = rebuild_index(xml_data, module_files, index)
+    assert set(rebuilt.unbound) == set(module_files) - {'troops.xml'}
+    assert rebuilt.definitions['empire']['file_name'] == 'spcultures.xml' and rebuilt.definitions['empire']['element'] is None
+    assert rebuilt.definitions['imperial_recruit']['element'] is xml_data['troops.xml'].getroot()[0]
+    assert sorted(rebuilt.references) == sorted(index.references)
+
+def test_session_layer_holds_only_its_own_entries(module_files):
+    _, base_index, _ = load_xml_files(module_files)
+    base_references = list(base_index.references['empire'])
+    mod_file = b'<NPCCharacters><NPCCharacter id="mod_recruit" culture="Culture.empire" /></NPCCharacters>'
+    xml_data, index, errors = load_xml_files({'mod_troops.xml': mod_file}, base_index=base_index)
+    assert not errors
+    own = index.references.maps[0]['empire']
+    assert [ref['file_name'] for ref in own] == ['mod_troops.xml']
+    assert list(index.references['empire']) == base_references + own and len(index.references['empire']) == len(base_references) + 1
+    assert len(index.values.maps[0]['empire']) == 1
+
+    element = xml_data['mod_troops.xml'].getroot()[0]
+    element.set('culture', 'Culture.vlandia')
+    index.apply_changes([AttributeChange('mod_troops.xml', element, 'culture', 'Culture.empire', 'Culture.vlandia')])
+    assert 'empire' not in index.references.maps[0] and list(index.references['empire']) == base_references
+    assert base_index.references['empire'] == base_references
+    assert [ref['file_name'] for ref in index.references['vlandia']][-1] == 'mod_troops.xml'
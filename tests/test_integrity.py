@@ -0,0 +1,36 @@
+"""Integrity checks: dangling references, duplicate definitions and orphans."""
+from xml_refactor import check_integrity, load_xml_files, new_dangling_references
+
+MOD_FILE = b'''<NPCCharacters>
+  <NPCCharacter id="vlandian_recruit" culture="Culture.sturgia" />
+  <NPCCharacter id="mod_hero" culture="Culture.vlandia">
+    <upgrade_targets><upgrade_target id="NPCCharacter.mod_veteran" /></upgrade_targets>
+  </NPCCharacter>
+</NPCCharacters>
+'''
+
+def test_integrity_report(module_files):
+    _, index, errors = load_xml_files(module_files)
+    assert not errors
+    clean = check_integrity(index)
+    assert clean['dangling'] == {} and clean['duplicates'] == []
+    assert clean['orphans'] == [{'id': 'imperial_recruit_set', 'file': 'troops.xml', 'line': 11}]
+
+    module_files['mod.xml'] = MOD_FILE
+    _, index, errors = load_xml_files(module_files)
+    report = check_integrity(index)
+    assert report['dangling'] == {
+        'Culture.': [{'id': 'sturgia', 'references': 1, 'locations': [('mod.xml', 2)]}],
+        'NPCCharacter.': [{'id': 'mod_veteran', 'references': 1, 'locations': [('mod.xml', 4)]}],
+    }
+    assert report['duplicates'] == [{'id': 'vlandian_recruit', 'locations': [('troops.xml', 17), ('mod.xml', 2)]}]
+    assert [orphan['id'] for orphan in report['orphans']] == ['mod_hero', 'imperial_recruit_set']
+    assert report['counts'] == {'dangling_ids': 2, 'dangling_references': 2, 'duplicates': 1, 'orphans': 2}
+    assert new_dangling_references(clean, report) == [('Culture.', 'sturgia', 1), ('NPCCharacter.', 'mod_veteran', 1)]
+
+def test_read_only_files_are_not_reported(module_files):
+    module_files['mod.xml'] = MOD_FILE
+    _, index, _ = load_xml_files(module_files)
+    report = check_integrity(index, read_only_files={'mod.xml'})
+    assert report['dangling'] == {} and report['orphans'] == [{'id': 'imperial_recruit_set', 'file': 'troops.xml', 'line': 11}]
+    assert [duplicate['id'] for duplicate in report['duplicates']] == ['vlandian_recruit'] # troops.xml's definition is not read-only
@@ -0,0 +1,48 @@
+"""Background jobs: progress, results, failures and cancellation."""
+import threading
+
+from xml_refactor import JOB_CANCELLED, JOB_DONE, JOB_FAILED, JobRunner, current_job, load_xml_files, report_progress
+
+def test_job_result_and_progress():
+    runner = JobRunner(max_workers=1)
+    job = runner.submit('count', lambda n: [report_progress(done, n, 'counting') or done for done in range(n)], 3)
+    assert job.wait(10) and job.status == JOB_DONE
+    assert job.result == [0, 1, 2] and job.progress == (2, 3, 'counting')
+    assert current_job() is None
+    runner.shutdown()
+
+def test_job_failure_is_recorded():
+    runner = JobRunner(max_workers=1)
+    job = runner.submit('fail', lambda: 1 / 0)
+    assert job.wait(10) and job.status == JOB_FAILED and job.error.startswith('ZeroDivisionError')
+    runner.shutdown()
+
+def test_cancel_stops_at_the_next_progress_report():
+    runner = JobRunner(max_workers=1)
+    started, release = threading.Event(), threading.Event()
+    reached = []
+    def work():
+        started.set()
+        release.wait(10)
+        for done in range(100):
+            report_progress(done, 100)
+            reached.append(done)
+    job = runner.submit('work', work)
+    pending = runner.submit('never started', reached.append, 'pending')
+    assert started.wait(10)
+    job.cancel()
+    pending.cancel()
+    release.set()
+    assert job.wait(10) and pending.wait(10)
+    assert job.status == pending.status == JOB_CANCELLED
+    assert reached == [] and job.result is None
+    runner.shutdown()
+
+def test_cancelled_load_returns_nothing(module_files):
+    runner = JobRunner(max_workers=1)
+    gate = threading.Event()
+    job = runner.submit('load', lambda: gate.wait(10) and load_xml_files(module_files))
+    job.cancel()
+    gate.set()
+    assert job.wait(10) and job.status == JOB_CANCELLED and job.result is None
+    runner.shutdown()
@@ -0,0 +1,23 @@
+"""Undo and redo of renames, down to the written bytes."""
+from conftest import MODULE_FILES, index_summary, load_module, render_all, renamed
+from xml_refactor import ChangeJournal, ReferenceIndex, perform_batch_refactor
+
+def test_rename_undo_redo(module_files):
+    xml_data, index = load_module(module_files)
+    journal = ChangeJournal()
+    change_set = []
+    perform_batch_refactor({'imperial_recruit': 'imperial_levy'}, xml_data, index.definitions, index.references, change_set, index.values)
+    index.apply_changes(change_set)
+    journal.record('rename', change_set)
+    expected = {file_name: renamed(content, 'imperial_recruit', 'imperial_levy') for file_name, content in MODULE_FILES.items()}
+    assert render_all(module_files, xml_data, index, journal) == expected
+    assert 'imperial_levy' in index.definitions and 'imperial_recruit' not in index.definitions
+
+    assert journal.undo(index) == 'rename'
+    assert render_all(module_files, xml_data, index, journal) == MODULE_FILES
+    assert index_summary(index) == index_summary(ReferenceIndex.build(xml_data))
+    assert journal.redo(index) == 'rename'
+    assert render_all(module_files, xml_data, index, journal) == expected
+    assert index_summary(index) == index_summary(ReferenceIndex.build(xml_data))
+    journal.revert_all()
+    assert render_all(module_files, xml_data, index, journal) == MODULE_FILES
@@ -0,0 +1,31 @@
+"""Loading: the parse cache and its stored shards."""
+from xml_refactor import CollectingProfiler, ParseCache, load_xml_files, set_profiler
+
+def _parse_counts(module_files, cache):
+    profiler = CollectingProfiler()
+    previous = set_profiler(profiler)
+    try: xml_data, index, errors = load_xml_files(module_files, cache=cache)
+    finally: set_profiler(previous)
+    assert not errors
+    record = next(record for record in profiler.records if record['stage'] == 'parse')
+    return xml_data, index, record['counts']['parsed'], record['counts']['indexed']
+
+def test_parse_cache_reuses_released_trees_and_shards(module_files):
+    cache = ParseCache()
+    xml_data, _, parsed, indexed = _parse_counts(module_files, cache)
+    assert parsed == indexed == len(module_files)
+    xml_data['troops.xml'].getroot()[0].set('id', 'edited') # Reverted by release() only through a journal
+    cache.release({name: tree for name, tree in xml_data.items() if name != 'troops.xml'})
+    module_files['items.xml'] = module_files['items.xml'].replace(b'imperial_sword', b'imperial_spear')
+    reloaded, index, parsed, indexed = _parse_counts(module_files, cache)
+    assert (parsed, indexed) == (2, 1) # troops.xml was not released; items.xml changed
+    assert reloaded['spcultures.xml'] is xml_data['spcultures.xml']
+    assert reloaded['troops.xml'] is not xml_data['troops.xml']
+    assert index.definitions['imperial_spear']['element'] is not None
+    assert index.definitions['empire']['element'] is reloaded['spcultures.xml'].getroot()[0]
+
+def test_parse_cache_stores_shards_on_disk(module_files, tmp_path):
+    load_xml_files(module_files, cache=ParseCache(str(tmp_path)))
+    _, index, parsed, indexed = _parse_counts(module_files, ParseCache(str(tmp_path)))
+    assert (parsed, indexed) == (len(module_files), 0)
+    assert index.definitions['imperial_recruit']['file_name'] == 'troops.xml'
@@ -0,0 +1,89 @@
+"""In-place output: splicing edited attribute values into the original bytes."""
+import re
+import time
+import zipfile
+from io import BytesIO
+
+from conftest import MODULE_FILES, load_module
+from xml_refactor import OUTPUT_ORIGINAL, OUTPUT_SPLICED, ChangeJournal, OutputCache, create_zip, perform_batch_refactor, refactor_paths
+from xml_refactor.output import element_ordinals, splice_attribute_edits
+from xml_refactor.parsing import parse_xml_bytes, scan_start_tags
+
+def _long_file(troops=40000):
+    """Troops one per line, then as many lines of two cultures referencing them, so the file
+    (and the referencing elements, several per line) run past lxml's 65535 sourceline cap."""
+    lines = ['<?xml version="1.0" encoding="utf-8"?>', '<Module>']
+    lines += [f'  <NPCCharacter id="troop_{n}" />' for n in range(troops)]
+    lines += [f'  <Culture id="culture_{n}" basic_troop="NPCCharacter.troop_{n}" /><Culture id="rebels_{n}" elite_basic_troop="NPCCharacter.troop_{n}" />'
+              for n in range(troops)]
+    lines.append('</Module>\n')
+    return '\n'.join(lines).encode('utf-8')
+
+def test_splice_past_sourceline_cap():
+    content = _long_file()
+    assert content.count(b'\n') > 65535
+    tree = parse_xml_bytes(content)
+    cultures = list(tree.getroot().iter('Culture'))[-3:] # Two per line, far past line 65535
+    edits = [(element, 'id', element.get('id'), element.get('id') + '_x') for element in cultures]
+    for element, attr_name, _, new_value in edits: element.set(attr_name, new_value)
+    spliced = splice_attribute_edits(content, edits, element_ordinals(tree), scan_start_tags(content))
+    expected = content
+    for _, _, old_value, new_value in edits:
+        expected = expected.replace(f'id="{old_value}"'.encode(), f'id="{new_value}"'.encode())
+    assert spliced == expected
+
+def test_rename_long_file_is_spliced_quickly(tmp_path):
+    source = tmp_path / 'spnpccharacters.xml'
+    source.write_bytes(_long_file())
+    mapping = {f'troop_{n}': f'veteran_{n}' for n in range(0, 40000, 8)}
+    started = time.perf_counter()
+    report = refactor_paths([str(source)], mapping=mapping, output_dir=str(tmp_path / 'out'), max_workers=1)
+    assert report['exit_code'] == 0
+    assert time.perf_counter() - started < 20 # Quadratic ordinal lookups took minutes here
+    assert report['files'][0]['output'] == OUTPUT_SPLICED
+    def renamed(match):
+        old_id = match.group(2).decode()
+        return b'"' + match.group(1) + mapping.get(old_id, old_id).encode() + b'"'
+    expected = re.sub(rb'"(NPCCharacter\.|)(troop_\d+)"', renamed, _long_file())
+    assert (tmp_path / 'out' / 'spnpccharacters.xml').read_bytes() == expected
+
+def test_streamed_and_parsed_renames_write_the_same_files(module_dir, tmp_path):
+    outputs = {}
+    for streaming in (False, True):
+        output_dir = tmp_path / f'out_{streaming}'
+        report = refactor_paths([str(module_dir)], pattern='imperial_', replacement='roman_', output_dir=str(output_dir),
+                                copy_unchanged=True, streaming=streaming, max_workers=2)
+        assert report['exit_code'] == 0 and report['changes']
+        outputs[streaming] = ({file_name: (output_dir / file_name).read_bytes() for file_name in MODULE_FILES}, report['changes'])
+    assert outputs[True] == outputs[False]
+
+def test_output_cache_rerenders_only_edited_files(module_files):
+    xml_data, index = load_module(module_files)
+    journal, cache = ChangeJournal(), OutputCache()
+    first = cache.render(list(module_files), xml_data, module_files, index, journal)
+    assert {file_name: status for file_name, (_, status) in first.items()} == dict.fromkeys(module_files, OUTPUT_ORIGINAL)
+    zip_bytes = cache.get_zip(first)
+    assert cache.get_zip(cache.render(list(module_files), xml_data, module_files, index, journal)) is zip_bytes
+
+    change_set = []
+    perform_batch_refactor({'vlandia': 'vakken'}, xml_data, index.definitions, index.references, change_set, index.values)
+    index.apply_changes(change_set)
+    journal.record('rename', change_set)
+    second = cache.render(list(module_files), xml_data, module_files, index, journal)
+    edited = {'spcultures.xml', 'troops.xml'}
+    assert {file_name for file_name, (_, status) in second.items() if status == OUTPUT_SPLICED} == edited
+    assert all(second[file_name][0] is first[file_name][0] for file_name in set(module_files) - edited)
+    assert cache.get_zip(second) is not zip_bytes
+
+def test_zip_options(module_files):
+    outputs = {file_name: (content, OUTPUT_ORIGINAL) for file_name, content in module_files.items()}
+    outputs['troops.xml'] = (module_files['troops.xml'].replace(b'vlandian_recruit', b'vakken_recruit'), OUTPUT_SPLICED)
+    def entries(zip_bytes):
+        with zipfile.ZipFile(BytesIO(zip_bytes)) as zip_file:
+            return {info.filename: (info.compress_type, zip_file.read(info)) for info in zip_file.infolist()}
+    default = entries(create_zip(outputs))
+    assert {file_name: content for file_name, (_, content) in default.items()} == {file_name: content for file_name, (content, _) in outputs.items()}
+    assert {file_name for file_name, (compress_type, _) in default.items() if compress_type == zipfile.ZIP_DEFLATED} == {'troops.xml'}
+    assert all(compress_type == zipfile.ZIP_DEFLATED for compress_type, _ in entries(create_zip(outputs, compress_untouched=True)).values())
+    assert all(compress_type == zipfile.ZIP_STORED for compress_type, _ in entries(create_zip(outputs, compresslevel=0)).values())
+    assert set(entries(create_zip(outputs, changed_only=True))) == {'troops.xml'}
@@ -0,0 +1,13 @@
+"""Index shards: the DOM and the streaming indexer must agree element for element."""
+from xml_refactor.parsing import MAX_SOURCELINE, index_tree, parse_xml_bytes, stream_index_file
+
+def test_streamed_shard_matches_dom_shard_past_sourceline_cap():
+    lines = ['<?xml version="1.0" encoding="utf-8"?>', '<Module>', '  <!-- troops -->']
+    lines += [f'  <NPCCharacter id="troop_{n}" culture="Culture.empire" />' for n in range(70000)]
+    lines += ['  <Culture id="empire" basic_troop="NPCCharacter.troop_69999" /><Culture id="vlandia" />', '</Module>\n']
+    content = '\n'.join(lines).encode('utf-8')
+    dom_shard = index_tree('module.xml', parse_xml_bytes(content), content)
+    streamed_shard = stream_index_file('module.xml', content)
+    for field in ('definitions', 'references', 'values', 'lines', 'tag_starts'):
+        assert getattr(streamed_shard, field) == getattr(dom_shard, field), field
+    assert streamed_shard.lines[-1] == MAX_SOURCELINE
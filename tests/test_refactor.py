@@ -0,0 +1,51 @@
+"""Rename mappings: parsing and conflict checks."""
+from xml_refactor import find_rename_conflicts, load_xml_files, parse_rename_mapping, plan_pattern_rename
+
+def test_mapping_formats_parse_alike():
+    expected = {'imperial_recruit': 'imperial_levy', 'empire': 'vakken'}
+    for text in ('{"imperial_recruit": "imperial_levy", "empire": "vakken"}',
+                 '[["imperial_recruit", "imperial_levy"], ["empire", "vakken"]]',
+                 'old,new\nimperial_recruit,imperial_levy\n# comment\n\nempire -> vakken',
+                 'imperial_recruit\timperial_levy\n"empire","vakken"'):
+        assert parse_rename_mapping(text) == (expected, []), text
+
+def test_invalid_json_entries_are_input_errors():
+    for text in ('["ab", "cd"]', '[["a", "b", "c"]]', '[["a", 1]]', '[1]', '{"a": null}'):
+        mapping, errors = parse_rename_mapping(text)
+        assert mapping == {} and len(errors) >= 1 and errors[0].startswith("Invalid mapping entry"), text
+    assert parse_rename_mapping('[["a", "b"], "cd"]') == ({'a': 'b'}, ["Invalid mapping entry 'cd': expected a pair of ID strings."])
+    assert parse_rename_mapping('{"a": "b"')[1][0].startswith("Invalid JSON mapping")
+
+def test_conflicting_mappings_are_reported(module_files):
+    _, index, _ = load_xml_files(module_files)
+    definitions = index.definitions
+    assert find_rename_conflicts({'empire': 'vakken', 'vlandia': 'sturgia'}, definitions) == []
+    assert find_rename_conflicts({'empire': 'vlandia', 'vlandia': 'empire'}, definitions) == [
+        "Swap: 'empire' <-> 'vlandia'. Rename through a temporary ID instead."]
+    assert find_rename_conflicts({'empire': 'vakken', 'vakken': 'sturgia'}, definitions) == [
+        "Chained rename: 'empire' -> 'vakken' -> 'sturgia'. Map 'empire' to the final ID directly."]
+    assert find_rename_conflicts({'empire': 'vakken', 'vlandia': 'vakken'}, definitions) == [
+        "'empire' and 'vlandia' are both mapped to 'vakken'."]
+    assert find_rename_conflicts({'imperial_recruit': 'vlandian_recruit'}, definitions) == [
+        "New ID 'vlandian_recruit' (for 'imperial_recruit') is already defined in 'troops.xml'."]
+    assert find_rename_conflicts({'empire': 'empire', 'vlandia': ''}, definitions) == [
+        "'empire' is mapped to itself.", "Empty ID in mapping 'vlandia' -> ''."]
+    assert find_rename_conflicts({'empire': 'bad\x01id'}, definitions) == [
+        "New ID 'bad\\x01id' (for 'empire') contains characters XML cannot hold."]
+
+def test_regex_pattern_rename_plans_matching_ids(module_files):
+    _, index, _ = load_xml_files(module_files)
+    mapping, preview, errors = plan_pattern_rename(r'^imperial_(\w+)_recruit$', r'roman_\1_levy', index.definitions, index.references)
+    assert errors == [] and mapping == {'imperial_vigla_recruit': 'roman_vigla_levy'}
+    assert preview == [{'old_id': 'imperial_vigla_recruit', 'new_id': 'roman_vigla_levy', 'defined_in': 'troops.xml', 'references': 1}]
+    mapping, _, _ = plan_pattern_rename('empire', 'vakken', index.definitions, index.references)
+    assert mapping == {'empire': 'vakken', 'kingdom_hero_party_empire_template': 'kingdom_hero_party_vakken_template',
+                       'spc_empire_lord_template': 'spc_vakken_lord_template', 'villager_empire': 'villager_vakken'}
+    # IDs defined in read-only files are left alone
+    mapping, _, _ = plan_pattern_rename('^imperial_', 'roman_', index.definitions, index.references, read_only_files={'troops.xml'})
+    assert mapping == {'imperial_sword': 'roman_sword'}
+
+def test_invalid_regex_patterns_are_errors(module_files):
+    _, index, _ = load_xml_files(module_files)
+    assert plan_pattern_rename('(', 'x', index.definitions, index.references)[2][0].startswith("Invalid regular expression '('")
+    assert plan_pattern_rename('empire', r'\2', index.definitions, index.references)[2][0].startswith(r"Invalid replacement '\2'")
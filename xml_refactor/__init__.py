@@ -0,0 +1,82 @@
+"""UI-free core of the Bannerlord XML ID refactor tool.
+
+The Streamlit app (xml_refactor_tool.py) and the command line (python -m xml_refactor) are
+thin front ends over these functions. Messages go through the reporter installed with
+set_reporter() instead of a UI, and per-stage timings to the profiler installed with
+set_profiler(). Long operations can run as background Jobs (see JobRunner), which report
+progress and can be cancelled.
+"""
+from .reporting import (
+    INFO, WARNING, ERROR,
+    Reporter, LoggingReporter, StreamReporter, CollectingReporter, get_reporter, set_reporter,
+)
+from .jobs import (
+    JOB_PENDING, JOB_RUNNING, JOB_DONE, JOB_FAILED, JOB_CANCELLED, JobCancelled, Job, JobRunner,
+    current_job, report_progress,
+)
+from .profiling import (
+    Profiler, CollectingProfiler, JsonLinesProfiler, get_profiler, set_profiler, stage, summarize_stages,
+)
+from .classification import (
+    REFERENCE_ATTRIBUTES, EQUIPMENT_TAGS, ATTR_NOT_REFERENCE, ATTR_DEFINITION, ATTR_REFERENCE,
+    split_prefixed_value, is_likely_reference, value_index_key, classify_attribute, index_attribute,
+)
+from .parsing import (
+    IndexShard, Definition, Reference, parse_xml_bytes, describe_parse_error, parse_xml, scan_start_tags,
+    index_tree, stream_index_file, merge_shard, bind_elements, find_ids,
+)
+from .index import AttributeChange, ChainedList, ElementInsertion, OverlayMap, ReferenceIndex
+from .loading import (
+    SHARD_CACHE_VERSION, PARSE_CACHE_DIR, PARALLEL_MIN_FILES, BASE_GAME_DIR, BaseCorpus, ParseCache,
+    content_hash, load_xml_files, read_file_bytes, list_xml_files, read_xml_directory,
+    materialize_files, rebuild_index, build_base_corpus,
+)
+from .integrity import NO_PREFIX, check_integrity, new_dangling_references
+from .graph import ReferenceGraph, definition_id
+from .browse import ReferenceBrowser, group_references_by_file
+from .journal import ChangeJournal, apply_attribute_changes, apply_insertions, invert_changes
+from .refactor import (
+    perform_refactor, find_rename_conflicts, find_read_only_conflicts, perform_batch_refactor,
+    plan_pattern_rename, parse_rename_mapping, describe_changes,
+)
+from .clone import CLONE_TAGS, clone_id, plan_clone, copy_clone_elements, apply_clone
+from .output import (
+    SPLICE_ENCODINGS, OUTPUT_ORIGINAL, OUTPUT_SPLICED, OUTPUT_RESERIALIZED, OutputCache,
+    serialize_tree, element_ordinals, locate_attribute_value,
+    splice_attribute_edits, splice_element_insertions, render_output_file, render_output_files, create_zip,
+)
+from .batch import (
+    EXIT_OK, EXIT_CONFLICT, EXIT_INPUT_ERROR, EXIT_WRITE_ERROR,
+    read_xml_paths, write_output_file, refactor_paths,
+)
+
+__all__ = [
+    'INFO', 'WARNING', 'ERROR', 'Reporter', 'LoggingReporter', 'StreamReporter',
+    'CollectingReporter', 'get_reporter', 'set_reporter',
+    'JOB_PENDING', 'JOB_RUNNING', 'JOB_DONE', 'JOB_FAILED', 'JOB_CANCELLED', 'JobCancelled', 'Job',
+    'JobRunner', 'current_job', 'report_progress',
+    'Profiler', 'CollectingProfiler', 'JsonLinesProfiler', 'get_profiler', 'set_profiler', 'stage',
+    'summarize_stages',
+    'REFERENCE_ATTRIBUTES', 'EQUIPMENT_TAGS', 'ATTR_NOT_REFERENCE', 'ATTR_DEFINITION',
+    'ATTR_REFERENCE', 'split_prefixed_value', 'is_likely_reference', 'value_index_key',
+    'classify_attribute', 'index_attribute',
+    'IndexShard', 'Definition', 'Reference', 'parse_xml_bytes', 'describe_parse_error', 'parse_xml',
+    'scan_start_tags', 'index_tree', 'stream_index_file', 'merge_shard', 'bind_elements',
+    'find_ids',
+    'AttributeChange', 'ChainedList', 'ElementInsertion', 'OverlayMap', 'ReferenceIndex',
+    'SHARD_CACHE_VERSION', 'PARSE_CACHE_DIR', 'PARALLEL_MIN_FILES', 'BASE_GAME_DIR', 'BaseCorpus',
+    'ParseCache', 'content_hash', 'load_xml_files', 'read_file_bytes', 'list_xml_files',
+    'read_xml_directory', 'materialize_files', 'rebuild_index', 'build_base_corpus',
+    'NO_PREFIX', 'check_integrity', 'new_dangling_references',
+    'ReferenceGraph', 'definition_id',
+    'ReferenceBrowser', 'group_references_by_file',
+    'ChangeJournal', 'apply_attribute_changes', 'apply_insertions', 'invert_changes',
+    'perform_refactor', 'find_rename_conflicts', 'find_read_only_conflicts',
+    'perform_batch_refactor', 'plan_pattern_rename', 'parse_rename_mapping', 'describe_changes',
+    'CLONE_TAGS', 'clone_id', 'plan_clone', 'copy_clone_elements', 'apply_clone',
+    'SPLICE_ENCODINGS', 'OUTPUT_ORIGINAL', 'OUTPUT_SPLICED', 'OUTPUT_RESERIALIZED', 'OutputCache',
+    'serialize_tree', 'element_ordinals', 'locate_attribute_value', 'splice_attribute_edits',
+    'splice_element_insertions', 'render_output_file', 'render_output_files', 'create_zip',
+    'EXIT_OK', 'EXIT_CONFLICT', 'EXIT_INPUT_ERROR', 'EXIT_WRITE_ERROR', 'read_xml_paths',
+    'write_output_file', 'refactor_paths',
+]
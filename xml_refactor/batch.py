@@ -0,0 +1,180 @@
+"""Headless batch refactors of XML files on disk: the library entry point behind the CLI."""
+import os
+import mmap
+
+from .integrity import NO_PREFIX, check_integrity, new_dangling_references
+from .journal import ChangeJournal, apply_attribute_changes
+from .loading import build_base_corpus, list_xml_files, load_xml_files, materialize_files, read_file_bytes
+from .output import OUTPUT_ORIGINAL, render_output_file
+from .profiling import CollectingProfiler, set_profiler, stage
+from .refactor import describe_changes, find_read_only_conflicts, find_rename_conflicts, perform_batch_refactor, plan_pattern_rename
+from .reporting import ERROR, CollectingReporter, set_reporter
+
+# Exit codes of refactor_paths() and the CLI (2 is left to argparse usage errors)
+EXIT_OK = 0          # Renamed (or previewed with dry_run), or nothing to rename
+EXIT_CONFLICT = 1    # Mapping conflicts or read-only base files in the way: nothing written
+EXIT_INPUT_ERROR = 3 # Unreadable or unparsable input, invalid mapping or pattern, failed rename: nothing written
+EXIT_WRITE_ERROR = 4 # Some output files could not be written
+
+def read_xml_paths(paths, use_mmap=True):
+    """Reads XML files and directories of XML files (searched recursively).
+
+    Files in a directory are named by their path relative to it, files given directly by their
+    base name. Returns ({file_name: contents}, {file_name: path}, errors).
+    """
+    file_contents, source_paths, errors = {}, {}, []
+    for path in paths:
+        if os.path.isdir(path): found = list_xml_files(path)
+        elif os.path.isfile(path): found = [(os.path.basename(path), path)]
+        else:
+            errors.append(f"No such file or directory: '{path}'.")
+            continue
+        for file_name, file_path in found:
+            if file_name in source_paths:
+                errors.append(f"'{file_path}' and '{source_paths[file_name]}' would both be written as '{file_name}'.")
+                continue
+            try:
+                file_contents[file_name] = read_file_bytes(file_path, use_mmap)
+                source_paths[file_name] = file_path
+            except OSError as e:
+                errors.append(f"Cannot read '{file_path}': {e}")
+    return file_contents, source_paths, errors
+
+def write_output_file(path, content):
+    """Writes content to path through a temporary file, so readers (or a crash) never see a partial file."""
+    directory = os.path.dirname(path)
+    if directory: os.makedirs(directory, exist_ok=True)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f: f.write(content)
+    os.replace(temp_path, path)
+
+def _close_mapped(file_contents):
+    for content in file_contents.values():
+        if isinstance(content, mmap.mmap): content.close()
+
+def refactor_paths(paths, mapping=None, pattern=None, replacement='', pattern_mode='prefix',
+                   output_dir=None, in_place=False, dry_run=False, copy_unchanged=False,
+                   base_dir=None, streaming=False, max_workers=None, use_mmap=True, reporter=None, profiler=None):
+    """Renames IDs in the XML files of paths and writes the edited files.
+
+    The renames are an old->new mapping of base IDs, or a pattern rename (pattern_mode 'prefix'
+    or 'regex', see plan_pattern_rename). Files are written to output_dir (keeping their
+    relative names; copy_unchanged also copies the untouched ones) or in_place; with dry_run
+    nothing is written. Files below base_dir are indexed as a read-only base corpus. The index
+    is checked with check_integrity() after loading and again after the rename; references the
+    rename left dangling are warned about and listed under 'new_dangling'.
+    Messages go to reporter and stage records (see profiling.stage) to profiler; both are also
+    collected for the report.
+
+    Returns a JSON-serializable report dict; its 'exit_code' is one of the EXIT_* codes.
+    """
+    collector = CollectingReporter(forward_to=reporter)
+    previous_reporter = set_reporter(collector)
+    stage_collector = CollectingProfiler(trace_memory=profiler.trace_memory if profiler else False, forward_to=profiler)
+    previous_profiler = set_profiler(stage_collector)
+    report = {
+        'status': 'ok', 'exit_code': EXIT_OK, 'dry_run': dry_run,
+        'files_loaded': 0, 'mapping': {}, 'errors': [], 'conflicts': [],
+        'changes': [], 'files': [], 'log': [], 'messages': [], 'stages': [],
+        'integrity': None, 'new_dangling': [],
+    }
+    def finish(status, exit_code):
+        report['status'], report['exit_code'] = status, exit_code
+        report['messages'] = [{'level': level, 'message': message} for level, message in collector.messages]
+        report['stages'] = stage_collector.records
+        return report
+
+    file_contents = {}
+    try:
+        if (mapping is None) == (pattern is None):
+            report['errors'].append("Give either a rename mapping or a pattern.")
+            return finish('input_error', EXIT_INPUT_ERROR)
+        if not dry_run and bool(output_dir) == bool(in_place):
+            report['errors'].append("Give either an output directory or in_place (or use dry_run).")
+            return finish('input_error', EXIT_INPUT_ERROR)
+
+        with stage('read', paths=len(paths), mmap=use_mmap) as counts:
+            file_contents, source_paths, read_errors = read_xml_paths(paths, use_mmap)
+            counts['files'] = len(file_contents)
+        report['errors'].extend(read_errors)
+        if not file_contents and not read_errors: report['errors'].append("No XML files found.")
+        if report['errors']: return finish('input_error', EXIT_INPUT_ERROR)
+
+        base_corpus = build_base_corpus(base_dir) if base_dir else None
+        read_only_files = base_corpus.file_names if base_corpus else frozenset()
+        if base_corpus:
+            for message in base_corpus.errors: collector.warning(f"Base corpus: {message}")
+        xml_data, index, load_errors = load_xml_files(
+            file_contents, max_workers, streaming, base_index=base_corpus.index if base_corpus else None)
+        report['errors'].extend(load_errors)
+        report['files_loaded'] = len(file_contents) - len(load_errors)
+        if load_errors: return finish('input_error', EXIT_INPUT_ERROR)
+        report['integrity'] = check_integrity(index, read_only_files)
+
+        if pattern is not None:
+            mapping, _, pattern_errors = plan_pattern_rename(
+                pattern, replacement, index.definitions, index.references, pattern_mode, read_only_files)
+            report['errors'].extend(pattern_errors)
+            if pattern_errors: return finish('input_error', EXIT_INPUT_ERROR)
+        report['mapping'] = dict(mapping)
+        if not mapping: return finish('nothing_to_do', EXIT_OK)
+
+        report['conflicts'] = find_rename_conflicts(mapping, index.definitions) + find_read_only_conflicts(mapping, index, read_only_files)
+        if report['conflicts']: return finish('conflict', EXIT_CONFLICT)
+
+        materialize_errors = materialize_files(index.unbound_files_for(mapping), xml_data, index, file_contents)
+        report['errors'].extend(materialize_errors)
+        if materialize_errors: return finish('input_error', EXIT_INPUT_ERROR)
+        change_set = []
+        reported = len(collector.messages)
+        report['log'] = perform_batch_refactor(mapping, xml_data, index.definitions, index.references, change_set, index.values)
+        rename_errors = [message for level, message in collector.messages[reported:] if level == ERROR]
+        if rename_errors: # Attributes that could not be set: write nothing rather than a partial rename
+            apply_attribute_changes(change_set, reverse=True)
+            report['errors'].extend(rename_errors)
+            return finish('rename_error', EXIT_INPUT_ERROR)
+        index.apply_changes(change_set)
+        integrity_before, report['integrity'] = report['integrity'], check_integrity(index, read_only_files)
+        report['new_dangling'] = [{'prefix': prefix, 'id': base_id, 'references': count}
+                                  for prefix, base_id, count in new_dangling_references(integrity_before, report['integrity'])]
+        for entry in report['new_dangling']:
+            prefix = entry['prefix'] if entry['prefix'] != NO_PREFIX else ''
+            collector.warning(f"The rename left {entry['references']} reference(s) to undefined '{prefix}{entry['id']}'.")
+        journal = ChangeJournal()
+        journal.record("batch", change_set)
+        report['changes'] = describe_changes(change_set)
+
+        # Render everything first: mmapped inputs are closed before any file is replaced
+        outputs = []
+        with stage('render', files=len(file_contents)):
+            for file_name in file_contents:
+                rendered = render_output_file(file_name, xml_data, file_contents, index, journal)
+                if rendered is None: continue
+                content, status = rendered
+                if status == OUTPUT_ORIGINAL:
+                    if not copy_unchanged or in_place: continue
+                    content = bytes(content)
+                outputs.append((file_name, content, status))
+        _close_mapped(file_contents)
+        edit_counts = {}
+        for change in change_set: edit_counts[change.file_name] = edit_counts.get(change.file_name, 0) + 1
+
+        write_failed = False
+        with stage('write', files=0 if dry_run else len(outputs), bytes=0 if dry_run else sum(len(output[1]) for output in outputs)):
+            for file_name, content, status in outputs:
+                entry = {'file': file_name, 'edits': edit_counts.get(file_name, 0), 'output': status, 'written_to': None}
+                if not dry_run:
+                    target = source_paths[file_name] if in_place else os.path.join(output_dir, *file_name.split('/'))
+                    try:
+                        write_output_file(target, content)
+                        entry['written_to'] = target
+                    except OSError as e:
+                        report['errors'].append(f"Cannot write '{target}': {e}")
+                        write_failed = True
+                report['files'].append(entry)
+        if write_failed: return finish('write_error', EXIT_WRITE_ERROR)
+        return finish('dry_run' if dry_run else 'ok', EXIT_OK)
+    finally:
+        _close_mapped(file_contents)
+        set_reporter(previous_reporter)
+        set_profiler(previous_profiler)
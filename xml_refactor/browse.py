@@ -0,0 +1,91 @@
+"""Browsing the references of one file from the index: facets, ID search and paging, no tree walks."""
+from bisect import bisect_left
+
+from lxml import etree
+
+from .index import OverlayMap
+from .integrity import NO_PREFIX
+from .profiling import stage
+
+def group_references_by_file(index):
+    """{file_name: [Reference, ...]} of the index's references, in one pass. With a base index
+    only the session layer is grouped: the read-only base files are not browsed."""
+    references = index.references.maps[0] if isinstance(index.references, OverlayMap) else index.references
+    by_file = {}
+    with stage('browse_group', references=0) as counts:
+        for ref_list in references.values():
+            for ref in ref_list: by_file.setdefault(ref['file_name'], []).append(ref)
+            counts['references'] += len(ref_list)
+    return by_file
+
+def _in_document_order(references):
+    """references ordered by their element's position in its tree, then by their attribute's
+    position in the element (one walk of the tree; lines cannot order elements sharing one).
+    References of unbound (streamed) files come last, by line."""
+    by_element, unbound = {}, []
+    for ref in references:
+        if ref['element'] is None: unbound.append(ref)
+        else: by_element.setdefault(ref['element'], []).append(ref)
+    ordered = []
+    if by_element:
+        root = next(iter(by_element)).getroottree().getroot()
+        for element in root.iter(etree.Element):
+            refs = by_element.get(element)
+            if refs is None: continue
+            if len(refs) > 1:
+                attribute_names = element.keys()
+                refs.sort(key=lambda ref: attribute_names.index(ref['attribute_name']))
+            ordered.extend(refs)
+    unbound.sort(key=lambda ref: ref.get('sourceline') or 0)
+    return ordered + unbound
+
+def _prefix_end(text):
+    """Smallest string greater than every string starting with text, for bisecting a prefix range."""
+    return text[:-1] + chr(ord(text[-1]) + 1)
+
+class ReferenceBrowser:
+    """The references of one file as rows, with indexes to filter them without rescanning.
+
+    rows are the file's References in document order; searches
+    return row numbers. Rows are filtered by tag, attribute and prefix through per-value row
+    lists, and by base ID prefix through a sorted key list (a flat trie: bisect finds the range
+    of IDs starting with the search text), or by substring of the attribute value.
+    """
+
+    def __init__(self, file_name, references):
+        self.file_name = file_name
+        with stage('browse_build', file=file_name, rows=len(references)):
+            self.rows = _in_document_order(references)
+            self.by_tag, self.by_attribute, self.by_prefix = {}, {}, {} # value -> ascending row numbers
+            for row, ref in enumerate(self.rows):
+                self.by_tag.setdefault(ref['element'].tag if ref['element'] is not None else '', []).append(row)
+                self.by_attribute.setdefault(ref['attribute_name'], []).append(row)
+                self.by_prefix.setdefault(ref['prefix'] or NO_PREFIX, []).append(row)
+            id_keys = sorted((ref['base_id'].lower(), row) for row, ref in enumerate(self.rows))
+            self._id_keys = [key for key, _ in id_keys]
+            self._id_rows = [row for _, row in id_keys]
+            self._values = None # Lowercased values, built by the first substring search
+
+    def search(self, tags=(), attributes=(), prefixes=(), text='', anywhere=False):
+        """Ascending row numbers of the rows matching every given filter (all rows without filters).
+
+        tags, attributes and prefixes each match any of their values (NO_PREFIX for references
+        without one). text matches the start of the base ID, case-insensitively, or with
+        anywhere=True any part of the attribute value.
+        """
+        matched = None
+        for selected, rows_by_value in ((tags, self.by_tag), (attributes, self.by_attribute), (prefixes, self.by_prefix)):
+            if not selected: continue
+            rows = set()
+            for value in selected: rows.update(rows_by_value.get(value, ()))
+            matched = rows if matched is None else matched & rows
+        text = text.strip().lower()
+        if text:
+            if anywhere:
+                if self._values is None: self._values = [ref['original_value'].lower() for ref in self.rows]
+                rows = set(row for row, value in enumerate(self._values) if text in value)
+            else:
+                start, end = bisect_left(self._id_keys, text), bisect_left(self._id_keys, _prefix_end(text))
+                rows = set(self._id_rows[start:end])
+            matched = rows if matched is None else matched & rows
+        return list(range(len(self.rows))) if matched is None else sorted(matched)
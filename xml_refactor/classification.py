@@ -0,0 +1,190 @@
+"""Which attributes define IDs and which reference them."""
+
+# --- Configuration ---
+# Common attributes that reference IDs (add more as needed)
+REFERENCE_ATTRIBUTES = {
+    # Attribute Name : Prefix (or None if just ID, or special marker)
+    "culture": "Culture.",
+    "faction": "Faction.",
+    "owner": "Hero.", # Can be Faction too, heuristic needed maybe - CURRENTLY ASSUMING HERO
+    "default_group": None, # Often refers to troop groups, might need prefix?
+    "occupation": None, # Sometimes links to Occupations enum, not necessarily an ID reference
+    "skill_template": "SkillSet.",
+    "is_template": None, # Boolean, ignore
+    "default_party_template": "PartyTemplate.",
+    "villager_party_template": "PartyTemplate.",
+    "caravan_party_template": "PartyTemplate.",
+    "elite_caravan_party_template": "PartyTemplate.",
+    "militia_party_template": "PartyTemplate.",
+    "rebels_party_template": "PartyTemplate.",
+    "vassal_reward_party_template": "PartyTemplate.",
+    "basic_troop": "NPCCharacter.",
+    "elite_basic_troop": "NPCCharacter.",
+    "melee_militia_troop": "NPCCharacter.",
+    "ranged_militia_troop": "NPCCharacter.",
+    "melee_elite_militia_troop": "NPCCharacter.",
+    "ranged_elite_militia_troop": "NPCCharacter.",
+    "tournament_master": "NPCCharacter.",
+    "villager": "NPCCharacter.",
+    "caravan_master": "NPCCharacter.",
+    "armed_trader": "NPCCharacter.",
+    "caravan_guard": "NPCCharacter.",
+    "veteran_caravan_guard": "NPCCharacter.",
+    "prison_guard": "NPCCharacter.",
+    "guard": "NPCCharacter.",
+    "blacksmith": "NPCCharacter.",
+    "weaponsmith": "NPCCharacter.",
+    "townswoman": "NPCCharacter.",
+    "townswoman_infant": "NPCCharacter.", # Added based on user XML
+    "townswoman_child": "NPCCharacter.",  # Added based on user XML
+    "townswoman_teenager": "NPCCharacter.",# Added based on user XML
+    "townsman": "NPCCharacter.",
+    "townsman_infant": "NPCCharacter.",   # Added based on user XML
+    "townsman_child": "NPCCharacter.",    # Added based on user XML
+    "townsman_teenager": "NPCCharacter.", # Added based on user XML
+    "village_woman": "NPCCharacter.",
+    "villager_male_child": "NPCCharacter.",# Added based on user XML (renamed from villager_child)
+    "villager_male_teenager": "NPCCharacter.",# Added based on user XML (renamed from villager_teenager)
+    "villager_female_child": "NPCCharacter.",# Added based on user XML (renamed from village_woman_child)
+    "villager_female_teenager": "NPCCharacter.",# Added based on user XML (renamed from village_woman_teenager)
+    "ransom_broker": "NPCCharacter.",
+    "gangleader_bodyguard": "NPCCharacter.",
+    "merchant_notary": "NPCCharacter.",
+    "artisan_notary": "NPCCharacter.",
+    "preacher_notary": "NPCCharacter.",
+    "rural_notable_notary": "NPCCharacter.",
+    "shop_worker": "NPCCharacter.",
+    "tavernkeeper": "NPCCharacter.",
+    "taverngamehost": "NPCCharacter.",
+    "musician": "NPCCharacter.",
+    "tavern_wench": "NPCCharacter.",
+    "armorer": "NPCCharacter.",
+    "horseMerchant": "NPCCharacter.",
+    "barber": "NPCCharacter.",
+    "merchant": "NPCCharacter.",
+    "beggar": "NPCCharacter.",
+    "female_beggar": "NPCCharacter.",
+    "female_dancer": "NPCCharacter.",
+    "gear_practice_dummy": "NPCCharacter.", # Added based on user XML
+    "weapon_practice_stage_1": "NPCCharacter.", # Added based on user XML
+    "weapon_practice_stage_2": "NPCCharacter.", # Added based on user XML
+    "weapon_practice_stage_3": "NPCCharacter.", # Added based on user XML
+    "gear_dummy": "NPCCharacter.", # Added based on user XML
+    "upgrade_target": "NPCCharacter.", # In troops.xml
+    "id": "EQUIPMENT_ITEM_ID", # Special case: 'id' on Equipment/equipment tags often reference Items
+    "slot": None, # Usually Item or Mount type, complex, ignore for now
+    "skill": "Skill.",
+    "lord_template": "NPCCharacter.", # In spcultures.xml lord_templates
+    "rebellion_hero_template": "NPCCharacter.", # In spcultures.xml rebellion_hero_templates
+    "tournament_team_template": "NPCCharacter.", # Patterns might be needed for specific tournament template IDs
+    "basic_mercenary_troop": "NPCCharacter.", # In spcultures.xml basic_mercenary_troops
+    "equipment_set": "EquipmentRoster.", # spnpccharacters, lords
+    "civilian_equipment_set": "EquipmentRoster.",
+    "battle_equipment_set": "EquipmentRoster.",
+    "civilian": "EquipmentRoster.", # Can also be EquipmentRoster ID apparently
+    "default_battle_equipment_roster": "EquipmentRoster.",
+    "default_civilian_equipment_roster": "EquipmentRoster.",
+    "duel_preset_equipment_roster": "EquipmentRoster.",
+    "banner_bearer_troop": "NPCCharacter.",
+    "formation": None, # Usually enum, ignore
+    "mount": "Item.", # Often references mount item ID
+    "harness": "Item.", # Often references harness item ID
+    "name": "TEMPLATE_REFERENCE", # Attributes like template="NPCCharacter.xyz" inside notable_and_wanderer_templates etc.
+    # Add more known reference attributes here based on testing
+}
+
+# Tags whose 'id' attribute points at an Item instead of defining a new ID
+EQUIPMENT_TAGS = ('Equipment', 'equipment')
+
+# --- Attribute Classification ---
+# Kinds returned by classify_attribute()
+ATTR_NOT_REFERENCE = 0
+ATTR_DEFINITION = 1
+ATTR_REFERENCE = 2
+
+# Compiled rule kinds (internal)
+_RULE_NONE = 0        # Never a reference
+_RULE_DEFINITION = 1  # Plain 'id' attribute defining an element
+_RULE_PREFIX = 2      # Configured prefix from REFERENCE_ATTRIBUTES, e.g. "NPCCharacter."
+_RULE_EQUIPMENT = 3   # 'id' on Equipment tags: Item reference with optional "Item." prefix
+_RULE_TEMPLATE = 4    # 'name' on template tags: any "Uppercase.base" value
+_RULE_DOTTED = 5      # Unconfigured attribute: "Xx.base" value with a multi-letter uppercase prefix
+
+_NOT_A_REFERENCE = (ATTR_NOT_REFERENCE, None, None)
+_ATTRIBUTE_RULES = {} # (tag, attribute_name) -> (rule_kind, configured_prefix, is_likely_reference)
+
+def _compile_rule(tag, attr_name):
+    """Derives the classification rule for one (tag, attribute) pair from REFERENCE_ATTRIBUTES."""
+    prefix_or_marker = REFERENCE_ATTRIBUTES.get(attr_name)
+    # The broad fallback only trusts un-prefixed values on these attributes
+    is_likely = attr_name in REFERENCE_ATTRIBUTES or \
+                (tag in EQUIPMENT_TAGS and attr_name == 'id') or \
+                (tag == 'template' and attr_name == 'name')
+    if attr_name == 'id':
+        kind = _RULE_EQUIPMENT if tag in EQUIPMENT_TAGS else _RULE_DEFINITION
+        return (kind, None, is_likely)
+    if isinstance(prefix_or_marker, str) and prefix_or_marker.endswith('.'):
+        return (_RULE_PREFIX, prefix_or_marker, is_likely)
+    if prefix_or_marker == 'TEMPLATE_REFERENCE':
+        return (_RULE_TEMPLATE if tag == 'template' else _RULE_NONE, None, is_likely)
+    if prefix_or_marker is None:
+        return (_RULE_DOTTED, None, is_likely)
+    return (_RULE_NONE, None, is_likely)
+
+def _get_rule(tag, attr_name):
+    """Returns the compiled rule for (tag, attribute), compiling it on first use."""
+    rule = _ATTRIBUTE_RULES.get((tag, attr_name))
+    if rule is None:
+        rule = _ATTRIBUTE_RULES[(tag, attr_name)] = _compile_rule(tag, attr_name)
+    return rule
+
+def split_prefixed_value(value):
+    """Splits 'Prefix.base' into ('Prefix.', 'base') when the prefix starts uppercase, else returns None."""
+    head, dot, tail = value.partition('.')
+    if dot and head and head[0].isupper():
+        return head + '.', tail
+    return None
+
+def is_likely_reference(tag, attr_name):
+    """True if an un-prefixed value on this (tag, attribute) is plausibly an ID reference."""
+    return _get_rule(tag, attr_name)[2]
+
+def value_index_key(tag, attr_name, value):
+    """Returns the base ID under which the broad fallback could match this value, or None.
+
+    'Prefix.base' values are keyed by 'base'; plain values only on likely reference attributes.
+    """
+    return index_attribute(tag, attr_name, value)[0]
+
+def classify_attribute(tag, attr_name, value):
+    """Classifies one attribute value.
+
+    Returns (kind, prefix, base_id) where kind is ATTR_DEFINITION, ATTR_REFERENCE or
+    ATTR_NOT_REFERENCE. Definitions use the full value as base_id (no prefix).
+    """
+    return index_attribute(tag, attr_name, value)[1:]
+
+def index_attribute(tag, attr_name, value):
+    """(value_index_key(...),) + classify_attribute(...) for one attribute, with a single rule
+    lookup and prefix split: the hot path of the indexers, and the one place the rules are applied."""
+    if not value: return (None,) + _NOT_A_REFERENCE
+    kind, configured_prefix, is_likely = _ATTRIBUTE_RULES.get((tag, attr_name)) or _get_rule(tag, attr_name)
+    if '.' in value:
+        split = split_prefixed_value(value)
+        value_key = split[1] if split else None
+    else:
+        split = None
+        value_key = value if is_likely else None
+    if kind == _RULE_PREFIX:
+        if value.startswith(configured_prefix) and len(value) > len(configured_prefix):
+            return (value_key, ATTR_REFERENCE, configured_prefix, value[len(configured_prefix):])
+    elif kind == _RULE_DEFINITION:
+        return (value_key, ATTR_DEFINITION, None, value)
+    elif kind == _RULE_EQUIPMENT:
+        if value.startswith("Item."):
+            return (value_key, ATTR_REFERENCE, "Item.", value[5:]) if len(value) > 5 else (value_key,) + _NOT_A_REFERENCE
+        return (value_key, ATTR_REFERENCE, None, value)
+    elif kind == _RULE_TEMPLATE or kind == _RULE_DOTTED:
+        if split and split[1] and (kind == _RULE_TEMPLATE or len(split[0]) > 2):
+            return (value_key, ATTR_REFERENCE, split[0], split[1])
+    return (value_key,) + _NOT_A_REFERENCE
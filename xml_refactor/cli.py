@@ -0,0 +1,121 @@
+"""Command line entry point: python -m xml_refactor PATH... --mapping FILE --output-dir DIR"""
+import argparse
+import json
+import sys
+
+from .batch import EXIT_INPUT_ERROR, refactor_paths
+from .loading import BASE_GAME_DIR
+from .profiling import JsonLinesProfiler
+from .refactor import parse_rename_mapping
+from .reporting import ERROR, INFO, WARNING, StreamReporter
+
+def positive_int(text):
+    """argparse type of counts such as --jobs: an integer of at least 1."""
+    try: value = int(text)
+    except ValueError: value = 0
+    if value < 1: raise argparse.ArgumentTypeError(f"expected a positive number, got '{text}'")
+    return value
+
+def build_parser():
+    # Invalid or conflicting option values raise ArgumentError, which main() reports as an input
+    # error (exit code 3); missing arguments remain argparse usage errors (exit code 2)
+    parser = argparse.ArgumentParser(
+        prog="python -m xml_refactor", exit_on_error=False,
+        description="Rename Bannerlord XML IDs (definitions and every reference) across a set of files.")
+    parser.add_argument('paths', nargs='+', metavar='PATH', help="XML files or directories (e.g. Modules/<Mod>/ModuleData), searched recursively.")
+    renames = parser.add_mutually_exclusive_group(required=True)
+    renames.add_argument('--mapping', metavar='FILE', help="Rename mapping: JSON object, or 'old,new' lines ('-' reads stdin).")
+    renames.add_argument('--rename', metavar='OLD=NEW', action='append', help="One rename; repeat for more.")
+    renames.add_argument('--prefix', nargs=2, metavar=('OLD', 'NEW'), help="Rename every ID starting with OLD to start with NEW instead.")
+    renames.add_argument('--regex', nargs=2, metavar=('PATTERN', 'REPLACEMENT'), help="Rename IDs by regex substitution (first match, \\1 groups allowed).")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--output-dir', metavar='DIR', help="Write the edited files below DIR, keeping their relative names.")
+    target.add_argument('--in-place', action='store_true', help="Overwrite the edited input files.")
+    target.add_argument('--dry-run', action='store_true', help="Only report what would change.")
+    parser.add_argument('--copy-unchanged', action='store_true', help="With --output-dir, also copy the files without edits.")
+    parser.add_argument('--base-dir', metavar='DIR', default=BASE_GAME_DIR,
+                        help="Game Modules directory indexed as read-only base corpus (default: $BANNERLORD_BASE_DIR).")
+    parser.add_argument('--report', metavar='FILE', help="Write the JSON report to FILE ('-' for stdout).")
+    parser.add_argument('--streaming', action='store_true', help="Index with iterparse and only load files a rename touches.")
+    parser.add_argument('--jobs', type=positive_int, metavar='N', help="Parallel workers for parsing/indexing (default: all cores).")
+    parser.add_argument('--no-mmap', dest='use_mmap', action='store_false', help="Read input files into memory instead of memory-mapping them.")
+    parser.add_argument('--profile', metavar='FILE', help="Write per-stage timings as JSON lines to FILE ('-' for stderr).")
+    parser.add_argument('--trace-memory', action='store_true', help="With --profile, also record each stage's peak Python allocation (slower).")
+    verbosity = parser.add_mutually_exclusive_group()
+    verbosity.add_argument('-q', '--quiet', action='store_true', help="Only print errors.")
+    verbosity.add_argument('-v', '--verbose', action='store_true', help="Also print info messages and every change.")
+    return parser
+
+def read_mapping(args):
+    """The old->new mapping given by --mapping or --rename, or (None, []) for pattern renames."""
+    if args.mapping:
+        try:
+            if args.mapping == '-': text = sys.stdin.read()
+            else:
+                with open(args.mapping, encoding='utf-8-sig') as f: text = f.read()
+        except OSError as e:
+            return None, [f"Cannot read mapping '{args.mapping}': {e}"]
+        return parse_rename_mapping(text)
+    if args.rename:
+        bad = [pair for pair in args.rename if '=' not in pair]
+        if bad: return None, [f"--rename expects OLD=NEW, got '{pair}'." for pair in bad]
+        return parse_rename_mapping('\n'.join(pair.replace('=', '\t', 1) for pair in args.rename))
+    return None, []
+
+def print_summary(report, verbose, stream):
+    if verbose:
+        for change in report['changes']:
+            print(f"{change['file']}:{change['line']}: {change['tag']}/@{change['attribute']}: '{change['old']}' -> '{change['new']}'", file=stream)
+    for conflict in report['conflicts']: print(f"conflict: {conflict}", file=stream)
+    integrity = report['integrity']
+    if integrity:
+        counts = integrity['counts']
+        print(f"integrity: {counts['dangling_references']} dangling references to {counts['dangling_ids']} undefined IDs"
+              f" ({', '.join(f'{prefix} {len(entries)}' for prefix, entries in integrity['dangling'].items()) or 'none'}),"
+              f" {counts['duplicates']} duplicate definitions, {counts['orphans']} unreferenced IDs.", file=stream)
+    for error in report['errors']: print(f"error: {error}", file=stream)
+    verb = "would change" if report['dry_run'] else "changed"
+    print(f"{report['status']}: {len(report['mapping'])} IDs, {len(report['changes'])} attribute edits, "
+          f"{verb} {sum(1 for entry in report['files'] if entry['edits'])} of {report['files_loaded']} files.", file=stream)
+
+def main(argv=None):
+    parser = build_parser()
+    try: args = parser.parse_args(argv)
+    except argparse.ArgumentError as e:
+        print(f"{parser.prog}: error: {e}", file=sys.stderr)
+        return EXIT_INPUT_ERROR
+    reporter = StreamReporter(min_level=ERROR if args.quiet else INFO if args.verbose else WARNING)
+    mapping, mapping_errors = read_mapping(args)
+    if mapping_errors:
+        for message in mapping_errors: print(f"error: {message}", file=sys.stderr)
+        return EXIT_INPUT_ERROR
+    pattern, replacement, pattern_mode = None, '', 'prefix'
+    if args.prefix: pattern, replacement = args.prefix
+    elif args.regex: (pattern, replacement), pattern_mode = args.regex, 'regex'
+
+    # Both outputs are opened before anything is renamed, so a bad path fails with no files written
+    profile_file = report_file = None
+    try:
+        if args.profile and args.profile != '-': profile_file = open(args.profile, 'w', encoding='utf-8')
+        if args.report and args.report != '-': report_file = open(args.report, 'w', encoding='utf-8')
+    except OSError as e:
+        if profile_file: profile_file.close()
+        print(f"error: Cannot write '{e.filename}': {e.strerror}", file=sys.stderr)
+        return EXIT_INPUT_ERROR
+    profiler = JsonLinesProfiler(profile_file, args.trace_memory) if args.profile else None
+    try:
+        report = refactor_paths(
+            args.paths, mapping=mapping, pattern=pattern, replacement=replacement, pattern_mode=pattern_mode,
+            output_dir=args.output_dir, in_place=args.in_place, dry_run=args.dry_run, copy_unchanged=args.copy_unchanged,
+            base_dir=args.base_dir, streaming=args.streaming, max_workers=args.jobs, use_mmap=args.use_mmap,
+            reporter=reporter, profiler=profiler)
+        if args.report == '-':
+            json.dump(report, sys.stdout, indent=2)
+            sys.stdout.write('\n')
+        elif report_file:
+            json.dump(report, report_file, indent=2)
+    finally:
+        if profile_file: profile_file.close()
+        if report_file: report_file.close()
+    if not args.quiet or report['exit_code']: print_summary(report, args.verbose, sys.stderr)
+    return report['exit_code']
@@ -0,0 +1,170 @@
+"""Cloning a definition with its dependency closure under new IDs, e.g. a new culture from empire."""
+import copy
+import re
+from collections import deque
+
+from lxml import etree
+
+from .classification import value_index_key
+from .graph import definition_id
+from .index import ElementInsertion
+from .jobs import report_progress
+from .profiling import stage
+from .refactor import find_rename_conflicts
+
+# Definition tags a clone copies when the closure reaches them (the root is copied whatever its tag).
+# Cultures are not followed, so a troop upgrading into another culture's tree does not clone that culture.
+CLONE_TAGS = ('NPCCharacter', 'EquipmentRoster', 'MBPartyTemplate')
+
+def clone_id(base_id, root_id, new_root_id, compiled_pattern=None, replacement=''):
+    """New ID of base_id in a clone of root_id as new_root_id.
+
+    The first match of compiled_pattern (if given) is substituted with replacement; otherwise the
+    first occurrence of root_id is replaced, e.g. 'empire_recruit' -> 'vakken_recruit'; IDs without
+    either get new_root_id as a prefix, e.g. 'imperial_recruit' -> 'vakken_imperial_recruit'.
+    """
+    if base_id == root_id: return new_root_id
+    if compiled_pattern is not None and compiled_pattern.search(base_id): return compiled_pattern.sub(replacement, base_id, count=1)
+    if root_id in base_id: return base_id.replace(root_id, new_root_id, 1)
+    return f"{new_root_id}_{base_id}"
+
+def _clone_target(def_info, xml_data, read_only_files, new_files):
+    """File the copy of a definition goes to: its own file, unless that is read-only; then the first
+    editable loaded file with the same root tag, else a new file (added to new_files)."""
+    file_name = def_info['file_name']
+    if file_name not in read_only_files: return file_name
+    root_tag = def_info['element'].getroottree().getroot().tag
+    for target_name, tree in xml_data.items():
+        if tree is not None and target_name not in read_only_files and tree.getroot().tag == root_tag: return target_name
+    for target_name, target_tag in new_files.items():
+        if target_tag == root_tag: return target_name
+    target_name = file_name.rsplit('/', 1)[-1]
+    while target_name in xml_data or target_name in new_files or target_name in read_only_files: target_name = f"clone_{target_name}"
+    new_files[target_name] = root_tag
+    return target_name
+
+def plan_clone(root_id, new_root_id, xml_data, index, graph, pattern=None, replacement='', tags=CLONE_TAGS, read_only_files=frozenset()):
+    """Resolves a clone of root_id's definition and its dependency closure (no tree is modified).
+
+    Walks graph (a ReferenceGraph) from root_id through the definitions whose tag is in tags;
+    each reached element is copied with its subtree, so nested definitions (equipment sets) are
+    copied along. Every definition in the copies gets a new ID (see clone_id; pattern is a regex).
+    Returns a plan dict:
+      'mapping':       {old base ID: new base ID}
+      'elements':      [(base_id, def_info, target_file)] top-level elements to copy
+      'preview':       one row per renamed ID with its tag and source and target files
+      'new_files':     {file_name: root tag} files the clone creates (for read-only sources)
+      'unbound_files': streamed files the walk reached; materialize them and plan again
+      'errors':        conflicts and invalid input; apply_clone() must not be called if any
+    """
+    plan = {'mapping': {}, 'elements': [], 'preview': [], 'new_files': {}, 'unbound_files': set(), 'errors': []}
+    if not root_id or not new_root_id:
+        plan['errors'].append("Give the ID to clone and its new ID.")
+        return plan
+    if root_id not in index.definitions:
+        plan['errors'].append(f"'{root_id}' is not defined in any loaded file.")
+        return plan
+    compiled = None
+    if pattern:
+        try: compiled = re.compile(pattern)
+        except re.error as e:
+            plan['errors'].append(f"Invalid regular expression '{pattern}': {e}")
+            return plan
+
+    with stage('clone_plan', ids=0, elements=0) as counts:
+        selected = {} # base_id -> def_info, in walk order
+        queue, seen = deque([root_id]), {root_id}
+        while queue:
+            base_id = queue.popleft()
+            def_info = index.definitions.get(base_id)
+            if def_info is None: continue # Referenced but not defined: kept as is
+            if def_info['element'] is None:
+                plan['unbound_files'].add(def_info['file_name'])
+                continue
+            if base_id != root_id and def_info['element'].tag not in tags: continue
+            selected[base_id] = def_info
+            for used_id in sorted(graph.direct_uses(base_id)):
+                if used_id not in seen:
+                    seen.add(used_id)
+                    queue.append(used_id)
+        if plan['unbound_files']: return plan
+
+        selected_elements = set(def_info['element'] for def_info in selected.values())
+        mapping = plan['mapping']
+        for base_id, def_info in selected.items():
+            element = def_info['element']
+            if any(ancestor in selected_elements for ancestor in element.iterancestors()): continue # Copied with it
+            if element.getparent() is None:
+                plan['errors'].append(f"'{base_id}' is defined by the root element of '{def_info['file_name']}' and cannot be copied.")
+                continue
+            target_file = _clone_target(def_info, xml_data, read_only_files, plan['new_files'])
+            plan['elements'].append((base_id, def_info, target_file))
+            for nested in element.iter(etree.Element):
+                nested_id = definition_id(nested)
+                if nested_id is None or nested_id in mapping: continue
+                mapping[nested_id] = clone_id(nested_id, root_id, new_root_id, compiled, replacement)
+                plan['preview'].append({
+                    'old_id': nested_id, 'new_id': mapping[nested_id], 'tag': nested.tag,
+                    'from_file': def_info['file_name'], 'to_file': target_file,
+                })
+        counts['ids'], counts['elements'] = len(mapping), len(plan['elements'])
+    plan['errors'].extend(find_rename_conflicts(mapping, index.definitions))
+    return plan
+
+def _rewrite_ids(element, mapping):
+    """Points every definition and reference in element's subtree at the new IDs of mapping.
+    Returns the number of attributes changed."""
+    rewritten = 0
+    for nested in element.iter(etree.Element):
+        for attr_name, value in nested.attrib.items():
+            # Same matching as the broad rename: 'Prefix.base' anywhere, plain values on likely attributes
+            old_base_id = value_index_key(nested.tag, attr_name, value)
+            new_base_id = mapping.get(old_base_id) if old_base_id is not None else None
+            if new_base_id is None: continue
+            nested.set(attr_name, f"{value.split('.', 1)[0]}.{new_base_id}" if '.' in value else new_base_id)
+            rewritten += 1
+    return rewritten
+
+def copy_clone_elements(plan):
+    """Detached copies of the elements of a plan_clone() plan, in plan order, with every ID of
+    the mapping rewritten. Only reads the source trees, so it can run in a background job."""
+    copies = []
+    with stage('clone_copy', elements=len(plan['elements']), rewritten=0) as counts:
+        for done, (base_id, def_info, _) in enumerate(plan['elements']):
+            report_progress(done, len(plan['elements']), f"Copying '{base_id}'")
+            clone = copy.deepcopy(def_info['element'])
+            clone.tail = None
+            counts['rewritten'] += _rewrite_ids(clone, plan['mapping'])
+            copies.append(clone)
+    return copies
+
+def apply_clone(plan, xml_data, index, insertions=None, copies=None):
+    """Inserts copies of the elements of a plan_clone() plan into their target files, with every
+    ID of the mapping rewritten inside them, and indexes the copies in one batch.
+
+    copies are those of copy_clone_elements(plan), which is called if they are not given.
+    Files in plan['new_files'] are added to xml_data; the originals are not modified. Every
+    copy is appended to insertions (if given) as an ElementInsertion, for ChangeJournal.record()
+    or to roll back with apply_insertions(). Returns the change log.
+    """
+    log = []
+    if insertions is None: insertions = []
+    if copies is None: copies = copy_clone_elements(plan)
+    mapping = plan['mapping']
+    with stage('clone', elements=len(plan['elements']), ids=len(mapping)):
+        for file_name, root_tag in plan['new_files'].items():
+            xml_data[file_name] = etree.ElementTree(etree.Element(root_tag))
+            log.append(f"CREATED: '{file_name}' for copies of read-only definitions.")
+        inserted_by_file = {}
+        for (base_id, def_info, target_file), clone in zip(plan['elements'], copies):
+            element = def_info['element']
+            if target_file == def_info['file_name']: parent = element.getparent()
+            else: parent = xml_data[target_file].getroot()
+            insertion = ElementInsertion(target_file, clone, parent, len(parent))
+            parent.insert(insertion.position, clone)
+            insertions.append(insertion)
+            inserted_by_file.setdefault(target_file, []).append(clone)
+            log.append(f"CLONED: '{base_id}' ({element.tag}) from '{def_info['file_name']}' as '{mapping[base_id]}' in '{target_file}'.")
+        for file_name, elements in inserted_by_file.items(): index.add_elements(file_name, elements)
+    log.append(f"CLONE: {len(plan['elements'])} elements copied with {len(mapping)} new IDs.")
+    return log
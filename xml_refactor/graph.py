@@ -0,0 +1,130 @@
+"""Which defined IDs reference which: the dependency graph behind impact previews and cloning."""
+from bisect import bisect_right
+
+from .classification import ATTR_DEFINITION, classify_attribute, split_prefixed_value
+from .index import OverlayMap
+from .profiling import stage
+
+def _is_plain_id(value):
+    """False for id="Prefix.base" values, which reference base rather than define an ID."""
+    return not ('.' in value and split_prefixed_value(value))
+
+def definition_id(element):
+    """The base ID element defines, or None."""
+    value = element.get('id')
+    if not value or classify_attribute(element.tag, 'id', value)[0] != ATTR_DEFINITION: return None
+    return value if _is_plain_id(value) else None
+
+def _owner_id(element, owners):
+    """Base ID of the definition element belongs to: its own, else its nearest defining ancestor's."""
+    chain, owner = [], None
+    while element is not None:
+        if element in owners:
+            owner = owners[element]
+            break
+        chain.append(element)
+        owner = definition_id(element)
+        if owner is not None: break
+        element = element.getparent()
+    for visited in chain: owners[visited] = owner
+    return owner
+
+class ReferenceGraph:
+    """Directed graph of base IDs: A -> B if A's definition (its element or anything nested in it)
+    references B, or contains B's definition (e.g. an EquipmentSet inside an NPCCharacter).
+
+    Edges come from the indexed references and from id="Prefix.base" values (upgrade targets);
+    matches only the broad fallback would find are not edges. Streamed files that are not loaded
+    yet use the nesting recorded by the streaming indexer (without it, a reference is attributed
+    to the nearest definition above it in the file).
+    With a base graph (of the base corpus) only the session layer of the index is scanned and
+    queries fall through to the base graph, which is never modified.
+    """
+
+    def __init__(self, base=None):
+        self.uses = {}    # base_id -> set of base IDs it references or contains
+        self.used_by = {} # base_id -> set of base IDs referencing or containing it
+        self.base = base
+
+    @classmethod
+    def build(cls, index, base=None):
+        """Builds the graph of a ReferenceIndex in one pass over its references and definitions."""
+        graph = cls(base)
+        own = lambda mapping: mapping.maps[0] if base is not None and isinstance(mapping, OverlayMap) else mapping
+        with stage('graph') as counts:
+            owners = {} # element -> owning base ID, shared by all lookups
+            unbound_definitions = {} # file_name -> ([line, ...], [base_id, ...]) by line, for streamed files
+            for def_key, def_info in own(index.definitions).items():
+                if def_info['element'] is None and _is_plain_id(def_key):
+                    unbound_definitions.setdefault(def_info['file_name'], []).append((def_info['sourceline'], def_key))
+            for file_name, entries in unbound_definitions.items():
+                entries.sort()
+                unbound_definitions[file_name] = ([line for line, _ in entries], [def_key for _, def_key in entries])
+
+            def owner_of(info):
+                element = info['element']
+                if element is not None: return _owner_id(element, owners)
+                if 'owner' in info: return info['owner'] # Recorded by the streaming indexer
+                lines, def_keys = unbound_definitions.get(info['file_name'], ((), ()))
+                position = bisect_right(lines, info['sourceline'])
+                return def_keys[position - 1] if position else None
+
+            for base_id, ref_list in own(index.references).items():
+                for ref in ref_list:
+                    owner = owner_of(ref)
+                    if owner is not None and owner != base_id: graph.add_edge(owner, base_id)
+            for def_key, def_info in own(index.definitions).items():
+                for info in [def_info] + index.duplicates.get(def_key, []):
+                    element = info['element']
+                    split = split_prefixed_value(def_key) if '.' in def_key else None
+                    if split and split[1]: # id="Prefix.base" references base
+                        owner = _owner_id(element.getparent(), owners) if element is not None else owner_of(info)
+                        if owner is not None and owner != split[1]: graph.add_edge(owner, split[1])
+                    else: # Nested definition
+                        if element is not None: owner = _owner_id(element.getparent(), owners) if element.getparent() is not None else None
+                        else: owner = info.get('owner')
+                        if owner is not None and owner != def_key: graph.add_edge(owner, def_key)
+            counts['ids'] = len(graph.uses.keys() | graph.used_by.keys())
+            counts['edges'] = sum(map(len, graph.uses.values()))
+        return graph
+
+    def add_edge(self, from_id, to_id):
+        self.uses.setdefault(from_id, set()).add(to_id)
+        self.used_by.setdefault(to_id, set()).add(from_id)
+
+    def direct_uses(self, base_id):
+        """IDs base_id references or contains."""
+        found = self.uses.get(base_id, set())
+        return found | self.base.direct_uses(base_id) if self.base is not None else found
+
+    def direct_used_by(self, base_id):
+        """IDs referencing or containing base_id."""
+        found = self.used_by.get(base_id, set())
+        return found | self.base.direct_used_by(base_id) if self.base is not None else found
+
+    def _walk(self, start_ids, neighbours, max_depth):
+        depths = {base_id: 0 for base_id in start_ids}
+        frontier = list(depths)
+        depth = 0
+        while frontier and (max_depth is None or depth < max_depth):
+            depth += 1
+            next_frontier = []
+            for base_id in frontier:
+                for neighbour in neighbours(base_id):
+                    if neighbour not in depths:
+                        depths[neighbour] = depth
+                        next_frontier.append(neighbour)
+            frontier = next_frontier
+        for base_id in start_ids: del depths[base_id]
+        return depths
+
+    def dependencies(self, base_ids, max_depth=None):
+        """{base_id: distance} of everything base_ids use, directly or transitively (not base_ids themselves)."""
+        return self._walk(_as_ids(base_ids), self.direct_uses, max_depth)
+
+    def dependents(self, base_ids, max_depth=None):
+        """{base_id: distance} of everything that uses base_ids, directly or transitively."""
+        return self._walk(_as_ids(base_ids), self.direct_used_by, max_depth)
+
+def _as_ids(base_ids):
+    return [base_ids] if isinstance(base_ids, str) else list(dict.fromkeys(base_ids))
@@ -0,0 +1,208 @@
+"""The global definitions/references index and its incremental updates."""
+import sys
+from collections import namedtuple, ChainMap
+from collections.abc import Sequence
+from itertools import chain
+
+from lxml import etree
+
+from .classification import ATTR_DEFINITION, ATTR_REFERENCE, index_attribute
+from .parsing import Definition, Reference, bind_elements, find_ids, index_tree, merge_shard, parse_xml_bytes
+from .profiling import stage
+from .reporting import get_reporter
+
+# --- Reference Index ---
+# One attribute edit made by perform_refactor: enough to update the index (or undo the edit)
+AttributeChange = namedtuple('AttributeChange', ['file_name', 'element', 'attribute_name', 'old_value', 'new_value'])
+# One element (with its subtree) added to a tree by clone_definitions, at parent[position]
+ElementInsertion = namedtuple('ElementInsertion', ['file_name', 'element', 'parent', 'position'])
+
+class ChainedList(Sequence):
+    """Read-only view of a base list followed by the session's own entries (see OverlayMap)."""
+    __slots__ = ('base', 'own')
+
+    def __init__(self, base, own): self.base, self.own = base, own
+    def __len__(self): return len(self.base) + len(self.own)
+    def __iter__(self): return chain(self.base, self.own)
+    def __add__(self, other): return list(self) + list(other)
+    def __radd__(self, other): return list(other) + list(self)
+
+    def __getitem__(self, position):
+        if isinstance(position, slice): return list(self)[position]
+        if position < 0: position += len(self)
+        if not 0 <= position < len(self): raise IndexError(position)
+        return self.base[position] if position < len(self.base) else self.own[position - len(self.base)]
+
+class OverlayMap(ChainMap):
+    """A session layer over a shared, read-only index map (see build_base_corpus).
+
+    Reads fall through to the base map; writes and deletes only touch the session layer.
+    For a key in both, the session layer holds only the session's own list entries and reads
+    join them to the base list in a ChainedList, so a base list is never copied.
+    """
+
+    def __getitem__(self, key):
+        layer, base = self.maps[0], self.maps[1]
+        if key not in layer: return base[key]
+        if key in base and isinstance(layer[key], list): return ChainedList(base[key], layer[key])
+        return layer[key]
+
+    def setdefault(self, key, default=None):
+        """The session's own entries of key, for appending."""
+        layer = self.maps[0]
+        if key not in layer: layer[key] = default
+        return layer[key]
+
+def _filter_entries(mapping, key, keep):
+    """Drops the entries of mapping[key] failing keep. Of an OverlayMap only the session's own
+    entries are filtered: the base corpus is read-only, so none of its entries ever go."""
+    own = mapping.maps[0] if isinstance(mapping, OverlayMap) else mapping
+    entries = own.get(key)
+    if not entries: return
+    # Reassigned rather than filtered in place, so a list shared with a shard is never modified
+    kept = [entry for entry in entries if keep(entry)]
+    if not kept: del own[key]
+    elif len(kept) != len(entries): own[key] = kept
+
+class ReferenceIndex:
+    """Owns the global definitions/references and keeps them current from refactor change sets.
+
+    Built once with find_ids(); afterwards apply_changes() only touches the entries of the
+    edited attributes, so consecutive renames never rescan the trees. With a base index the
+    maps are OverlayMaps: the base entries are shared, never copied or modified.
+    Duplicate definitions are kept aside in duplicates (see check_integrity); if the definition
+    in use is renamed away, the next duplicate takes its place.
+    """
+
+    def __init__(self, definitions=None, references=None, values=None, base=None, duplicates=None):
+        self.definitions = definitions if definitions is not None else {} # base_id -> Definition
+        self.references = references if references is not None else {}  # base_id -> list of References
+        self.values = values if values is not None else {}                # value_index_key -> list of (file_name, element, attribute_name)
+        self.duplicates = duplicates if duplicates is not None else {}    # base_id -> list of shadowed Definitions
+        self.base = base
+        if base is not None:
+            self.definitions = OverlayMap(self.definitions, base.definitions)
+            self.references = OverlayMap(self.references, base.references)
+            self.values = OverlayMap(self.values, base.values)
+            self.duplicates = OverlayMap(self.duplicates, base.duplicates)
+        self.unbound = {} # file_name -> merge_shard bindings, for streamed files without a DOM yet
+        self.positions = {} # file_name -> tag_starts from its shard, for in-place output
+        self.revision = 0 # Bumped by every update, so views derived from the index know when to rebuild
+
+    @classmethod
+    def build(cls, xml_data, base=None):
+        """Builds an index with a full find_ids() scan of xml_data, layered over base if given."""
+        with stage('index', files=len(xml_data), rebuild=True):
+            if base is None:
+                values, duplicates = {}, {}
+                definitions, references = find_ids(xml_data, values, duplicates)
+                return cls(definitions, references, values, duplicates=duplicates)
+            index = cls(base=base) # Merged shard by shard so duplicates of base IDs are detected
+            for file_name, tree in xml_data.items():
+                if tree is None: continue
+                try:
+                    index.add_shard(index_tree(file_name, tree), tree)
+                except Exception as e:
+                     get_reporter().error(f"Error iterating elements in {file_name}: {e}")
+            return index
+
+    def add_shard(self, shard, tree=None):
+        """Merges one file's IndexShard, bound to its parsed tree.
+
+        Without a tree (streaming mode) the file is recorded as unbound until materialize().
+        """
+        bindings = merge_shard(shard, tree, self.definitions, self.references, self.values, self.duplicates)
+        self.revision += 1
+        if tree is None: self.unbound[shard.file_name] = bindings
+        if shard.tag_starts is not None: self.positions[shard.file_name] = shard.tag_starts
+
+    def unbound_files_for(self, base_ids):
+        """Names of unbound (streamed) files holding any definition or reference of base_ids."""
+        if not self.unbound: return set()
+        file_names = set()
+        for base_id in base_ids:
+            # The value index covers definitions, prefixed references and likely plain references
+            file_names.update(location[0] for location in self.values.get(base_id, ()))
+            def_info = self.definitions.get(base_id)
+            if def_info: file_names.add(def_info['file_name'])
+        return file_names & self.unbound.keys()
+
+    def materialize(self, file_name, content):
+        """Parses an unbound file's full DOM and binds its index entries. Returns the tree."""
+        tree = parse_xml_bytes(content)
+        bind_elements(self.unbound.pop(file_name), tree)
+        self.revision += 1
+        return tree
+
+    def apply_changes(self, change_set):
+        """Moves each changed attribute from its old-value entries to its new-value entries."""
+        self.revision += 1
+        with stage('reindex', changes=len(change_set)):
+            if len(set((change.element, change.attribute_name) for change in change_set)) != len(change_set):
+                # An attribute edited more than once: its moves must happen in order
+                for change in change_set:
+                    self._remove_entries([(change.element, change.attribute_name, change.old_value)])
+                    self._add_entry(change.file_name, change.element, change.attribute_name, change.new_value)
+                return
+            self._remove_entries([(change.element, change.attribute_name, change.old_value) for change in change_set])
+            for change in change_set: self._add_entry(change.file_name, change.element, change.attribute_name, change.new_value)
+
+    def add_elements(self, file_name, elements):
+        """Indexes every attribute of the subtrees of elements, newly inserted into file_name."""
+        self.revision += 1
+        with stage('reindex', elements=0) as counts:
+            for subtree in elements:
+                for element in subtree.iter(etree.Element):
+                    counts['elements'] += 1
+                    for attr_name, value in element.attrib.items(): self._add_entry(file_name, element, attr_name, value)
+
+    def remove_elements(self, file_name, elements):
+        """Drops the index entries of the subtrees of elements, about to be removed from file_name."""
+        self.revision += 1
+        with stage('reindex', elements=0) as counts:
+            entries = []
+            for subtree in elements:
+                for element in subtree.iter(etree.Element):
+                    counts['elements'] += 1
+                    entries.extend((element, attr_name, value) for attr_name, value in element.attrib.items())
+            self._remove_entries(entries)
+
+    def _remove_entries(self, entries):
+        """Drops the index entries of (element, attribute_name, value) triples. Each affected list is
+        filtered once, however many of its entries go (a rename can move thousands off one ID)."""
+        value_drops, reference_drops = {}, {}
+        for element, attr_name, value in entries:
+            value_key, kind, prefix, base_id = index_attribute(element.tag, attr_name, value)
+            if value_key is not None: value_drops.setdefault(value_key, set()).add((element, attr_name))
+            if kind == ATTR_DEFINITION: self._remove_definition(base_id, element)
+            elif kind == ATTR_REFERENCE: reference_drops.setdefault(base_id, set()).add((element, attr_name))
+        for value_key, dropped in value_drops.items():
+            _filter_entries(self.values, value_key, lambda loc: (loc[1], loc[2]) not in dropped)
+        for base_id, dropped in reference_drops.items():
+            _filter_entries(self.references, base_id, lambda ref: (ref['element'], ref['attribute_name']) not in dropped)
+
+    def _remove_definition(self, base_id, element):
+        def_info = self.definitions.get(base_id)
+        shadowed = self.duplicates.get(base_id)
+        if def_info is not None and def_info['element'] is element:
+            if shadowed: # The next duplicate becomes the definition in use
+                self.definitions[base_id] = shadowed[0]
+                if len(shadowed) > 1: self.duplicates[base_id] = shadowed[1:]
+                else: del self.duplicates[base_id]
+            else: del self.definitions[base_id]
+        elif shadowed:
+            _filter_entries(self.duplicates, base_id, lambda dup: dup['element'] is not element)
+
+    def _add_entry(self, file_name, element, attr_name, value):
+        value_key, kind, prefix, base_id = index_attribute(element.tag, attr_name, value)
+        if value_key is not None:
+            self.values.setdefault(value_key, []).append((file_name, element, attr_name))
+
+        if kind == ATTR_DEFINITION:
+            def_info = Definition(file_name, element)
+            if base_id in self.definitions: # Reported by check_integrity()
+                self.duplicates.setdefault(base_id, []).append(def_info)
+            else:
+                self.definitions[base_id] = def_info
+        elif kind == ATTR_REFERENCE:
+            self.references.setdefault(base_id, []).append(Reference(file_name, element, sys.intern(attr_name), prefix and sys.intern(prefix), base_id))
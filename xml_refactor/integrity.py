@@ -0,0 +1,73 @@
+"""Cross-file integrity of the index: dangling references, duplicate definitions and orphans."""
+from .classification import split_prefixed_value
+from .index import OverlayMap
+from .profiling import stage
+
+# Group of references written without a prefix (e.g. equipment ids)
+NO_PREFIX = '(no prefix)'
+
+def _own_entries(mapping):
+    """The session's own layer of an OverlayMap (the base corpus is checked once, by itself), else mapping."""
+    return mapping.maps[0] if isinstance(mapping, OverlayMap) else mapping
+
+def _location(info):
+    """(file_name, line) of a definition or reference dict, bound or not."""
+    element = info['element']
+    return info['file_name'], element.sourceline if element is not None else info.get('sourceline')
+
+def check_integrity(index, read_only_files=frozenset(), max_locations=20):
+    """Validates a ReferenceIndex in one sweep over the entries of the files outside read_only_files.
+
+    Returns a JSON-serializable dict:
+      'dangling':   {prefix: [{'id', 'references', 'locations'}]} references to base IDs no loaded
+                    file defines, grouped by reference prefix (NPCCharacter., Item., ...)
+      'duplicates': [{'id', 'locations'}] IDs defined more than once, the one in use first
+      'orphans':    [{'id', 'file', 'line'}] defined IDs nothing loaded refers to (the game
+                    itself may still use them)
+      'counts':     totals of the above
+    Locations are (file_name, line) pairs, at most max_locations per ID.
+    """
+    with stage('integrity') as counts:
+        definitions, references, values, duplicates = index.definitions, index.references, index.values, index.duplicates
+        dangling = {} # prefix -> base_id -> reference (or definition) dicts; located only when reported
+        for base_id, ref_list in _own_entries(references).items():
+            if base_id in definitions: continue
+            for ref in ref_list:
+                if read_only_files and ref['file_name'] in read_only_files: continue
+                dangling.setdefault(ref['prefix'] or NO_PREFIX, {}).setdefault(base_id, []).append(ref)
+
+        duplicate_list, orphans = [], []
+        for def_key, def_info in _own_entries(definitions).items():
+            infos = [def_info] + duplicates[def_key] if def_key in duplicates else [def_info]
+            split = split_prefixed_value(def_key) if '.' in def_key else None
+            if split and split[1]:
+                # id="Prefix.base" (e.g. on upgrade_target) points at base rather than defining an ID
+                if split[1] not in definitions:
+                    infos = [info for info in infos if not read_only_files or info['file_name'] not in read_only_files]
+                    if infos: dangling.setdefault(split[0], {}).setdefault(split[1], []).extend(infos)
+                continue
+            if read_only_files and all(info['file_name'] in read_only_files for info in infos): continue
+            if len(infos) > 1:
+                duplicate_list.append({'id': def_key, 'locations': [_location(info) for info in infos[:max_locations]]})
+            if references.get(def_key) or (read_only_files and def_info['file_name'] in read_only_files): continue
+            # The value index also holds the id attribute of each definition
+            if len(values.get(def_key, ())) > len(infos): continue
+            file_name, line = _location(def_info)
+            orphans.append({'id': def_key, 'file': file_name, 'line': line})
+
+        dangling = {prefix: [{'id': base_id, 'references': len(infos), 'locations': [_location(info) for info in infos[:max_locations]]}
+                             for base_id, infos in sorted(by_id.items())]
+                    for prefix, by_id in sorted(dangling.items())}
+        duplicate_list.sort(key=lambda entry: entry['id'])
+        orphans.sort(key=lambda entry: (entry['file'], entry['id']))
+        counts.update(
+            dangling_ids=sum(len(entries) for entries in dangling.values()),
+            dangling_references=sum(entry['references'] for entries in dangling.values() for entry in entries),
+            duplicates=len(duplicate_list), orphans=len(orphans))
+        return {'dangling': dangling, 'duplicates': duplicate_list, 'orphans': orphans, 'counts': dict(counts)}
+
+def new_dangling_references(before, after):
+    """(prefix, base_id, references) of the dangling entries in report after that are not in report before."""
+    known = set((prefix, entry['id']) for prefix, entries in before['dangling'].items() for entry in entries)
+    return [(prefix, entry['id'], entry['references']) for prefix, entries in after['dangling'].items()
+            for entry in entries if (prefix, entry['id']) not in known]
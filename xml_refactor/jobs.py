@@ -0,0 +1,125 @@
+"""Background jobs: long operations in worker threads, with progress and cancellation."""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Job states
+JOB_PENDING = 'pending'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+JOB_CANCELLED = 'cancelled'
+JOB_FINISHED = frozenset([JOB_DONE, JOB_FAILED, JOB_CANCELLED])
+
+class JobCancelled(BaseException):
+    """Raised by report_progress() in a cancelled job. A BaseException, so the core's
+    'except Exception' fallbacks (broken pools, per-file errors) do not swallow it."""
+
+class Job:
+    """One function running in a JobRunner worker thread.
+
+    status goes pending -> running -> done, failed or cancelled; result is the function's return
+    value and error the message of what it raised. progress is (done, total, message) as last
+    reported by the function (see report_progress()). records and messages collect the stage
+    records and reporter messages of the job's thread, for front ends whose profiler and
+    reporter only work in their own thread (see current_job()).
+    """
+
+    def __init__(self, label):
+        self.label = label
+        self.status = JOB_PENDING
+        self.progress = (0, None, None)
+        self.result = None
+        self.error = None
+        self.records = []
+        self.messages = []
+        self.started = self.finished_at = None
+        self._cancel_event = threading.Event()
+        self._finished_event = threading.Event()
+
+    @property
+    def finished(self):
+        return self.status in JOB_FINISHED
+
+    @property
+    def cancel_requested(self):
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        """Asks the job to stop at its next progress report (a pending job never starts)."""
+        self._cancel_event.set()
+
+    def wait(self, timeout=None):
+        """Blocks until the job has finished or timeout seconds have passed; returns finished."""
+        return self._finished_event.wait(timeout)
+
+    def fraction(self):
+        """Completed fraction (0.0-1.0) of the current step, or None if its size is unknown."""
+        done, total, _ = self.progress
+        return min(1.0, done / total) if total else None
+
+    def seconds(self):
+        """Run time so far (or in total, once finished)."""
+        if self.started is None: return 0.0
+        return (self.finished_at or time.perf_counter()) - self.started
+
+    def report(self, done, total=None, message=None):
+        if self._cancel_event.is_set(): raise JobCancelled(self.label)
+        self.progress = (done, total, message) # One assignment: readers never see a torn update
+
+    def run(self, fn, args, kwargs):
+        """Runs fn(*args, **kwargs) as this job, in the calling thread."""
+        if self._cancel_event.is_set():
+            self.status = JOB_CANCELLED
+            self._finished_event.set()
+            return
+        self.started = time.perf_counter()
+        self.status = JOB_RUNNING
+        _local.job = self
+        try:
+            self.result = fn(*args, **kwargs)
+            self.status = JOB_DONE
+        except JobCancelled:
+            self.status = JOB_CANCELLED
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            self.status = JOB_FAILED
+        finally:
+            _local.job = None
+            self.finished_at = time.perf_counter()
+            self._finished_event.set()
+
+class JobRunner:
+    """Runs Jobs in a pool of worker threads.
+
+    Threads rather than processes: jobs read the caller's live lxml trees and index, which
+    cannot be shipped to another process (load_xml_files() starts its own process pool).
+    """
+
+    def __init__(self, max_workers=4):
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix='xml_refactor_job')
+
+    def submit(self, label, fn, *args, **kwargs):
+        """Starts fn(*args, **kwargs) as a Job labelled label and returns the Job."""
+        job = Job(label)
+        job.future = self.executor.submit(job.run, fn, args, kwargs)
+        return job
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+_local = threading.local()
+
+def current_job():
+    """The Job running in this thread, or None outside jobs."""
+    return getattr(_local, 'job', None)
+
+def report_progress(done, total=None, message=None):
+    """Reports progress to the job running in this thread (a no-op outside jobs).
+
+    Long loops of the core call it once per file or ID; it raises JobCancelled there once the
+    job is cancelled. Work done until then (e.g. a change_set filled so far) is the caller's to
+    discard or roll back.
+    """
+    job = getattr(_local, 'job', None)
+    if job is not None: job.report(done, total, message)
@@ -0,0 +1,125 @@
+"""Undo/redo of applied refactors: attribute edits and inserted (cloned) elements."""
+
+# --- Change Journal ---
+def apply_attribute_changes(change_set, reverse=False):
+    """Writes the new values of change_set to their elements (or the old values, in reverse order, if reverse=True)."""
+    for change in (reversed(change_set) if reverse else change_set):
+        value = change.old_value if reverse else change.new_value
+        if value is None: change.element.attrib.pop(change.attribute_name, None)
+        else: change.element.set(change.attribute_name, value)
+
+
+def apply_insertions(insertions, index=None, reverse=False):
+    """Inserts the elements of insertions at their recorded positions (or removes them, in reverse
+    order, if reverse=True) and updates index (if given) to match."""
+    for insertion in (reversed(insertions) if reverse else insertions):
+        if reverse:
+            if index is not None: index.remove_elements(insertion.file_name, [insertion.element])
+            insertion.parent.remove(insertion.element)
+        else:
+            insertion.parent.insert(insertion.position, insertion.element)
+            if index is not None: index.add_elements(insertion.file_name, [insertion.element])
+
+
+def invert_changes(change_set):
+    """Returns the change set that undoes change_set, in the order it must be applied."""
+    return [change._replace(old_value=change.new_value, new_value=change.old_value) for change in reversed(change_set)]
+
+
+class ChangeJournal:
+    """Attribute-level undo/redo history of the refactors applied to the live trees.
+
+    Each step is (label, change_set, insertions). Undo/redo rewrite only the journaled attributes,
+    and detach or re-attach the inserted elements (see clone_definitions), keeping the
+    ReferenceIndex in sync, so no tree is ever copied.
+    """
+
+    def __init__(self, max_steps=100):
+        self.max_steps = max_steps
+        self.undo_stack = []
+        self.redo_stack = []
+        # file_name -> {(element, attribute_name): value before its first journaled edit}; survives max_steps trimming
+        self.original_values = {}
+        # file_name -> counter bumped whenever a step touching that file is recorded, undone or redone
+        self.revisions = {}
+        # file_name -> ElementInsertions currently attached to its tree, in insertion order
+        self.inserted = {}
+
+    def _bump_revisions(self, change_set):
+        for file_name in set(change.file_name for change in change_set):
+            self.revisions[file_name] = self.revisions.get(file_name, 0) + 1
+
+    def revision(self, file_name):
+        """Revision of file_name's content; 0 until a journaled edit touches it."""
+        return self.revisions.get(file_name, 0)
+
+    def _track_insertions(self, insertions, attached):
+        for insertion in insertions:
+            if attached: self.inserted.setdefault(insertion.file_name, []).append(insertion)
+            else: self.inserted[insertion.file_name].remove(insertion)
+        self._bump_revisions(insertions)
+
+    def record(self, label, change_set, insertions=()):
+        """Adds an applied refactor (or clone) as one undoable step. A new step clears the redo history."""
+        if not change_set and not insertions: return
+        for change in change_set:
+            self.original_values.setdefault(change.file_name, {}).setdefault((change.element, change.attribute_name), change.old_value)
+        self.undo_stack.append((label, list(change_set), list(insertions)))
+        del self.undo_stack[:-self.max_steps]
+        self.redo_stack.clear()
+        self._bump_revisions(change_set)
+        self._track_insertions(insertions, attached=True)
+
+    def undo(self, index):
+        """Reverts the latest step and returns its label (None if there is nothing to undo)."""
+        if not self.undo_stack: return None
+        label, change_set, insertions = self.undo_stack.pop()
+        apply_attribute_changes(change_set, reverse=True)
+        index.apply_changes(invert_changes(change_set))
+        apply_insertions(insertions, index, reverse=True)
+        self.redo_stack.append((label, change_set, insertions))
+        self._bump_revisions(change_set)
+        self._track_insertions(insertions, attached=False)
+        return label
+
+    def redo(self, index):
+        """Re-applies the latest undone step and returns its label (None if there is nothing to redo)."""
+        if not self.redo_stack: return None
+        label, change_set, insertions = self.redo_stack.pop()
+        apply_insertions(insertions, index)
+        apply_attribute_changes(change_set)
+        index.apply_changes(change_set)
+        self.undo_stack.append((label, change_set, insertions))
+        self._bump_revisions(change_set)
+        self._track_insertions(insertions, attached=True)
+        return label
+
+    def revert_all(self):
+        """Restores the original value of every journaled attribute, removes every inserted element
+        and clears the history."""
+        for file_name, insertions in self.inserted.items():
+            apply_insertions(insertions, reverse=True)
+            self.revisions[file_name] = self.revisions.get(file_name, 0) + 1
+        self.inserted.clear()
+        for file_name, originals in self.original_values.items():
+            for (element, attr_name), original_value in originals.items():
+                if original_value is None: element.attrib.pop(attr_name, None)
+                else: element.set(attr_name, original_value)
+            self.revisions[file_name] = self.revisions.get(file_name, 0) + 1
+        self.original_values.clear()
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+
+    def net_insertions(self, file_name):
+        """The elements currently inserted into file_name's tree, in insertion order."""
+        return [insertion.element for insertion in self.inserted.get(file_name, ())]
+
+    def net_edits(self, file_name):
+        """(element, attribute_name, original_value, current_value) for every journaled attribute of
+        file_name whose current value differs from its original one (undone edits drop out)."""
+        edits = []
+        for (element, attr_name), original_value in self.original_values.get(file_name, {}).items():
+            current_value = element.get(attr_name)
+            if current_value != original_value:
+                edits.append((element, attr_name, original_value, current_value))
+        return edits
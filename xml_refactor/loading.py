@@ -0,0 +1,295 @@
+"""Loading files: content-hash cache, parallel parse/index, streaming and the base corpus."""
+import hashlib
+import mmap
+import multiprocessing
+import os
+import pickle
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from .index import ReferenceIndex
+from .jobs import report_progress
+from .parsing import describe_parse_error, index_tree, parse_xml_bytes, stream_index_file
+from .profiling import stage
+from .reporting import get_reporter
+
+# --- Parse Cache ---
+# Bump whenever the shard layout or the classification rules change, so stale stored shards are ignored
+SHARD_CACHE_VERSION = 4
+# Directory for the on-disk shard store; unset keeps the parse cache in memory only
+PARSE_CACHE_DIR = os.environ.get('XML_REFACTOR_CACHE_DIR')
+
+def content_hash(content):
+    """SHA-256 hex digest of a file's bytes: the key of its cached tree and shard."""
+    return hashlib.sha256(content).hexdigest()
+
+class ParseCache:
+    """Parsed trees and IndexShards keyed by the SHA-256 of the file bytes.
+
+    Shards are immutable and are also pickled to cache_dir (if set), so reopening a project
+    skips indexing. Trees cannot be pickled and get edited in place, so they are only kept in
+    memory and only while they match their bytes: load_xml_files() takes them out and
+    release() puts them back once the project's journaled edits are reverted.
+    """
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        self.shards = {} # digest -> IndexShard
+        self.trees = {}  # digest -> pristine tree not currently loaded
+        self.loaded = {} # file_name -> digest, for the files of the last load_xml_files() call
+
+    def _shard_path(self, digest):
+        return os.path.join(self.cache_dir, f"{digest}.v{SHARD_CACHE_VERSION}.shard")
+
+    def get_shard(self, digest, file_name):
+        """Cached shard for digest (renamed to file_name), or None."""
+        shard = self.shards.get(digest)
+        if shard is None and self.cache_dir:
+            try:
+                with open(self._shard_path(digest), 'rb') as f: shard = pickle.load(f)
+            except FileNotFoundError: return None
+            except Exception: return None # Corrupt or incompatible entry: it is simply rebuilt
+            self.shards[digest] = shard
+        if shard is not None and shard.file_name != file_name: shard = shard._replace(file_name=file_name)
+        return shard
+
+    def put_shard(self, digest, shard):
+        self.shards[digest] = shard
+        if not self.cache_dir: return
+        path = self._shard_path(digest)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(path + '.tmp', 'wb') as f: pickle.dump(shard, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(path + '.tmp', path) # Atomic, so concurrent sessions never read a partial entry
+        except OSError:
+            pass # The store is only an accelerator
+
+    def take_tree(self, digest):
+        return self.trees.pop(digest, None)
+
+    def release(self, xml_data, journal=None):
+        """Reverts journal's edits and keeps the now pristine trees of xml_data for the next load."""
+        if journal: journal.revert_all()
+        for file_name, tree in xml_data.items():
+            digest = self.loaded.get(file_name)
+            if tree is not None and digest: self.trees[digest] = tree
+        self.loaded = {}
+
+
+# --- Parallel Loading ---
+# Below this many files a worker pool costs more than it saves
+PARALLEL_MIN_FILES = 4
+
+def _parse_file_worker(file_name, content):
+    """Thread worker: returns (tree, None) or (None, error message). lxml releases the GIL while parsing."""
+    try:
+        return parse_xml_bytes(content), None
+    except Exception as e:
+        return None, describe_parse_error(file_name, e)
+
+def _index_file_worker(file_name, content):
+    """Process worker: parses its own copy of the file and returns (IndexShard, None) or (None, error message)."""
+    try:
+        return index_tree(file_name, parse_xml_bytes(content), content), None
+    except Exception as e:
+        return None, describe_parse_error(file_name, e)
+
+def _stream_index_worker(file_name, content):
+    """Process worker for streaming mode: returns (IndexShard, None) or (None, error message)."""
+    try:
+        return stream_index_file(file_name, content), None
+    except Exception as e:
+        return None, describe_parse_error(file_name, e)
+
+def _process_pool_context():
+    """Multiprocessing context for index workers: 'forkserver' where available, else 'spawn'.
+
+    Never 'fork': the loader runs in a multithreaded process (the Streamlit server, JobRunner
+    threads) and a forked child can inherit a lock held by another thread and hang. The workers
+    live in this UI-free module, so fresh interpreters import them cheaply.
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods(): return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+def load_xml_files(file_contents, max_workers=None, streaming=False, cache=None, base_index=None):
+    """Parses and indexes {file_name: bytes} with a pool of workers (one per core by default).
+
+    Trees are parsed in a thread pool while the IndexShards are built in a process pool, then
+    merged in file order (duplicate definitions are detected at merge time). Indexing is Python
+    code holding the GIL and costs several times the parse, so only processes spread it over the
+    cores; each worker parses its own copy of the file, which costs CPU but not wall time when
+    there are cores to spare. With one worker or few files there is no pool and the shards are
+    built here from the thread-parsed trees, so every file is parsed once.
+
+    With streaming=True files are only indexed with iterparse (in the process pool, or in this
+    process if no pool is available): no DOM is kept, the files are left out of parsed_data and
+    recorded in index.unbound until materialize_files() is called.
+    With a ParseCache, files whose bytes were seen before reuse their tree and shard, so only
+    new or changed files are parsed and indexed. With a base_index (see load_base_corpus) the
+    returned index is layered over it.
+    Returns (parsed_data, index, errors) with parsed_data[file_name] = None for unparsable files.
+    """
+    file_names = list(file_contents)
+    digests, cached_trees, shard_results = {}, {}, {}
+    if cache is not None:
+        for file_name in file_names:
+            digest = digests[file_name] = content_hash(file_contents[file_name])
+            tree = None if streaming else cache.take_tree(digest) # Streaming keeps no DOM it does not need
+            if tree is not None: cached_trees[file_name] = tree
+            shard = cache.get_shard(digest, file_name)
+            # Shards of parsed trees lack the nesting a streamed file needs (IndexShard.owners)
+            if shard is not None and not (streaming and shard.owners is None): shard_results[file_name] = (shard, None)
+        cache.trees.clear() # Trees of files that are no longer loaded
+        cache.loaded = digests
+    to_index = [name for name in file_names if name not in shard_results]
+    to_parse = [] if streaming else [name for name in file_names if name not in cached_trees]
+    max_workers = max_workers or os.cpu_count() or 1
+    pool_context = _process_pool_context() if len(to_index) >= PARALLEL_MIN_FILES and max_workers > 1 else None
+    cached_shards = set(shard_results)
+
+    parse_stage = stage('parse', files=len(file_names), bytes=sum(len(content) for content in file_contents.values()),
+                        parsed=len(to_parse), indexed=len(to_index), cached_shards=len(cached_shards),
+                        processes=max_workers if pool_context is not None else 0, streaming=streaming)
+    with parse_stage, ThreadPoolExecutor(max_workers) as thread_pool:
+        process_pool = None
+        if pool_context is not None:
+            try:
+                process_pool = ProcessPoolExecutor(max_workers, mp_context=pool_context)
+                # Largest files first so the pool is not left waiting on one big file at the end.
+                # Contents are pickled to the workers, so mmapped files are passed as bytes
+                by_size = sorted(to_index, key=lambda name: len(file_contents[name]), reverse=True)
+                index_worker = _stream_index_worker if streaming else _index_file_worker
+                shard_futures = {name: process_pool.submit(index_worker, name, bytes(file_contents[name])) for name in by_size}
+            except Exception:
+                if process_pool is not None: process_pool.shutdown(cancel_futures=True)
+                process_pool = None
+        parse_results = {}
+        for done, (name, result) in enumerate(zip(to_parse, thread_pool.map(_parse_file_worker, to_parse, [file_contents[name] for name in to_parse])), 1):
+            parse_results[name] = result
+            report_progress(done, len(to_parse), f"Parsed {name}")
+        parse_results.update((name, (tree, None)) for name, tree in cached_trees.items())
+        if process_pool is not None:
+            try:
+                for done, (name, future) in enumerate(shard_futures.items(), 1):
+                    shard_results[name] = future.result()
+                    report_progress(done, len(shard_futures), f"Indexed {name}")
+            except Exception:
+                # Broken pool: index everything below instead
+                shard_results = {name: result for name, result in shard_results.items() if name in cached_shards}
+            finally:
+                process_pool.shutdown(cancel_futures=True) # Only pending after a cancelled job
+
+    parsed_data, errors = {}, []
+    index = ReferenceIndex(base=base_index)
+    with stage('index', files=len(file_names), elements=0, indexed_attributes=0) as counts:
+        for done, file_name in enumerate(file_names):
+            report_progress(done, len(file_names), f"Indexing {file_name}")
+            tree, error = parse_results.get(file_name, (None, None))
+            if streaming and tree is None:
+                shard, error = shard_results.get(file_name) or _stream_index_worker(file_name, file_contents[file_name])
+                if shard is None:
+                    parsed_data[file_name] = None
+                    errors.append(error)
+                else:
+                    index.add_shard(shard)
+                    counts['elements'] += len(shard.lines or ())
+                    counts['indexed_attributes'] += len(shard.values)
+                    if cache is not None and file_name not in cached_shards: cache.put_shard(digests[file_name], shard)
+                continue
+            parsed_data[file_name] = tree
+            if tree is None:
+                errors.append(error)
+                continue
+            try:
+                shard = (shard_results.get(file_name) or (None, None))[0] or index_tree(file_name, tree, file_contents[file_name])
+                index.add_shard(shard, tree)
+                counts['elements'] += len(shard.lines or ())
+                counts['indexed_attributes'] += len(shard.values)
+                if cache is not None and file_name not in cached_shards: cache.put_shard(digests[file_name], shard)
+            except Exception as e:
+                errors.append(f"Error iterating elements in {file_name}: {e}")
+    return parsed_data, index, errors
+
+def rebuild_index(xml_data, file_contents, index):
+    """A fresh index of a session whose incremental updates failed, layered over index.base.
+
+    Parsed files are indexed from their trees; files index still holds unbound (streamed, not
+    materialized) are streamed again from file_contents, so they stay in the index and the output.
+    """
+    rebuilt = ReferenceIndex(base=index.base)
+    file_names = list(file_contents) + [file_name for file_name in xml_data if file_name not in file_contents] # Clone-created files last
+    with stage('index', files=len(file_names), rebuild=True):
+        for file_name in file_names:
+            tree = xml_data.get(file_name)
+            try:
+                if tree is not None: rebuilt.add_shard(index_tree(file_name, tree, file_contents.get(file_name)), tree)
+                elif file_name in index.unbound: rebuilt.add_shard(stream_index_file(file_name, file_contents[file_name]))
+            except Exception as e:
+                get_reporter().error(f"Error iterating elements in {file_name}: {e}")
+    return rebuilt
+
+def read_file_bytes(path, use_mmap=False):
+    """Contents of a file: a read-only mmap if use_mmap and the platform allows it, else bytes.
+
+    An mmap supports everything the loader and the output splicer do with bytes (slicing,
+    regex scans, hashing, parsing) without copying the file into memory first.
+    """
+    with open(path, 'rb') as f:
+        if use_mmap:
+            try: return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, OSError): pass # Empty file or unmappable (e.g. a pipe)
+        return f.read()
+
+def list_xml_files(directory):
+    """(relative path, path) of every .xml file below directory, in sorted path order."""
+    found = []
+    for root, dir_names, file_names in os.walk(directory):
+        dir_names.sort()
+        for file_name in sorted(file_names):
+            if not file_name.lower().endswith('.xml'): continue
+            path = os.path.join(root, file_name)
+            found.append((os.path.relpath(path, directory).replace(os.sep, '/'), path))
+    return found
+
+def read_xml_directory(directory, use_mmap=False):
+    """{relative path: contents} for every .xml file below directory, in sorted path order."""
+    return {name: read_file_bytes(path, use_mmap) for name, path in list_xml_files(directory)}
+
+def materialize_files(file_names, xml_data, index, file_contents):
+    """Parses the full DOM of streamed files on demand and binds their index entries.
+
+    Adds the trees to xml_data. Returns a list of error messages.
+    """
+    errors = []
+    file_names = [file_name for file_name in file_names if file_name in index.unbound]
+    if not file_names: return errors
+    with stage('materialize', files=len(file_names)):
+        for done, file_name in enumerate(file_names):
+            report_progress(done, len(file_names), f"Loading {file_name}")
+            try:
+                xml_data[file_name] = index.materialize(file_name, file_contents[file_name])
+            except Exception as e:
+                errors.append(describe_parse_error(file_name, e))
+    return errors
+
+
+# --- Base Corpus ---
+# Game 'Modules' directory whose XML files (Native, SandBox, StoryMode, ...) form a base corpus
+# shared by all sessions; uploads are then only the mod's own files. Unset disables it.
+BASE_GAME_DIR = os.environ.get('BANNERLORD_BASE_DIR')
+
+# Shared by every session or run layered over it: nothing in it may be modified
+BaseCorpus = namedtuple('BaseCorpus', ['directory', 'xml_data', 'index', 'file_names', 'errors'])
+
+def build_base_corpus(directory):
+    """Parses and indexes the XML files below directory as a read-only base corpus.
+
+    Uploads are layered over the returned index (load_xml_files(base_index=...)) and never
+    edit its files: see find_read_only_conflicts(). The app builds it once per server process.
+    """
+    with stage('base_corpus', directory=directory) as counts:
+        file_contents = read_xml_directory(directory)
+        counts['files'] = len(file_contents)
+        xml_data, index, errors = load_xml_files(file_contents, cache=ParseCache(PARSE_CACHE_DIR))
+    file_names = frozenset(file_name for file_name, tree in xml_data.items() if tree is not None)
+    return BaseCorpus(directory, xml_data, index, file_names, errors)
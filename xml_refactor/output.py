@@ -0,0 +1,211 @@
+"""Rendering edited files: in-place byte splicing, re-serialization and ZIP assembly."""
+import copy
+import html
+import re
+import zipfile
+from io import BytesIO
+
+from lxml import etree
+
+from .parsing import scan_start_tags
+from .profiling import stage
+from .reporting import get_reporter
+
+# --- Output ---
+# Encodings whose bytes the splicer can scan and write directly
+SPLICE_ENCODINGS = ('UTF-8', 'US-ASCII', 'ASCII')
+_TAG_NAME_RE = re.compile(rb'<([^\s/>]+)')
+_ATTRIBUTE_RE = re.compile(rb'\s+([^\s=/>]+)\s*=\s*("[^"]*"|\'[^\']*\')')
+
+def serialize_tree(tree):
+    """Serializes a whole tree (pretty printed, with XML declaration)."""
+    # Use lxml.etree.tostring for pretty printing
+    return etree.tostring(
+        tree,
+        pretty_print=True,      # <<< THE KEY CHANGE FOR FORMATTING
+        xml_declaration=True,   # Add <?xml...> declaration
+        encoding='utf-8'        # Specify encoding
+    )
+
+def element_ordinals(tree, appended=()):
+    """{element: document-order ordinal} of tree's elements, in one walk. The walk stops at the
+    first of the appended elements (inserted under the root, so they come last): the rest have
+    no start tag in the original bytes."""
+    ordinals = {}
+    appended = set(appended)
+    for ordinal, element in enumerate(tree.getroot().iter(etree.Element)):
+        if element in appended: break
+        ordinals[element] = ordinal
+    return ordinals
+
+def locate_attribute_value(content, tag_start, attr_name):
+    """Byte span (without quotes) of attr_name's value in the start tag at tag_start, or None."""
+    name_match = _TAG_NAME_RE.match(content, tag_start)
+    if not name_match: return None
+    wanted = attr_name.encode('utf-8')
+    position = name_match.end()
+    while True:
+        attr_match = _ATTRIBUTE_RE.match(content, position)
+        if not attr_match: return None
+        if attr_match.group(1) == wanted:
+            return attr_match.start(2) + 1, attr_match.end(2) - 1
+        position = attr_match.end()
+
+def _attribute_text(raw_value):
+    """Value lxml reports for raw attribute bytes: entities resolved, whitespace normalized."""
+    text = html.unescape(raw_value.decode('utf-8'))
+    return text.replace('\t', ' ').replace('\n', ' ').replace('\r', ' ')
+
+def _escape_attribute(value, quote):
+    escaped = value.replace('&', '&amp;').replace('<', '&lt;').replace('\t', '&#9;').replace('\n', '&#10;').replace('\r', '&#13;')
+    return escaped.replace('"', '&quot;') if quote == '"' else escaped.replace("'", '&apos;')
+
+def splice_attribute_edits(content, edits, ordinals, tag_starts):
+    """Writes each (element, attribute_name, old_value, new_value) edit into the original bytes.
+
+    ordinals maps the source elements to their start tags in tag_starts (see element_ordinals()).
+    Only the edited attribute values change; every other byte (comments, whitespace, quoting,
+    attribute order) is kept. Returns None if any edit cannot be located and verified.
+    """
+    if len(ordinals) != len(tag_starts): return None # Scanner and parser disagree on the elements
+    spans = []
+    for element, attr_name, old_value, new_value in edits:
+        if new_value is None or attr_name.startswith('{'): return None
+        ordinal = ordinals.get(element)
+        if ordinal is None: return None
+        span = locate_attribute_value(content, tag_starts[ordinal], attr_name)
+        if span is None or _attribute_text(content[span[0]:span[1]]) != old_value: return None
+        quote = content[span[0] - 1:span[0]].decode('ascii')
+        spans.append((span[0], span[1], _escape_attribute(new_value, quote).encode('utf-8')))
+    spans.sort()
+    pieces, position = [], 0
+    for start, end, replacement in spans:
+        pieces.append(content[position:start])
+        pieces.append(replacement)
+        position = end
+    pieces.append(content[position:])
+    return b''.join(pieces)
+
+def splice_element_insertions(content, root, elements):
+    """Writes elements, appended to root, into the original bytes just before root's closing tag.
+
+    Each element is serialized on its own lines, indented one level. Returns None if an element
+    is not a child of root or the closing tag cannot be found.
+    """
+    if root.tag.startswith('{') or any(element.getparent() is not root for element in elements): return None
+    close_start = content.rfind(b'</' + root.tag.encode('utf-8'))
+    if close_start < 0: return None
+    pieces = []
+    for element in elements:
+        element = copy.deepcopy(element)
+        element.tail = None
+        etree.indent(element, space='  ', level=1)
+        pieces.append(b'  ' + etree.tostring(element, encoding='utf-8') + b'\n')
+    return content[:close_start] + b''.join(pieces) + content[close_start:]
+
+def _inside(element, elements):
+    """True if element is one of elements or nested in one."""
+    return element in elements or any(ancestor in elements for ancestor in element.iterancestors())
+
+# Output status of a rendered file
+OUTPUT_ORIGINAL, OUTPUT_SPLICED, OUTPUT_RESERIALIZED = 'original', 'spliced', 'reserialized'
+
+def render_output_file(file_name, xml_data, file_contents, index, journal):
+    """(output_bytes, status) for one file: verbatim if it has no net edits, else the original bytes
+    with the edited values (and inserted elements) spliced in, or the re-serialized tree if they
+    cannot be spliced. Returns None if the file has neither source bytes nor a tree, or was
+    created by a clone that has been undone.
+    """
+    content = file_contents.get(file_name)
+    edits = journal.net_edits(file_name) if journal else []
+    inserted = journal.net_insertions(file_name) if journal else []
+    if inserted: # Inserted elements are written whole, with their current values
+        inserted_set = set(inserted)
+        edits = [edit for edit in edits if not _inside(edit[0], inserted_set)]
+    if content is not None and not edits and not inserted: return content, OUTPUT_ORIGINAL # Untouched: copy verbatim
+    tree = xml_data.get(file_name)
+    if tree is None or (content is None and not inserted and not edits): return None
+    spliced = None
+    if content is not None and (tree.docinfo.encoding or 'UTF-8').upper() in SPLICE_ENCODINGS:
+        tag_starts = index.positions.get(file_name)
+        if tag_starts is None: tag_starts = scan_start_tags(content)
+        try:
+            spliced = splice_attribute_edits(content, edits, element_ordinals(tree, inserted), tag_starts)
+            if spliced is not None and inserted: spliced = splice_element_insertions(spliced, tree.getroot(), inserted)
+        except (UnicodeDecodeError, ValueError): spliced = None
+    if spliced is None: return serialize_tree(tree), OUTPUT_RESERIALIZED
+    return spliced, OUTPUT_SPLICED
+
+def render_output_files(file_names, xml_data, file_contents, index, journal):
+    """Renders every file with render_output_file(). Returns (outputs, reserialized_file_names)."""
+    outputs, reserialized = {}, []
+    with stage('render', files=len(file_names)) as counts:
+        for file_name in file_names:
+            rendered = render_output_file(file_name, xml_data, file_contents, index, journal)
+            if rendered is None: continue
+            outputs[file_name] = rendered[0]
+            if rendered[1] == OUTPUT_RESERIALIZED: reserialized.append(file_name)
+        counts['reserialized'] = len(reserialized)
+    return outputs, reserialized
+
+class OutputCache:
+    """Rendered output per file, keyed by the file's journal revision, plus the last assembled ZIP.
+
+    Streamlit reruns the script on every interaction; with this cache a file is only re-rendered
+    after a refactor, undo or redo touched it, and the ZIP is only rebuilt when an entry or a
+    ZIP option changed.
+    """
+
+    def __init__(self):
+        self.entries = {} # file_name -> (revision, output_bytes, status)
+        self.zip_key = None
+        self.zip_bytes = None
+
+    def render(self, file_names, xml_data, file_contents, index, journal):
+        """{file_name: (output_bytes, status)} for file_names, re-rendering only stale entries."""
+        outputs = {}
+        with stage('render', files=len(file_names), rendered=0) as counts:
+            for file_name in file_names:
+                revision = journal.revision(file_name) if journal else 0
+                entry = self.entries.get(file_name)
+                if entry is None or entry[0] != revision:
+                    counts['rendered'] += 1
+                    rendered = render_output_file(file_name, xml_data, file_contents, index, journal)
+                    if rendered is None:
+                        self.entries.pop(file_name, None)
+                        continue
+                    entry = self.entries[file_name] = (revision,) + rendered
+                outputs[file_name] = entry[1:]
+            counts['reserialized'] = sum(1 for _, status in outputs.values() if status == OUTPUT_RESERIALIZED)
+        return outputs
+
+    def get_zip(self, outputs, compresslevel=6, compress_untouched=False, changed_only=False):
+        """ZIP bytes for outputs (as returned by render()), rebuilt only if an entry or an option changed."""
+        key = (tuple((file_name, self.entries[file_name][0]) for file_name in outputs), compresslevel, compress_untouched, changed_only)
+        if key != self.zip_key:
+            self.zip_bytes = create_zip(outputs, compresslevel, compress_untouched, changed_only)
+            self.zip_key = key
+        return self.zip_bytes
+
+def create_zip(outputs, compresslevel=6, compress_untouched=False, changed_only=False):
+    """Creates a zip file in memory from rendered outputs ({file_name: (output_bytes, status)}).
+
+    Edited files are deflated at compresslevel (0 stores them). Untouched files are stored as is
+    unless compress_untouched is set, or left out entirely if changed_only is set.
+    """
+    zip_buffer = BytesIO()
+    zip_stage = stage('zip', files=0, deflated=0, bytes=0, compresslevel=compresslevel)
+    with zip_stage as counts, zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED, False) as zip_file:
+        for file_name, (content, status) in outputs.items():
+            untouched = status == OUTPUT_ORIGINAL
+            if untouched and changed_only: continue
+            deflate = compresslevel > 0 and (compress_untouched or not untouched)
+            try:
+                zip_file.writestr(file_name, content, compress_type=zipfile.ZIP_DEFLATED if deflate else zipfile.ZIP_STORED,
+                                  compresslevel=compresslevel if deflate else None)
+                counts['files'] += 1
+                counts['deflated'] += deflate
+                counts['bytes'] += len(content)
+            except Exception as e:
+                get_reporter().error(f"Error writing {file_name} to zip: {e}")
+    return zip_buffer.getvalue()
@@ -0,0 +1,255 @@
+"""Parsing XML bytes and extracting per-file index shards."""
+import re
+import sys
+from array import array
+from collections import namedtuple
+from io import BytesIO
+
+from lxml import etree
+
+from .classification import ATTR_DEFINITION, ATTR_REFERENCE, index_attribute, split_prefixed_value
+from .reporting import get_reporter
+
+# --- Helper Functions ---
+def parse_xml_bytes(content):
+    """Parses raw XML bytes (or an mmap of them) with the tool's lxml settings. Raises on invalid XML."""
+    # Clean potential BOM
+    if content[:3] == b'\xef\xbb\xbf': # Works for bytes and mmap alike
+        content = content[3:]
+    # Configure lxml parser to try and preserve comments and structure
+    # remove_blank_text=True helps with pretty print output later
+    parser = etree.XMLParser(remove_blank_text=True, resolve_entities=False)
+    root = etree.fromstring(content, parser=parser)
+    return etree.ElementTree(root)
+
+def describe_parse_error(file_name, error):
+    """User-facing message for a parse_xml_bytes() failure."""
+    if isinstance(error, etree.XMLSyntaxError): # lxml specific parse error
+        return f"Error parsing {file_name}: Invalid XML structure. {error}"
+    return f"An unexpected error occurred while parsing {file_name}: {error}"
+
+# Use lxml for parsing
+def parse_xml(uploaded_file):
+    """Parses an uploaded XML file using lxml."""
+    try:
+        uploaded_file.seek(0)
+        return parse_xml_bytes(uploaded_file.read()) # Read as bytes
+    except Exception as e:
+        get_reporter().error(describe_parse_error(uploaded_file.name, e))
+        return None
+
+# --- Source Positions ---
+# Markup that may contain '<' without opening an element is matched (and skipped) first;
+# a bare '<' followed by a name character is an element start tag.
+_MARKUP_RE = re.compile(rb'<!--.*?-->|<!\[CDATA\[.*?\]\]>|<\?.*?\?>|<!DOCTYPE(?:[^>\[]|\[.*?\])*>|</|<(?=[^\s!?/])', re.S)
+
+def scan_start_tags(content):
+    """Byte offsets of every element start tag in raw XML, in document order (= element ordinals)."""
+    return array('Q', [match.start() for match in _MARKUP_RE.finditer(content) if match.end() - match.start() == 1])
+
+# --- Index Shards ---
+# Picklable per-file index. Elements are addressed by their ordinal in document order
+# (tree.getroot().iter(etree.Element)), so a shard can be built in another process and
+# bound to the main process's tree later.
+IndexShard = namedtuple('IndexShard', [
+    'file_name',
+    'definitions', # list of (base_id, ordinal)
+    'references',  # list of (base_id, ordinal, attribute_name, prefix); the value is prefix + base_id
+    'values',      # list of (value_index_key, ordinal, attribute_name)
+    'lines',       # array of source line numbers per ordinal (line where the start tag ends, at most MAX_SOURCELINE)
+    'tag_starts',  # array of start-tag byte offsets per ordinal in the original bytes, if they were available
+    'owners',      # per ordinal, the plain base ID defined by its nearest ancestor (or None); streamed shards only
+], defaults=(None, None, None))
+
+# lxml reports element.sourceline of parsed trees up to 65535 (even with huge_tree), while
+# iterparse sees the true line: streamed lines are clamped so both modes report the same lines
+MAX_SOURCELINE = 65535
+
+# Attribute names and prefixes repeat across thousands of entries: one string object each
+_intern = sys.intern
+
+# --- Index Entries ---
+class _Entry:
+    """Mapping-style access to a __slots__ record (info['file_name'], info.get('owner'), 'owner' in info),
+    so index entries read like the dicts they replace at a fraction of the memory. Unset slots are
+    missing keys."""
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        try: return getattr(self, key)
+        except AttributeError: raise KeyError(key) from None
+
+    def __setitem__(self, key, value):
+        setattr(self, key, value)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def __contains__(self, key):
+        return hasattr(self, key)
+
+    def __repr__(self):
+        fields = ', '.join(f"{name}={getattr(self, name)!r}" for name in self.__slots__ if hasattr(self, name))
+        return f"{type(self).__name__}({fields})"
+
+class Definition(_Entry):
+    """Where a base ID is defined. Streamed files not yet materialized have element None plus the
+    'sourceline' and (if recorded) the 'owner' of the definition."""
+    __slots__ = ('file_name', 'element', 'sourceline', 'owner')
+
+    def __init__(self, file_name, element):
+        self.file_name = file_name
+        self.element = element
+
+class Reference(_Entry):
+    """One attribute referencing base_id as prefix + base_id (its 'original_value').
+    Unbound entries carry 'sourceline' and 'owner' like Definition."""
+    __slots__ = ('file_name', 'element', 'attribute_name', 'prefix', 'base_id', 'sourceline', 'owner')
+
+    def __init__(self, file_name, element, attribute_name, prefix, base_id):
+        self.file_name = file_name
+        self.element = element
+        self.attribute_name = attribute_name
+        self.prefix = prefix
+        self.base_id = base_id
+
+    @property
+    def original_value(self):
+        return self.base_id if self.prefix is None else self.prefix + self.base_id
+
+def index_tree(file_name, tree, content=None):
+    """Extracts the definitions, references and value-index entries of one parsed file.
+
+    Pass the file's raw content to also record start-tag byte offsets for in-place output.
+    """
+    definitions, references, values = [], [], []
+    lines = array('L')
+    # Elements only: comments and processing instructions are skipped by the filter
+    for ordinal, element in enumerate(tree.getroot().iter(etree.Element)):
+        lines.append(element.sourceline or 0)
+        element_tag = element.tag
+        # Classify only the attributes this element actually carries
+        for attr_name, original_value in element.attrib.items():
+            value_key, kind, prefix, base_id = index_attribute(element_tag, attr_name, original_value)
+            if value_key is not None:
+                values.append((value_key, ordinal, _intern(attr_name)))
+            if kind == ATTR_DEFINITION:
+                definitions.append((base_id, ordinal))
+            elif kind == ATTR_REFERENCE:
+                references.append((base_id, ordinal, _intern(attr_name), prefix and _intern(prefix)))
+    tag_starts = scan_start_tags(content) if content is not None else None
+    return IndexShard(file_name, definitions, references, values, lines, tag_starts)
+
+def stream_index_file(file_name, content):
+    """Builds the IndexShard of raw XML bytes with iterparse, without keeping a DOM.
+
+    Elements are cleared as soon as they end, so memory stays bounded by the document depth
+    plus the shard itself. Ordinals match index_tree() on the fully parsed file.
+    """
+    source = BytesIO(content[3:] if content[:3] == b'\xef\xbb\xbf' else content) # Skip a BOM
+    definitions, references, values = [], [], []
+    lines = array('L')
+    owners, owner_stack = [], [None] # The DOM is gone later, so nesting is recorded for the dependency graph
+    ordinal = -1
+    for event, element in etree.iterparse(source, events=('start', 'end'), remove_blank_text=True, resolve_entities=False):
+        if event == 'end':
+            owner_stack.pop()
+            # Drop the finished element and any already processed siblings
+            element.clear(keep_tail=True)
+            parent = element.getparent()
+            if parent is not None:
+                while element.getprevious() is not None:
+                    del parent[0]
+            continue
+        ordinal += 1
+        lines.append(min(element.sourceline or 0, MAX_SOURCELINE))
+        owner = owner_stack[-1]
+        owners.append(owner)
+        element_tag = element.tag
+        for attr_name, original_value in element.attrib.items():
+            value_key, kind, prefix, base_id = index_attribute(element_tag, attr_name, original_value)
+            if value_key is not None:
+                values.append((value_key, ordinal, _intern(attr_name)))
+            if kind == ATTR_DEFINITION:
+                definitions.append((base_id, ordinal))
+                if not ('.' in base_id and split_prefixed_value(base_id)): owner = base_id
+            elif kind == ATTR_REFERENCE:
+                references.append((base_id, ordinal, _intern(attr_name), prefix and _intern(prefix)))
+        owner_stack.append(owner)
+    return IndexShard(file_name, definitions, references, values, lines, scan_start_tags(content), owners)
+
+def merge_shard(shard, tree, found_definitions, found_references, value_index=None, duplicates=None):
+    """Binds a shard to tree's elements and merges it into the global dicts.
+
+    Duplicate definitions are detected here, keeping the first instance merged; the others are
+    collected in duplicates (base_id -> list of Definitions) if given, else reported one
+    warning each. With tree=None (streamed file, no DOM yet) entries get element None plus their
+    'sourceline', and the returned (holders, ordinals) bindings let bind_elements() fill them in later.
+    """
+    file_name = _intern(shard.file_name)
+    elements = list(tree.getroot().iter(etree.Element)) if tree is not None else None
+    lines, owners = shard.lines, shard.owners
+    # Streamed files: entries (or value locations) to bind, and the element ordinal of each
+    holders, ordinals = ([], array('L')) if elements is None else (None, None)
+    for base_id, ordinal in shard.definitions:
+        if base_id in found_definitions and duplicates is None:
+            get_reporter().warning(f"Duplicate definition ID '{base_id}' found. Using first instance from '{found_definitions[base_id]['file_name']}'. Second instance in '{file_name}'.")
+            continue
+        if elements is not None:
+            def_info = Definition(file_name, elements[ordinal])
+        else:
+            def_info = Definition(file_name, None)
+            def_info.sourceline = lines[ordinal]
+            if owners is not None: def_info.owner = owners[ordinal]
+            holders.append(def_info)
+            ordinals.append(ordinal)
+        if base_id in found_definitions: duplicates.setdefault(base_id, []).append(def_info)
+        else: found_definitions[base_id] = def_info
+    if elements is None and owners is not None: # Plain IDs defined by the referencing elements themselves
+        own_definitions = {ordinal: base_id for base_id, ordinal in shard.definitions if not ('.' in base_id and split_prefixed_value(base_id))}
+    for base_id, ordinal, attr_name, prefix in shard.references:
+        # Store reference info (element itself is needed)
+        ref_info = Reference(file_name, elements[ordinal] if elements is not None else None, _intern(attr_name), prefix and _intern(prefix), base_id)
+        if elements is None:
+            ref_info.sourceline = lines[ordinal]
+            if owners is not None: ref_info.owner = own_definitions.get(ordinal) or owners[ordinal]
+            holders.append(ref_info)
+            ordinals.append(ordinal)
+        found_references.setdefault(base_id, []).append(ref_info)
+    if value_index is not None:
+        for value_key, ordinal, attr_name in shard.values:
+            if elements is not None:
+                location = (file_name, elements[ordinal], _intern(attr_name))
+            else:
+                location = [file_name, None, _intern(attr_name)] # Mutable until bound
+                holders.append(location)
+                ordinals.append(ordinal)
+            value_index.setdefault(value_key, []).append(location)
+    return (holders, ordinals) if elements is None else None
+
+def bind_elements(bindings, tree):
+    """Fills the element slots left open by merge_shard(shard, None, ...) from the parsed tree."""
+    elements = list(tree.getroot().iter(etree.Element))
+    holders, ordinals = bindings
+    for holder, ordinal in zip(holders, ordinals):
+        if type(holder) is list: holder[1] = elements[ordinal] # Value location
+        else: holder.element = elements[ordinal]
+
+def find_ids(xml_data, value_index=None, duplicates=None):
+    """Finds potential defining IDs and referencing attributes in parsed XMLs.
+
+    If value_index (a dict) is given, it is filled in the same pass with
+    value_index_key -> list of (file_name, element, attribute_name) for the broad fallback.
+    Duplicate definitions go to duplicates (a dict) if given, see merge_shard().
+    """
+    found_definitions = {} # base_id -> Definition
+    found_references = {} # base_id -> list of References
+
+    for file_name, tree in xml_data.items():
+        if tree is None: continue
+        try:
+            merge_shard(index_tree(file_name, tree), tree, found_definitions, found_references, value_index, duplicates)
+        except Exception as e:
+             get_reporter().error(f"Error iterating elements in {file_name}: {e}")
+
+    return found_definitions, found_references
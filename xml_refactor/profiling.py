@@ -0,0 +1,128 @@
+"""Per-stage timing and memory instrumentation of the core pipeline."""
+import json
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError: # Not available on Windows
+    resource = None
+
+class Profiler:
+    """Receives one record per pipeline stage the core runs (see stage()).
+
+    A record is a dict: {'stage': name, 'seconds': wall time, 'counts': {...}} plus 'peak_mb'
+    (peak Python heap allocation during the stage, only with trace_memory; lxml's own memory
+    is not traced), 'max_rss_mb' (peak resident memory of the process so far) and 'error' (if
+    the stage raised). This base class discards them; subclass and install with set_profiler().
+    """
+
+    trace_memory = False
+
+    def record(self, entry):
+        pass
+
+class CollectingProfiler(Profiler):
+    """Keeps every record, e.g. for a report or a UI panel, and passes it on to forward_to (if given)."""
+
+    def __init__(self, trace_memory=False, forward_to=None):
+        self.records = []
+        self.trace_memory = trace_memory
+        self.forward_to = forward_to
+
+    def record(self, entry):
+        self.records.append(entry)
+        if self.forward_to is not None: self.forward_to.record(entry)
+
+class JsonLinesProfiler(Profiler):
+    """Writes every record as one JSON line (to stderr by default), for headless runs."""
+
+    def __init__(self, stream=None, trace_memory=False):
+        self.stream = stream
+        self.trace_memory = trace_memory
+
+    def record(self, entry):
+        stream = self.stream or sys.stderr
+        stream.write(json.dumps(entry) + '\n')
+        stream.flush()
+
+def summarize_stages(records):
+    """Totals per stage name, in first-seen order: [{stage, calls, seconds, peak_mb, counts}].
+
+    Counts are summed over the calls; peak_mb is the largest peak of any call (if traced).
+    """
+    totals = {}
+    for entry in records:
+        total = totals.get(entry['stage'])
+        if total is None: total = totals[entry['stage']] = {'stage': entry['stage'], 'calls': 0, 'seconds': 0.0, 'peak_mb': None, 'counts': {}}
+        total['calls'] += 1
+        total['seconds'] = round(total['seconds'] + entry['seconds'], 6)
+        if entry.get('peak_mb') is not None: total['peak_mb'] = max(total['peak_mb'] or 0, entry['peak_mb'])
+        for name, value in entry['counts'].items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool): total['counts'][name] = total['counts'].get(name, 0) + value
+    return list(totals.values())
+
+def max_rss_mb():
+    """Peak resident memory of this process in MB, or None where unavailable."""
+    if resource is None: return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1) # bytes on macOS, KiB elsewhere
+
+_profiler = Profiler()
+_traced = threading.local() # Per thread stack of the peaks seen by nested traced stages
+
+def get_profiler():
+    """The profiler the core functions currently send their stage records to."""
+    return _profiler
+
+def set_profiler(profiler):
+    """Installs profiler for all core functions and returns the previous one."""
+    global _profiler
+    previous, _profiler = _profiler, profiler
+    return previous
+
+@contextmanager
+def stage(name, **counts):
+    """Times the enclosed block as pipeline stage name and records it with the current profiler.
+
+    Yields the counts dict, so the block can add the sizes it only knows at the end:
+
+        with stage('render', files=len(file_names)) as counts:
+            ...
+            counts['reserialized'] = len(reserialized)
+
+    Nested stages are recorded separately (the outer one includes the inner ones).
+    """
+    profiler = _profiler
+    if type(profiler) is Profiler: # Nothing is recorded: skip the bookkeeping
+        yield counts
+        return
+    entry = {'stage': name, 'seconds': None, 'counts': counts}
+    tracing = profiler.trace_memory
+    if tracing:
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing: tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        peaks = _traced.__dict__.setdefault('peaks', [])
+        peaks.append(0)
+    start = time.perf_counter()
+    try:
+        yield counts
+    except BaseException as e:
+        entry['error'] = type(e).__name__
+        raise
+    finally:
+        entry['seconds'] = round(time.perf_counter() - start, 6)
+        if tracing:
+            # reset_peak() in a nested stage hides the earlier peak of this one, so nested
+            # stages hand their absolute peak up the stack
+            peak = max(tracemalloc.get_traced_memory()[1], peaks.pop())
+            if peaks: peaks[-1] = max(peaks[-1], peak)
+            entry['peak_mb'] = round(max(0, peak - baseline) / 1e6, 3)
+            if started_tracing: tracemalloc.stop()
+        entry['max_rss_mb'] = max_rss_mb()
+        profiler.record(entry)
@@ -0,0 +1,322 @@
+"""Renaming IDs across the loaded trees: single, batch and pattern renames."""
+import json
+import re
+
+from .classification import split_prefixed_value, value_index_key
+from .index import AttributeChange
+from .jobs import report_progress
+from .profiling import stage
+from .reporting import get_reporter
+
+# perform_refactor remains largely the same logic
+def perform_refactor(old_base_id, new_base_id, xml_data, definitions, references, change_set=None, value_index=None, dry_run=False):
+    """Performs the refactoring across all loaded XML data using BASE IDs.
+
+    Every attribute edit is also appended to change_set (if given) as an AttributeChange,
+    so a ReferenceIndex can be updated without rescanning the trees. With a value_index
+    (see find_ids) the broad fallback is a lookup instead of a scan of every element.
+    With dry_run=True no tree is modified: change_set and the log describe what would change.
+    """
+    changes_made = []
+    if change_set is None: change_set = []
+    processed_elements = set() # Track (file_name, element_identity, attribute_name)
+
+    with stage('refactor', ids=1, indexed_fallback=value_index is not None, dry_run=dry_run) as counts:
+        _rename_definition(old_base_id, new_base_id, definitions, processed_elements, changes_made, change_set, dry_run=dry_run)
+        _rename_references(old_base_id, new_base_id, references, processed_elements, changes_made, change_set, dry_run)
+        counts['indexed_edits'] = len(change_set)
+
+        # --- 3. Broader Search (Fallback) ---
+        if dry_run: pass # Previews run on every selection change: keep them quiet
+        elif value_index is not None: get_reporter().info("Performing broader reference search across all attributes (indexed fallback)...")
+        else: get_reporter().info("Performing broader reference search across all attributes (fallback)...")
+        broad_changes = _rename_broad({old_base_id: new_base_id}, xml_data, value_index, processed_elements, changes_made, change_set, dry_run)
+        counts['broad_edits'] = broad_changes
+    if not dry_run: get_reporter().info(f"Broader search finished. Found {broad_changes} potential broad references.")
+    return changes_made
+
+
+def describe_changes(change_set):
+    """One JSON-serializable row per AttributeChange, ordered by file and line: the structured diff
+    of a refactor (or of a dry run): {'file', 'line', 'tag', 'attribute', 'old', 'new'}."""
+    rows = [{
+        'file': change.file_name, 'line': change.element.sourceline, 'tag': change.element.tag,
+        'attribute': change.attribute_name, 'old': change.old_value, 'new': change.new_value,
+    } for change in change_set]
+    rows.sort(key=lambda row: (row['file'], row['line'] or 0))
+    return rows
+
+
+# Characters an XML 1.0 attribute value cannot hold (lxml refuses to set them)
+_NOT_XML_CHARS_RE = re.compile('[^\t\n\r\x20-\ud7ff\ue000-\ufffd\U00010000-\U0010ffff]')
+
+def find_rename_conflicts(mapping, definitions):
+    """Checks an old->new base ID mapping before a batch rename. Returns a list of conflict messages."""
+    conflicts = []
+    targets = {}
+    for old_base_id, new_base_id in mapping.items():
+        if not old_base_id or not new_base_id:
+            conflicts.append(f"Empty ID in mapping '{old_base_id}' -> '{new_base_id}'.")
+            continue
+        if old_base_id == new_base_id:
+            conflicts.append(f"'{old_base_id}' is mapped to itself.")
+            continue
+        if _NOT_XML_CHARS_RE.search(new_base_id):
+            conflicts.append(f"New ID {new_base_id!r} (for '{old_base_id}') contains characters XML cannot hold.")
+            continue
+        if new_base_id in mapping:
+            if mapping[new_base_id] == old_base_id:
+                if old_base_id < new_base_id: # Report each swap once
+                    conflicts.append(f"Swap: '{old_base_id}' <-> '{new_base_id}'. Rename through a temporary ID instead.")
+            else:
+                conflicts.append(f"Chained rename: '{old_base_id}' -> '{new_base_id}' -> '{mapping[new_base_id]}'. Map '{old_base_id}' to the final ID directly.")
+        elif new_base_id in definitions:
+            conflicts.append(f"New ID '{new_base_id}' (for '{old_base_id}') is already defined in '{definitions[new_base_id]['file_name']}'.")
+        if new_base_id in targets:
+            conflicts.append(f"'{targets[new_base_id]}' and '{old_base_id}' are both mapped to '{new_base_id}'.")
+        else:
+            targets[new_base_id] = old_base_id
+    return conflicts
+
+
+def find_read_only_conflicts(base_ids, index, read_only_files):
+    """Checks that renaming base_ids edits no read-only (base corpus) file. Returns a list of conflict messages."""
+    conflicts = []
+    if not read_only_files: return conflicts
+    for base_id in base_ids:
+        # The value index covers definitions, prefixed references and likely plain references
+        file_names = set(location[0] for location in index.values.get(base_id, ()))
+        file_names.update(ref['file_name'] for ref in index.references.get(base_id, ()))
+        def_info = index.definitions.get(base_id)
+        if def_info: file_names.add(def_info['file_name'])
+        locked = sorted(file_names & read_only_files)
+        if locked:
+            more = f" (+{len(locked) - 3} more)" if len(locked) > 3 else ""
+            conflicts.append(f"'{base_id}' is defined or referenced in read-only base files: {', '.join(locked[:3])}{more}.")
+    return conflicts
+
+
+def perform_batch_refactor(mapping, xml_data, definitions, references, change_set=None, value_index=None, dry_run=False):
+    """Applies a whole old->new base ID mapping in one pass and returns one consolidated change log.
+
+    Nothing is changed if find_rename_conflicts() reports a conflict. Definitions and indexed
+    references are updated per ID; the broad fallback is one lookup per ID with a value_index,
+    otherwise a single traversal of all trees for the whole mapping. dry_run as in perform_refactor.
+    """
+    conflicts = find_rename_conflicts(mapping, definitions)
+    if conflicts:
+        return [f"CONFLICT: {conflict}" for conflict in conflicts]
+
+    changes_made = []
+    if change_set is None: change_set = []
+    processed_elements = set()
+    with stage('refactor', ids=len(mapping), indexed_fallback=value_index is not None, dry_run=dry_run) as counts:
+        # Resolves prefixed definition keys ('Prefix.base') once instead of per ID
+        dotted_definitions = {key.split('.', 1)[1]: key for key in definitions if '.' in key}
+        for done, (old_base_id, new_base_id) in enumerate(mapping.items()):
+            report_progress(done, len(mapping), f"Renaming '{old_base_id}'")
+            _rename_definition(old_base_id, new_base_id, definitions, processed_elements, changes_made, change_set, dotted_definitions, dry_run)
+            _rename_references(old_base_id, new_base_id, references, processed_elements, changes_made, change_set, dry_run)
+        counts['indexed_edits'] = len(change_set)
+        broad_changes = counts['broad_edits'] = _rename_broad(mapping, xml_data, value_index, processed_elements, changes_made, change_set, dry_run)
+    changes_made.append(f"BATCH: {len(mapping)} IDs renamed with {len(change_set)} attribute edits ({broad_changes} from the broad search).")
+    return changes_made
+
+
+def plan_pattern_rename(pattern, replacement, definitions, references, mode='regex', read_only_files=frozenset()):
+    """Resolves a pattern rename against the indexed base IDs (no tree access).
+
+    mode='regex' substitutes the first match of pattern in each base ID (backreferences like \\1
+    allowed); mode='prefix' replaces a leading literal prefix. IDs defined in read_only_files (or,
+    if undefined, only referenced there) are not matched. Returns (mapping, preview, errors),
+    preview being one row per matched ID with its definition file and reference count.
+    """
+    mapping, preview = {}, []
+    if not pattern: return mapping, preview, []
+    if mode == 'regex':
+        try: compiled = re.compile(pattern)
+        except re.error as e: return mapping, preview, [f"Invalid regular expression '{pattern}': {e}"]
+
+    # Base IDs known to the index; prefixed definition keys ('Prefix.base') are renamed by their base
+    base_ids = set(references)
+    def_keys = {} # base_id -> its definition key
+    for def_key in definitions:
+        split = split_prefixed_value(def_key) if '.' in def_key else None
+        base_id = split[1] if split and split[1] else def_key
+        base_ids.add(base_id)
+        def_keys.setdefault(base_id, def_key)
+
+    for base_id in sorted(base_ids):
+        if mode == 'prefix':
+            if not base_id.startswith(pattern): continue
+            new_base_id = replacement + base_id[len(pattern):]
+        else:
+            if not compiled.search(base_id): continue
+            try: new_base_id = compiled.sub(replacement, base_id, count=1)
+            except (re.error, IndexError) as e: return {}, [], [f"Invalid replacement '{replacement}': {e}"]
+        if new_base_id == base_id: continue
+        def_info = definitions.get(def_keys.get(base_id, base_id))
+        if read_only_files: # Skip base game IDs: defined, or only referenced, in read-only files
+            if def_info and def_info['file_name'] in read_only_files: continue
+            if not def_info and all(ref['file_name'] in read_only_files for ref in references.get(base_id, ())): continue
+        mapping[base_id] = new_base_id
+        preview.append({
+            'old_id': base_id, 'new_id': new_base_id,
+            'defined_in': def_info['file_name'] if def_info else '',
+            'references': len(references.get(base_id, ()))
+        })
+    return mapping, preview, []
+
+
+def _rename_definition(old_base_id, new_base_id, definitions, processed_elements, changes_made, change_set, dotted_definitions=None, dry_run=False):
+    """Step 1: renames the defining 'id' attribute of old_base_id."""
+    definition_updated = False
+    definition_key_found = None
+    if old_base_id in definitions: definition_key_found = old_base_id
+    elif dotted_definitions is not None: definition_key_found = dotted_definitions.get(old_base_id)
+    else:
+        for def_id_key in definitions.keys():
+            if '.' in def_id_key and def_id_key.split('.', 1)[1] == old_base_id:
+                definition_key_found = def_id_key; break
+
+    if definition_key_found:
+        def_info = definitions[definition_key_found]
+        def_file = def_info['file_name']
+        def_element = def_info['element']
+        # Use element itself for identity with lxml (more reliable than id())
+        element_id_tuple = (def_file, def_element, 'id')
+
+        if element_id_tuple not in processed_elements:
+            try:
+                current_def_id = def_element.get('id') # Use .get()
+                if current_def_id == definition_key_found:
+                    new_def_id = new_base_id
+                    if '.' in definition_key_found:
+                        prefix_part = definition_key_found.split('.', 1)[0] + "."
+                        new_def_id = prefix_part + new_base_id
+                    if not dry_run: def_element.set('id', new_def_id) # Use .set()
+                    change_set.append(AttributeChange(def_file, def_element, 'id', current_def_id, new_def_id))
+                    changes_made.append(f"DEFINED: In '{def_file}', changed ID '{current_def_id}' to '{new_def_id}' for tag '{def_element.tag}'.")
+                    processed_elements.add(element_id_tuple)
+                    definition_updated = True
+                else:
+                    changes_made.append(f"WARNING: Definition element ID mismatch in '{def_file}'. Expected '{definition_key_found}', found '{current_def_id}'. No change.")
+            except Exception as e: get_reporter().error(f"Error updating definition for {definition_key_found} in {def_file}: {e}")
+
+    if not definition_updated and not definition_key_found:
+        changes_made.append(f"WARNING: Definition for base ID '{old_base_id}' not found.")
+
+
+def _rename_references(old_base_id, new_base_id, references, processed_elements, changes_made, change_set, dry_run=False):
+    """Step 2: renames the references to old_base_id found by find_ids."""
+    if old_base_id not in references: return
+    for ref_info in references[old_base_id]:
+        ref_file, ref_element, ref_attr_name = ref_info['file_name'], ref_info['element'], ref_info['attribute_name']
+        ref_prefix, original_value = ref_info.get('prefix'), ref_info['original_value']
+        element_id_tuple = (ref_file, ref_element, ref_attr_name)
+        if element_id_tuple in processed_elements: continue
+
+        current_value = ref_element.get(ref_attr_name)
+        if current_value == original_value:
+            expected_old_value = f"{ref_prefix or ''}{old_base_id}"
+            if original_value == expected_old_value:
+                try:
+                    new_value_with_prefix = f"{ref_prefix or ''}{new_base_id}"
+                    if not dry_run: ref_element.set(ref_attr_name, new_value_with_prefix) # Use .set()
+                    change_set.append(AttributeChange(ref_file, ref_element, ref_attr_name, original_value, new_value_with_prefix))
+                    changes_made.append(f"REFERENCED ({ref_attr_name}): In '{ref_file}', changed '{original_value}' to '{new_value_with_prefix}' for tag '{ref_element.tag}'.")
+                    processed_elements.add(element_id_tuple)
+                except Exception as e: get_reporter().error(f"Error updating ref for {old_base_id} in {ref_file} attr '{ref_attr_name}': {e}")
+            else:
+                changes_made.append(f"INFO: Ref in '{ref_file}' ({ref_attr_name}='{original_value}') skipped. Value != expected pattern '{expected_old_value}'.")
+                processed_elements.add(element_id_tuple)
+        else:
+            changes_made.append(f"WARNING: Ref in '{ref_file}' ({ref_attr_name}) skipped. Expected '{original_value}', found '{current_value}'.")
+            processed_elements.add(element_id_tuple)
+
+
+def _rename_broad(mapping, xml_data, value_index, processed_elements, changes_made, change_set, dry_run=False):
+    """Step 3: renames any remaining attribute whose value looks like a reference to a mapped ID.
+
+    Returns the number of broad changes.
+    """
+    if value_index is not None:
+        # Only attributes whose value (or 'Prefix.base' split) equals an old ID can match
+        candidates = [(f, e, a, e.get(a)) for old_base_id in mapping for f, e, a in value_index.get(old_base_id, ())]
+    else:
+        candidates = _iter_all_attributes(xml_data)
+    broad_changes = 0
+    total = len(candidates) if isinstance(candidates, list) else None # The full scan reports per file instead
+    for done, (file_name, element, attr_name, attr_value) in enumerate(candidates):
+        if total and not done % 1000: report_progress(done, total, "Checking matches outside the index")
+        element_id_tuple = (file_name, element, attr_name)
+        if attr_value is None or element_id_tuple in processed_elements: continue
+
+        # Same heuristics as value_index_key: uppercase 'Prefix.base' anywhere, plain value on likely attributes
+        old_base_id = value_index_key(element.tag, attr_name, attr_value)
+        new_base_id = mapping.get(old_base_id) if old_base_id is not None else None
+        if new_base_id is None: continue
+        expected_new = f"{attr_value.split('.', 1)[0]}.{new_base_id}" if '.' in attr_value else new_base_id
+
+        try:
+            if not dry_run: element.set(attr_name, expected_new) # Use .set()
+            change_set.append(AttributeChange(file_name, element, attr_name, attr_value, expected_new))
+            changes_made.append(f"REFERENCED (broad/{attr_name}): In '{file_name}', changed '{attr_value}' to '{expected_new}' for tag '{element.tag}'.")
+            processed_elements.add(element_id_tuple)
+            broad_changes += 1
+        except Exception as e: get_reporter().error(f"Error updating broad ref for {old_base_id} in {file_name} attr '{attr_name}': {e}")
+    return broad_changes
+
+
+def _iter_all_attributes(xml_data):
+    """Yields (file_name, element, attribute_name, value) for every attribute of every element."""
+    for done, (file_name, tree) in enumerate(xml_data.items()):
+         report_progress(done, len(xml_data), f"Searching {file_name}")
+         if tree is None: continue
+         for element in tree.getroot().iter():
+             if not isinstance(element.tag, str): continue # Skip comments/PIs
+             # Lxml .attrib is a dict-like proxy, iterate over a copy since values may be set meanwhile
+             for attr_name, attr_value in dict(element.attrib).items():
+                 yield file_name, element, attr_name, attr_value
+
+
+def parse_rename_mapping(text):
+    """Parses an old->new base ID mapping for perform_batch_refactor.
+
+    Accepts JSON ({"old": "new"} or [["old", "new"], ...]) or one 'old,new' pair per line
+    (tab or '->' also work as separators; blank lines, '#' comments and an 'old,new' header are skipped).
+    Returns (mapping, errors).
+    """
+    mapping, errors = {}, []
+    text = (text or "").strip()
+    if not text: return mapping, errors
+
+    pairs = []
+    if text[0] in '{[':
+        try:
+            loaded = json.loads(text)
+            pairs = list(loaded.items()) if isinstance(loaded, dict) else list(loaded)
+        except (ValueError, TypeError) as e:
+            return mapping, [f"Invalid JSON mapping: {e}"]
+    else:
+        for line_number, line in enumerate(text.splitlines(), 1):
+            line = line.strip()
+            if not line or line.startswith('#'): continue
+            parts = [part.strip().strip('"') for part in re.split(r'\s*(?:->|,|\t)\s*', line)]
+            if len(parts) != 2:
+                errors.append(f"Line {line_number}: expected 'old,new', got '{line}'.")
+                continue
+            if line_number == 1 and [part.lower() for part in parts] == ['old', 'new']: continue
+            pairs.append(tuple(parts))
+
+    for pair in pairs:
+        # Only real pairs: a JSON string such as "ab" must not unpack into 'a' -> 'b'
+        if not isinstance(pair, (list, tuple)) or len(pair) != 2 or not all(isinstance(part, str) for part in pair):
+            errors.append(f"Invalid mapping entry {pair!r}: expected a pair of ID strings.")
+            continue
+        old_base_id, new_base_id = pair[0].strip(), pair[1].strip()
+        if old_base_id in mapping and mapping[old_base_id] != new_base_id:
+            errors.append(f"'{old_base_id}' is mapped to both '{mapping[old_base_id]}' and '{new_base_id}'.")
+            continue
+        mapping[old_base_id] = new_base_id
+    return mapping, errors
@@ -0,0 +1,72 @@
+"""Where the core functions send their messages, instead of calling a UI directly."""
+import logging
+import sys
+
+# Message levels, in increasing severity
+INFO = 'info'
+WARNING = 'warning'
+ERROR = 'error'
+_LEVEL_ORDER = {INFO: 0, WARNING: 1, ERROR: 2}
+
+class Reporter:
+    """Receives the info/warning/error messages of the core functions.
+
+    Subclass and install with set_reporter(): the Streamlit app shows them with st.*, the CLI
+    prints and collects them for its JSON report.
+    """
+
+    def report(self, level, message):
+        pass
+
+    def info(self, message): self.report(INFO, message)
+    def warning(self, message): self.report(WARNING, message)
+    def error(self, message): self.report(ERROR, message)
+
+class LoggingReporter(Reporter):
+    """Default reporter: forwards messages to the 'xml_refactor' logger."""
+
+    _LOG_LEVELS = {INFO: logging.INFO, WARNING: logging.WARNING, ERROR: logging.ERROR}
+
+    def __init__(self, logger=None):
+        self.logger = logger or logging.getLogger('xml_refactor')
+
+    def report(self, level, message):
+        self.logger.log(self._LOG_LEVELS[level], message)
+
+class StreamReporter(Reporter):
+    """Prints messages at or above min_level as 'level: message' lines (to stderr by default)."""
+
+    def __init__(self, stream=None, min_level=INFO):
+        self.stream = stream
+        self.min_level = min_level
+
+    def report(self, level, message):
+        if _LEVEL_ORDER[level] >= _LEVEL_ORDER[self.min_level]:
+            print(f"{level}: {message}", file=self.stream or sys.stderr)
+
+class CollectingReporter(Reporter):
+    """Keeps every message as (level, message), e.g. for a JSON report, and passes it on to
+    forward_to (if given)."""
+
+    def __init__(self, forward_to=None):
+        self.messages = []
+        self.forward_to = forward_to
+
+    def report(self, level, message):
+        self.messages.append((level, message))
+        if self.forward_to is not None: self.forward_to.report(level, message)
+
+    def count(self, level):
+        return sum(1 for message_level, _ in self.messages if message_level == level)
+
+_reporter = LoggingReporter()
+
+def get_reporter():
+    """The reporter the core functions currently send their messages to."""
+    return _reporter
+
+def set_reporter(reporter):
+    """Installs reporter for all core functions and returns the previous one."""
+    global _reporter
+    previous, _reporter = _reporter, reporter
+    return previous
@@ -1,527 +1,663 @@
-# --- Imports ---
-import streamlit as st
-# import xml.etree.ElementTree as ET # No longer using standard ET directly
-from lxml import etree # Import lxml's etree module
-from io import BytesIO
-import zipfile
-import re
-
-# --- Configuration ---
-# Common attributes that reference IDs (add more as needed)
-REFERENCE_ATTRIBUTES = {
-    # Attribute Name : Prefix (or None if just ID, or special marker)
-    "culture": "Culture.",
-    "faction": "Faction.",
-    "owner": "Hero.", # Can be Faction too, heuristic needed maybe - CURRENTLY ASSUMING HERO
-    "default_group": None, # Often refers to troop groups, might need prefix?
-    "occupation": None, # Sometimes links to Occupations enum, not necessarily an ID reference
-    "skill_template": "SkillSet.",
-    "is_template": None, # Boolean, ignore
-    "default_party_template": "PartyTemplate.",
-    "villager_party_template": "PartyTemplate.",
-    "caravan_party_template": "PartyTemplate.",
-    "elite_caravan_party_template": "PartyTemplate.",
-    "militia_party_template": "PartyTemplate.",
-    "rebels_party_template": "PartyTemplate.",
-    "vassal_reward_party_template": "PartyTemplate.",
-    "basic_troop": "NPCCharacter.",
-    "elite_basic_troop": "NPCCharacter.",
-    "melee_militia_troop": "NPCCharacter.",
-    "ranged_militia_troop": "NPCCharacter.",
-    "melee_elite_militia_troop": "NPCCharacter.",
-    "ranged_elite_militia_troop": "NPCCharacter.",
-    "tournament_master": "NPCCharacter.",
-    "villager": "NPCCharacter.",
-    "caravan_master": "NPCCharacter.",
-    "armed_trader": "NPCCharacter.",
-    "caravan_guard": "NPCCharacter.",
-    "veteran_caravan_guard": "NPCCharacter.",
-    "prison_guard": "NPCCharacter.",
-    "guard": "NPCCharacter.",
-    "blacksmith": "NPCCharacter.",
-    "weaponsmith": "NPCCharacter.",
-    "townswoman": "NPCCharacter.",
-    "townswoman_infant": "NPCCharacter.", # Added based on user XML
-    "townswoman_child": "NPCCharacter.",  # Added based on user XML
-    "townswoman_teenager": "NPCCharacter.",# Added based on user XML
-    "townsman": "NPCCharacter.",
-    "townsman_infant": "NPCCharacter.",   # Added based on user XML
-    "townsman_child": "NPCCharacter.",    # Added based on user XML
-    "townsman_teenager": "NPCCharacter.", # Added based on user XML
-    "village_woman": "NPCCharacter.",
-    "villager_male_child": "NPCCharacter.",# Added based on user XML (renamed from villager_child)
-    "villager_male_teenager": "NPCCharacter.",# Added based on user XML (renamed from villager_teenager)
-    "villager_female_child": "NPCCharacter.",# Added based on user XML (renamed from village_woman_child)
-    "villager_female_teenager": "NPCCharacter.",# Added based on user XML (renamed from village_woman_teenager)
-    "ransom_broker": "NPCCharacter.",
-    "gangleader_bodyguard": "NPCCharacter.",
-    "merchant_notary": "NPCCharacter.",
-    "artisan_notary": "NPCCharacter.",
-    "preacher_notary": "NPCCharacter.",
-    "rural_notable_notary": "NPCCharacter.",
-    "shop_worker": "NPCCharacter.",
-    "tavernkeeper": "NPCCharacter.",
-    "taverngamehost": "NPCCharacter.",
-    "musician": "NPCCharacter.",
-    "tavern_wench": "NPCCharacter.",
-    "armorer": "NPCCharacter.",
-    "horseMerchant": "NPCCharacter.",
-    "barber": "NPCCharacter.",
-    "merchant": "NPCCharacter.",
-    "beggar": "NPCCharacter.",
-    "female_beggar": "NPCCharacter.",
-    "female_dancer": "NPCCharacter.",
-    "gear_practice_dummy": "NPCCharacter.", # Added based on user XML
-    "weapon_practice_stage_1": "NPCCharacter.", # Added based on user XML
-    "weapon_practice_stage_2": "NPCCharacter.", # Added based on user XML
-    "weapon_practice_stage_3": "NPCCharacter.", # Added based on user XML
-    "gear_dummy": "NPCCharacter.", # Added based on user XML
-    "upgrade_target": "NPCCharacter.", # In troops.xml
-    "id": "EQUIPMENT_ITEM_ID", # Special case: 'id' on Equipment/equipment tags often reference Items
-    "slot": None, # Usually Item or Mount type, complex, ignore for now
-    "skill": "Skill.",
-    "lord_template": "NPCCharacter.", # In spcultures.xml lord_templates
-    "rebellion_hero_template": "NPCCharacter.", # In spcultures.xml rebellion_hero_templates
-    "tournament_team_template": "NPCCharacter.", # Patterns might be needed for specific tournament template IDs
-    "basic_mercenary_troop": "NPCCharacter.", # In spcultures.xml basic_mercenary_troops
-    "equipment_set": "EquipmentRoster.", # spnpccharacters, lords
-    "civilian_equipment_set": "EquipmentRoster.",
-    "battle_equipment_set": "EquipmentRoster.",
-    "civilian": "EquipmentRoster.", # Can also be EquipmentRoster ID apparently
-    "default_battle_equipment_roster": "EquipmentRoster.",
-    "default_civilian_equipment_roster": "EquipmentRoster.",
-    "duel_preset_equipment_roster": "EquipmentRoster.",
-    "banner_bearer_troop": "NPCCharacter.",
-    "formation": None, # Usually enum, ignore
-    "mount": "Item.", # Often references mount item ID
-    "harness": "Item.", # Often references harness item ID
-    "name": "TEMPLATE_REFERENCE", # Attributes like template="NPCCharacter.xyz" inside notable_and_wanderer_templates etc.
-    # Add more known reference attributes here based on testing
-}
-
-# --- Helper Functions ---
-
-# Use lxml for parsing
-def parse_xml(uploaded_file):
-    """Parses an uploaded XML file using lxml."""
-    try:
-        uploaded_file.seek(0)
-        content = uploaded_file.read() # Read as bytes
-        # Clean potential BOM
-        if content.startswith(b'\xef\xbb\xbf'):
-            content = content[3:]
-        # Configure lxml parser to try and preserve comments and structure
-        # remove_blank_text=True helps with pretty print output later
-        parser = etree.XMLParser(remove_blank_text=True, resolve_entities=False)
-        root = etree.fromstring(content, parser=parser)
-        tree = etree.ElementTree(root)
-        return tree
-    except etree.XMLSyntaxError as e: # Catch lxml specific parse error
-        st.error(f"Error parsing {uploaded_file.name}: Invalid XML structure. {e}")
-        return None
-    except Exception as e:
-        st.error(f"An unexpected error occurred while parsing {uploaded_file.name}: {e}")
-        return None
-
-# find_ids function remains largely the same, as lxml's API is similar for basic access
-def find_ids(xml_data):
-    """Finds potential defining IDs and referencing attributes in parsed XMLs."""
-    found_definitions = {} # base_id -> {file_name, element}
-    found_references = {} # base_id -> list of {file_name, element, attribute_name, prefix, original_value}
-
-    for file_name, tree in xml_data.items():
-        if tree is None: continue
-        try:
-            root = tree.getroot()
-            # Use iter() which works for both lxml and ET
-            for element in root.iter():
-                # Skip comments and processing instructions if any were kept
-                if not isinstance(element.tag, str):
-                    continue
-
-                element_tag = element.tag
-
-                # --- Find Definitions (standard id attribute) ---
-                element_id_val = element.get('id') # Use .get() for safer access
-                if element_id_val: # Handles None or empty string
-                    base_def_id = element_id_val # Use full ID as key for simplicity now
-
-                    if base_def_id in found_definitions:
-                        st.warning(f"Duplicate definition ID '{base_def_id}' found. Using first instance from '{found_definitions[base_def_id]['file_name']}'. Second instance in '{file_name}'.")
-                    else:
-                        found_definitions[base_def_id] = {'file_name': file_name, 'element': element}
-
-                # --- Find References (based on REFERENCE_ATTRIBUTES) ---
-                for attr_name, prefix_or_marker in REFERENCE_ATTRIBUTES.items():
-                    original_value = element.get(attr_name)
-                    if original_value: # Handles None or empty string
-                        base_id = None
-                        prefix = None
-                        is_reference = False
-
-                        if isinstance(prefix_or_marker, str) and prefix_or_marker.endswith('.'):
-                            configured_prefix = prefix_or_marker
-                            if original_value.startswith(configured_prefix):
-                                prefix = configured_prefix
-                                base_id = original_value[len(prefix):]
-                                is_reference = True
-                        elif prefix_or_marker == 'EQUIPMENT_ITEM_ID' and attr_name == 'id' and element_tag in ('Equipment', 'equipment'):
-                            if original_value.startswith("Item."):
-                                prefix = "Item."
-                                base_id = original_value[len(prefix):]
-                            else:
-                                prefix = None
-                                base_id = original_value
-                            is_reference = True
-                        elif prefix_or_marker == 'TEMPLATE_REFERENCE' and attr_name == 'name' and element_tag == 'template':
-                             if '.' in original_value:
-                                 parts = original_value.split('.', 1)
-                                 if parts[0] and parts[0][0].isupper():
-                                      prefix = parts[0] + "."
-                                      base_id = parts[1]
-                                      is_reference = True
-                        elif prefix_or_marker is None and attr_name != 'id':
-                             if '.' in original_value:
-                                 parts = original_value.split('.', 1)
-                                 if parts[0] and parts[0][0].isupper() and len(parts[0]) > 1:
-                                      prefix = parts[0] + "."
-                                      base_id = parts[1]
-                                      is_reference = True
-
-                        if is_reference and base_id:
-                            if base_id not in found_references:
-                                found_references[base_id] = []
-                            # Store reference info (element itself is needed)
-                            found_references[base_id].append({
-                                'file_name': file_name,
-                                'element': element,
-                                'attribute_name': attr_name,
-                                'prefix': prefix,
-                                'original_value': original_value
-                            })
-        except Exception as e:
-             st.error(f"Error iterating elements in {file_name}: {e}")
-
-    return found_definitions, found_references
-
-
-# perform_refactor remains largely the same logic
-def perform_refactor(old_base_id, new_base_id, xml_data, definitions, references):
-    """Performs the refactoring across all loaded XML data using BASE IDs."""
-    changes_made = []
-    processed_elements = set() # Track (file_name, element_identity, attribute_name)
-
-    # --- 1. Update Definition ---
-    definition_updated = False
-    definition_key_found = None
-    if old_base_id in definitions: definition_key_found = old_base_id
-    else:
-        for def_id_key in definitions.keys():
-            if '.' in def_id_key and def_id_key.split('.', 1)[1] == old_base_id:
-                definition_key_found = def_id_key; break
-
-    if definition_key_found:
-        def_info = definitions[definition_key_found]
-        def_file = def_info['file_name']
-        def_element = def_info['element']
-        # Use element itself for identity with lxml (more reliable than id())
-        element_id_tuple = (def_file, def_element, 'id')
-
-        if element_id_tuple not in processed_elements:
-            try:
-                current_def_id = def_element.get('id') # Use .get()
-                if current_def_id == definition_key_found:
-                    new_def_id = new_base_id
-                    if '.' in definition_key_found:
-                        prefix_part = definition_key_found.split('.', 1)[0] + "."
-                        new_def_id = prefix_part + new_base_id
-                    def_element.set('id', new_def_id) # Use .set()
-                    changes_made.append(f"DEFINED: In '{def_file}', changed ID '{current_def_id}' to '{new_def_id}' for tag '{def_element.tag}'.")
-                    processed_elements.add(element_id_tuple)
-                    definition_updated = True
-                else:
-                    changes_made.append(f"WARNING: Definition element ID mismatch in '{def_file}'. Expected '{definition_key_found}', found '{current_def_id}'. No change.")
-            except Exception as e: st.error(f"Error updating definition for {definition_key_found} in {def_file}: {e}")
-
-    if not definition_updated and not definition_key_found:
-        changes_made.append(f"WARNING: Definition for base ID '{old_base_id}' not found.")
-
-    # --- 2. Update Specific References ---
-    if old_base_id in references:
-        for ref_info in references[old_base_id]:
-            ref_file, ref_element, ref_attr_name = ref_info['file_name'], ref_info['element'], ref_info['attribute_name']
-            ref_prefix, original_value = ref_info.get('prefix'), ref_info['original_value']
-            element_id_tuple = (ref_file, ref_element, ref_attr_name)
-            if element_id_tuple in processed_elements: continue
-
-            current_value = ref_element.get(ref_attr_name)
-            if current_value == original_value:
-                expected_old_value = f"{ref_prefix or ''}{old_base_id}"
-                if original_value == expected_old_value:
-                    try:
-                        new_value_with_prefix = f"{ref_prefix or ''}{new_base_id}"
-                        ref_element.set(ref_attr_name, new_value_with_prefix) # Use .set()
-                        changes_made.append(f"REFERENCED ({ref_attr_name}): In '{ref_file}', changed '{original_value}' to '{new_value_with_prefix}' for tag '{ref_element.tag}'.")
-                        processed_elements.add(element_id_tuple)
-                    except Exception as e: st.error(f"Error updating ref for {old_base_id} in {ref_file} attr '{ref_attr_name}': {e}")
-                else:
-                    changes_made.append(f"INFO: Ref in '{ref_file}' ({ref_attr_name}='{original_value}') skipped. Value != expected pattern '{expected_old_value}'.")
-                    processed_elements.add(element_id_tuple)
-            else:
-                changes_made.append(f"WARNING: Ref in '{ref_file}' ({ref_attr_name}) skipped. Expected '{original_value}', found '{current_value}'.")
-                processed_elements.add(element_id_tuple)
-
-    # --- 3. Broader Search (Fallback) ---
-    st.write("Performing broader reference search across all attributes (fallback)...")
-    broad_changes = 0
-    for file_name, tree in xml_data.items():
-         if tree is None: continue
-         root = tree.getroot()
-         for element in root.iter():
-             if not isinstance(element.tag, str): continue # Skip comments/PIs
-             # Need to use .attrib directly here if modifying during iteration isn't safe
-             # Lxml .attrib is a dict-like proxy, safer to iterate keys then get/set
-             current_attrs = dict(element.attrib) # Create copy
-             for attr_name, attr_value in current_attrs.items():
-                 element_id_tuple = (file_name, element, attr_name)
-                 if element_id_tuple in processed_elements: continue
-
-                 potential_prefix, value_matches, expected_new = None, False, None
-                 if '.' in attr_value:
-                     parts = attr_value.split('.', 1)
-                     if parts[0] and parts[0][0].isupper() and parts[1] == old_base_id:
-                          potential_prefix, value_matches = parts[0] + ".", True
-                          expected_new = f"{potential_prefix}{new_base_id}"
-                 elif attr_value == old_base_id:
-                     is_likely = attr_name in REFERENCE_ATTRIBUTES or \
-                                 (element.tag in ('Equipment', 'equipment') and attr_name == 'id') or \
-                                 (element.tag == 'template' and attr_name == 'name')
-                     if is_likely:
-                          potential_prefix, value_matches, expected_new = None, True, new_base_id
-
-                 if value_matches and expected_new is not None:
-                     try:
-                         element.set(attr_name, expected_new) # Use .set()
-                         changes_made.append(f"REFERENCED (broad/{attr_name}): In '{file_name}', changed '{attr_value}' to '{expected_new}' for tag '{element.tag}'.")
-                         processed_elements.add(element_id_tuple)
-                         broad_changes += 1
-                     except Exception as e: st.error(f"Error updating broad ref for {old_base_id} in {file_name} attr '{attr_name}': {e}")
-
-    st.write(f"Broader search finished. Found {broad_changes} potential broad references.")
-    return changes_made
-
-
-# Use lxml for creating the zip with pretty printing
-def create_zip(xml_data):
-    """Creates a zip file in memory containing the modified XML data using lxml."""
-    zip_buffer = BytesIO()
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED, False) as zip_file:
-        for file_name, tree in xml_data.items():
-            if tree:
-                try:
-                    # Use lxml.etree.tostring for pretty printing
-                    xml_bytes = etree.tostring(
-                        tree,
-                        pretty_print=True,      # <<< THE KEY CHANGE FOR FORMATTING
-                        xml_declaration=True,   # Add <?xml...> declaration
-                        encoding='utf-8'        # Specify encoding
-                    )
-                    zip_file.writestr(file_name, xml_bytes)
-                except Exception as e:
-                    st.error(f"Error serializing or writing {file_name} to zip: {e}")
-            else:
-                 st.warning(f"Skipping file '{file_name}' for ZIP creation (not parsed correctly).")
-    zip_buffer.seek(0)
-    return zip_buffer
-
-# --- UI Helper ---
-def get_element_path(element):
-    """Helper to create a simple path string for an element."""
-    # Use lxml's .get method
-    elem_id = element.get('id')
-    if elem_id:
-         return f"{element.tag}[id={elem_id}]"
-    return element.tag
-
-# --- Streamlit App ---
-# (The Streamlit UI part remains largely the same, just ensure it uses
-#  the variables/functions modified above correctly)
-st.set_page_config(layout="wide")
-
-st.title("Bannerlord Mod XML ID Refactor Tool (Attribute-Focused)")
-st.warning("⚠️ **Prototype Limitations:** Basic ID detection. No pattern renaming. **Backup files!** Uses lxml for formatting.")
-
-# --- Session State Initialization ---
-default_state = {
-    'uploaded_files_data': {}, 'parsed_xml_data': {}, 'definitions': {},
-    'references': {}, 'primary_file': None, 'selected_attribute_key': None,
-    'selected_ref_info': None, 'new_id_input_value': "",
-    'refactor_results': [], 'show_download': False
-}
-for key, value in default_state.items():
-    if key not in st.session_state:
-        st.session_state[key] = value
-
-# --- File Uploader ---
-uploaded_files = st.file_uploader(
-    "Upload ALL relevant XML files (incl. spcultures.xml)", type=['xml'],
-    accept_multiple_files=True, key="file_uploader",
-    help="Select spcultures.xml and files defining/referencing IDs (troops, characters, etc.)"
-)
-
-# --- Main Logic ---
-if uploaded_files:
-    new_file_names = set(f.name for f in uploaded_files)
-    cached_file_names = set(st.session_state.get('uploaded_files_data', {}).keys())
-
-    if new_file_names != cached_file_names:
-        st.info(f"New file upload detected ({len(uploaded_files)} files). Reprocessing...")
-        current_uploaded_data = {f.name: f for f in uploaded_files}
-        st.session_state.uploaded_files_data = current_uploaded_data
-        for key in default_state:
-            if key != 'uploaded_files_data': st.session_state[key] = default_state[key]
-
-        with st.spinner(f"Processing {len(uploaded_files)} files..."):
-            temp_parsed_data = {}
-            files_processed_count, files_failed_count = 0, 0
-            for file_name, uploaded_file_obj in current_uploaded_data.items():
-                 parsed_tree = parse_xml(uploaded_file_obj) # Calls the lxml version
-                 temp_parsed_data[file_name] = parsed_tree
-                 if parsed_tree: files_processed_count += 1
-                 else: files_failed_count += 1
-            st.session_state.parsed_xml_data = temp_parsed_data
-
-            if files_processed_count > 0:
-                st.session_state.definitions, st.session_state.references = find_ids(st.session_state.parsed_xml_data)
-                st.success(f"Processed {files_processed_count} files. Found global definitions/references.")
-                if files_failed_count > 0: st.warning(f"{files_failed_count} files failed to parse.")
-                valid_files = [name for name, tree in st.session_state.parsed_xml_data.items() if tree]
-                if "spcultures.xml" in valid_files: st.session_state.primary_file = "spcultures.xml"
-                elif valid_files: st.session_state.primary_file = valid_files[0]
-            elif files_failed_count > 0: st.error("All uploaded files failed to parse.")
-        st.rerun()
-
-    has_valid_data = any(tree for tree in st.session_state.get('parsed_xml_data', {}).values())
-    if not has_valid_data:
-        if st.session_state.get('uploaded_files_data'): st.error("XML data could not be parsed.")
-    else:
-        parsed_file_names = [name for name, tree in st.session_state.parsed_xml_data.items() if tree]
-        if not parsed_file_names: st.warning("No files parsed successfully.")
-        else:
-            if st.session_state.primary_file not in parsed_file_names: st.session_state.primary_file = parsed_file_names[0]
-            selected_primary_file = st.selectbox("Select primary file to browse:", parsed_file_names, index=parsed_file_names.index(st.session_state.primary_file), key="primary_file_selector")
-            if selected_primary_file != st.session_state.primary_file:
-                st.session_state.primary_file = selected_primary_file
-                st.session_state.selected_attribute_key, st.session_state.selected_ref_info, st.session_state.new_id_input_value = None, None, ""
-                st.rerun()
-
-            st.subheader(f"Select Attribute to Refactor in '{st.session_state.primary_file}'")
-            attribute_options = {"<Select an attribute>": None}
-            primary_tree = st.session_state.parsed_xml_data.get(st.session_state.primary_file)
-            if primary_tree:
-                try:
-                    root = primary_tree.getroot()
-                    count = 0
-                    for element in root.iter():
-                        if not isinstance(element.tag, str): continue # Skip comments/PIs
-                        elem_path_str = get_element_path(element)
-                        for attr_name, original_value in element.attrib.items(): # Use element.attrib with lxml
-                            if not original_value: continue
-                            prefix_or_marker = REFERENCE_ATTRIBUTES.get(attr_name)
-                            base_id, prefix, is_reference = None, None, False
-                            # Reference detection logic (same as before)
-                            if isinstance(prefix_or_marker, str) and prefix_or_marker.endswith('.'):
-                                if original_value.startswith(prefix_or_marker): prefix, base_id, is_reference = prefix_or_marker, original_value[len(prefix_or_marker):], True
-                            elif prefix_or_marker == 'EQUIPMENT_ITEM_ID' and attr_name == 'id' and element.tag in ('Equipment', 'equipment'):
-                                if original_value.startswith("Item."): prefix, base_id = "Item.", original_value[5:]
-                                else: prefix, base_id = None, original_value
-                                is_reference = True
-                            elif prefix_or_marker == 'TEMPLATE_REFERENCE' and attr_name == 'name' and element.tag == 'template':
-                                 if '.' in original_value:
-                                     parts = original_value.split('.', 1)
-                                     if parts[0] and parts[0][0].isupper(): prefix, base_id, is_reference = parts[0] + ".", parts[1], True
-                            elif prefix_or_marker is None and attr_name != 'id':
-                                 if '.' in original_value:
-                                     parts = original_value.split('.', 1)
-                                     if parts[0] and parts[0][0].isupper() and len(parts[0]) > 1: prefix, base_id, is_reference = parts[0] + ".", parts[1], True
-                            # Add option if it's a reference
-                            if is_reference and base_id:
-                                display_text = f'{elem_path_str} | {attr_name}="{original_value}"'
-                                option_key = f"{st.session_state.primary_file}-{count}"
-                                attribute_options[display_text] = {
-                                    "key": option_key, "file": st.session_state.primary_file,
-                                    "element_repr": elem_path_str, "attribute_name": attr_name,
-                                    "original_value": original_value, "old_id": base_id, "prefix": prefix
-                                }
-                                count += 1
-                except Exception as e: st.error(f"Error iterating elements in {st.session_state.primary_file}: {e}")
-
-            if len(attribute_options) <= 1: st.info(f"No potential ID references found in '{st.session_state.primary_file}'.")
-            else:
-                 option_keys = list(attribute_options.keys())
-                 current_attr_index = 0
-                 if st.session_state.selected_attribute_key:
-                      try: current_attr_index = next(i for i, k in enumerate(option_keys) if attribute_options[k] and attribute_options[k]['key'] == st.session_state.selected_attribute_key)
-                      except (StopIteration, ValueError): current_attr_index = 0
-                 selected_attr_display = st.selectbox("Select attribute to modify:", option_keys, index=current_attr_index, key="attribute_selector")
-                 selected_info = attribute_options.get(selected_attr_display)
-                 if selected_info: st.session_state.selected_attribute_key, st.session_state.selected_ref_info = selected_info['key'], selected_info
-                 else: st.session_state.selected_attribute_key, st.session_state.selected_ref_info = None, None
-
-                 if st.session_state.selected_ref_info:
-                     ref_info = st.session_state.selected_ref_info
-                     st.write(f"**Selected:** Attribute `{ref_info['attribute_name']}` = `{ref_info['original_value']}`")
-                     st.write(f"(Element: `{ref_info['element_repr']}`, Base ID: `{ref_info['old_id']}`, Prefix: `{ref_info['prefix'] or '(None)'}`)")
-                     new_id_input = st.text_input(f"Enter New Base ID for '{ref_info['old_id']}':", key="new_id_input", value=st.session_state.new_id_input_value)
-                     st.session_state.new_id_input_value = new_id_input
-                     if st.button("Refactor This Attribute Globally", key="refactor_button"):
-                         new_base_id = st.session_state.new_id_input_value.strip()
-                         old_base_id = ref_info['old_id']
-                         if old_base_id and new_base_id and new_base_id != old_base_id:
-                             with st.spinner("Preparing... Creating temporary copies."): # Copy logic remains same
-                                 temp_parsed_data = {}
-                                 copy_success = True
-                                 source_data = st.session_state.parsed_xml_data
-                                 for fname, tree in source_data.items():
-                                      if tree:
-                                           try:
-                                                # Use lxml's tostring/fromstring for copying
-                                                xml_string = etree.tostring(tree.getroot(), encoding='utf-8')
-                                                temp_root = etree.fromstring(xml_string)
-                                                temp_parsed_data[fname] = etree.ElementTree(temp_root)
-                                           except Exception as e: st.error(f"Error copying {fname}: {e}"); copy_success = False; temp_parsed_data[fname]=None
-                                      else: temp_parsed_data[fname]=None
-                             if not copy_success: st.error("Copying failed. Aborting.")
-                             else:
-                                 with st.spinner("Analyzing copies..."): temp_definitions, temp_references = find_ids(temp_parsed_data) # Uses lxml elements
-                                 with st.spinner(f"Refactoring '{old_base_id}' to '{new_base_id}' globally..."):
-                                     st.session_state.refactor_results = perform_refactor(old_base_id, new_base_id, temp_parsed_data, temp_definitions, temp_references) # Uses lxml elements
-                                 st.session_state.parsed_xml_data = temp_parsed_data
-                                 st.session_state.show_download = True
-                                 st.success(f"Refactoring triggered by '{ref_info['attribute_name']}' complete.")
-                                 st.session_state.definitions, st.session_state.references = find_ids(st.session_state.parsed_xml_data)
-                                 st.session_state.selected_attribute_key, st.session_state.selected_ref_info, st.session_state.new_id_input_value = None, None, ""
-                                 st.rerun()
-                         elif not new_base_id: st.warning("Please enter a New ID.")
-                         elif new_base_id == old_base_id: st.warning("New ID cannot be the same as the Old ID.")
-
-    if st.session_state.refactor_results:
-         st.subheader("Refactoring Summary:")
-         st.text_area("Changes Made:", "\n".join(st.session_state.refactor_results), height=300, key="results_area")
-    if st.session_state.show_download:
-         st.subheader("Download Modified Files")
-         valid_xml_data = {name: tree for name, tree in st.session_state.get('parsed_xml_data', {}).items() if tree}
-         if valid_xml_data:
-             try:
-                  zip_buffer = create_zip(valid_xml_data) # Calls the lxml version
-                  st.download_button("Download Modified Files as ZIP", zip_buffer, "refactored_xml_files.zip", "application/zip", key="download_button")
-                  st.info("Download ZIP and replace original files (after backup!).")
-             except Exception as e: st.error(f"Error creating ZIP: {e}"); st.exception(e)
-         else: st.warning("No valid XML data to download.")
-
-elif not uploaded_files:
-     if not st.session_state.get('parsed_xml_data'): st.info("Please upload XML files to begin.")
-     if st.session_state.get('uploaded_files_data'):
-          st.info("File selection cleared. Resetting state.")
-          for key in default_state: st.session_state[key] = default_state[key]
-          st.rerun()
\ No newline at end of file
+# --- Imports ---
+import streamlit as st
+from xml_refactor import (
+    Reporter, set_reporter, Profiler, get_profiler, set_profiler, summarize_stages,
+    JOB_DONE, JOB_CANCELLED, JobRunner, current_job,
+    ParseCache, PARSE_CACHE_DIR, BASE_GAME_DIR, build_base_corpus, content_hash,
+    load_xml_files, materialize_files, rebuild_index, ChangeJournal, apply_attribute_changes,
+    perform_refactor, find_rename_conflicts, find_read_only_conflicts, perform_batch_refactor,
+    plan_pattern_rename, parse_rename_mapping, OutputCache, OUTPUT_ORIGINAL, OUTPUT_RESERIALIZED,
+    NO_PREFIX, check_integrity, new_dangling_references, ReferenceGraph, describe_changes,
+    CLONE_TAGS, plan_clone, copy_clone_elements, apply_clone, apply_insertions, ReferenceBrowser, group_references_by_file,
+)
+
+# --- Streamlit Reporting ---
+class StreamlitReporter(Reporter):
+    """Shows the core's messages in the running script's page (st.* resolves the session).
+    Messages of background jobs are kept with the job, as a worker thread has no page."""
+
+    def report(self, level, message):
+        job = current_job()
+        if job is not None: job.messages.append((level, message))
+        elif level == 'error': st.error(message)
+        elif level == 'warning': st.warning(message)
+        else: st.write(message)
+
+set_reporter(StreamlitReporter())
+
+class StreamlitProfiler(Profiler):
+    """Keeps the core's stage records in the running session, for the Performance panel."""
+
+    MAX_RECORDS = 500
+
+    @property
+    def trace_memory(self):
+        # tracemalloc is process-wide, so only stages of the script thread are traced
+        return current_job() is None and st.session_state.get('trace_memory', False)
+
+    def record(self, entry):
+        job = current_job()
+        if job is not None: # Moved to the session's records when the job is picked up
+            job.records.append(entry)
+            return
+        records = st.session_state.setdefault('performance_records', [])
+        records.append(entry)
+        if len(records) > self.MAX_RECORDS: del records[:-self.MAX_RECORDS]
+
+set_profiler(StreamlitProfiler())
+
+# Parsed once per server process and shared by every session
+load_base_corpus = st.cache_resource(show_spinner="Loading base game files...")(build_base_corpus)
+
+@st.cache_resource(show_spinner="Building the base game dependency graph...")
+def load_base_graph(_base_corpus):
+    """Dependency graph of the (single, never modified) base corpus, shared like the corpus itself."""
+    return ReferenceGraph.build(_base_corpus.index)
+
+# Worker threads for the background jobs of all sessions (one job at a time per session)
+JOB_WORKERS = 4
+# Seconds between refreshes of a running job's progress bar
+JOB_POLL_SECONDS = 0.5
+
+@st.cache_resource
+def get_job_runner():
+    return JobRunner(JOB_WORKERS)
+
+# --- UI Helper ---
+def run_session_refactor(refactor_fn, label, base_ids):
+    """Starts refactor_fn(xml_data, index, change_set, dry_run) as the session's background job.
+
+    The job is a dry run: it only reads the trees, so browsing goes on while it runs, and its
+    edits are applied in one go once it finishes (see apply_session_refactor). Refused if it
+    would edit a read-only base corpus file. Streamed files holding any of base_ids are
+    materialized first. Returns True if the job was started.
+    """
+    index = st.session_state.reference_index
+    read_only_conflicts = find_read_only_conflicts(base_ids, index, st.session_state.read_only_files)
+    if read_only_conflicts:
+        for message in read_only_conflicts: st.error(message)
+        return False
+    touched_streamed_files = index.unbound_files_for(base_ids)
+    if touched_streamed_files:
+        with st.spinner(f"Loading {len(touched_streamed_files)} streamed files touched by this rename..."):
+            materialize_errors = materialize_files(touched_streamed_files, st.session_state.parsed_xml_data, index, st.session_state.file_contents)
+        if materialize_errors:
+            for message in materialize_errors: st.error(message)
+            return False
+    xml_data = dict(st.session_state.parsed_xml_data) # Browsing may load more streamed files meanwhile
+
+    def compute_changes():
+        change_set = []
+        return refactor_fn(xml_data, index, change_set, True), change_set
+
+    start_session_job(label, compute_changes, lambda result, messages: apply_session_refactor(label, *result, messages))
+    return True
+
+def apply_session_refactor(label, results, change_set, messages):
+    """Applies the edits a rename job computed, updates the index from them and journals them under
+    label, unless any edited attribute changed while the job ran."""
+    stale_count = sum(1 for change in change_set if change.element.get(change.attribute_name) != change.old_value)
+    if stale_count:
+        messages.append(('error', f"{label}: {stale_count} attributes changed while it ran, nothing was applied. Run it again."))
+        return
+    locked_files = sorted(set(change.file_name for change in change_set) & st.session_state.read_only_files)
+    if locked_files: # Not expected after the check in run_session_refactor, but base trees are shared by all sessions
+        messages.append(('error', f"{label} would touch read-only base files ({', '.join(locked_files)}), nothing was applied."))
+        return
+    index = st.session_state.reference_index
+    integrity_before = get_integrity_report()
+    applied = []
+    try:
+        for change in change_set: # One at a time, so a failure leaves a known prefix to roll back
+            apply_attribute_changes((change,))
+            applied.append(change)
+        index.apply_changes(change_set)
+    except Exception as e:
+        apply_attribute_changes(applied, reverse=True)
+        if len(applied) == len(change_set): # The index update failed part way
+            st.session_state.reference_index = rebuild_session_index(index)
+        messages.append(('error', f"{label} failed, nothing was applied: {e}"))
+        return
+    record_session_step(label, change_set, (), integrity_before)
+    messages.append(('success', f"{label}: {len(change_set)} attribute edits applied."))
+    st.session_state.refactor_results = results
+    st.session_state.show_download = True
+    st.session_state.selected_attribute_key, st.session_state.selected_ref_info, st.session_state.new_id_input_value = None, None, ""
+
+def rebuild_session_index(index):
+    """The session's index rebuilt after a failed update, keeping its unmaterialized streamed files."""
+    return rebuild_index(st.session_state.parsed_xml_data, st.session_state.file_contents, index)
+
+def record_session_step(label, change_set, insertions, integrity_before):
+    """Journals an applied step and refreshes the graph and the integrity report."""
+    st.session_state.change_journal.record(label, change_set, insertions)
+    st.session_state.reference_graph = None
+    st.session_state.integrity_report = check_integrity(st.session_state.reference_index, st.session_state.read_only_files)
+    st.session_state.integrity_new_dangling = new_dangling_references(integrity_before, st.session_state.integrity_report)
+
+def get_clone_plan(root_id, new_root_id, pattern, replacement, tags):
+    """plan_clone() on the session, loading the streamed files the closure reaches first."""
+    index = st.session_state.reference_index
+    while True:
+        plan = plan_clone(root_id, new_root_id, st.session_state.parsed_xml_data, index, get_reference_graph(),
+                          pattern, replacement, tags, st.session_state.read_only_files)
+        if not plan['unbound_files']: return plan
+        with st.spinner(f"Loading {len(plan['unbound_files'])} streamed files reached by the clone..."):
+            materialize_errors = materialize_files(plan['unbound_files'], st.session_state.parsed_xml_data, index, st.session_state.file_contents)
+        if materialize_errors:
+            for message in materialize_errors: st.error(message)
+            plan['errors'].extend(materialize_errors)
+            return plan
+
+def run_session_clone(plan, label):
+    """Copies the elements of a clone plan in a background job; the copies are inserted and
+    journaled under label once it finishes (see apply_session_clone)."""
+    start_session_job(label, lambda: copy_clone_elements(plan),
+                      lambda copies, messages: apply_session_clone(plan, label, copies, messages))
+
+def apply_session_clone(plan, label, copies, messages):
+    """Inserts the copies of a clone job into the session's trees and journals them under label."""
+    index = st.session_state.reference_index
+    integrity_before = get_integrity_report()
+    insertions = []
+    try:
+        log = apply_clone(plan, st.session_state.parsed_xml_data, index, insertions, copies)
+    except Exception as e:
+        messages.append(('error', f"Cloning failed, removing {len(insertions)} copied elements: {e}"))
+        apply_insertions(insertions, reverse=True)
+        st.session_state.reference_index = rebuild_session_index(index)
+        return
+    record_session_step(label, [], insertions, integrity_before)
+    st.session_state.refactor_results = log
+    st.session_state.show_download = True
+    st.session_state.pop('clone_new_id', None) # The new IDs are taken now
+
+def start_session_job(label, fn, on_done):
+    """Runs fn() as the session's background job. on_done(result, messages) is called in the
+    script run that picks the finished job up (see finish_session_job) and may append
+    (level, message) pairs to show."""
+    st.session_state.active_job = get_job_runner().submit(label, fn)
+    st.session_state.active_job_done = on_done
+    st.session_state.job_messages = []
+
+def job_running():
+    """True while the session has a job that is not picked up yet: actions that modify the trees wait for it."""
+    return st.session_state.active_job is not None
+
+def finish_session_job():
+    """Picks up the session's finished background job: its stage records and messages, and on
+    success its result through its on_done handler. All of it happens in this script run,
+    before any widget reads the state, so the page sees the state before or after the job."""
+    job = st.session_state.active_job
+    if job is None or not job.finished: return
+    on_done = st.session_state.active_job_done
+    st.session_state.active_job = st.session_state.active_job_done = None
+    profiler = get_profiler()
+    for entry in job.records: profiler.record(entry)
+    messages = list(job.messages)
+    if job.status == JOB_DONE: on_done(job.result, messages)
+    elif job.status == JOB_CANCELLED: messages.append(('warning', f"Cancelled: {job.label}."))
+    else: messages.append(('error', f"{job.label} failed: {job.error}"))
+    st.session_state.job_messages = messages
+
+def cancel_session_job():
+    """Cancels the session's background job (if any), waits for it to stop and drops its outcome."""
+    job = st.session_state.active_job
+    st.session_state.active_job = st.session_state.active_job_done = None
+    if job is not None:
+        job.cancel()
+        job.wait() # Until it stops, e.g. using the parse cache
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def show_job_progress():
+    """Progress bar of the session's job. Refreshes on its own, so the rest of the page stays
+    usable; reruns the whole app once the job has finished."""
+    job = st.session_state.active_job
+    if job is None: return
+    if job.finished: st.rerun()
+    message = job.progress[2]
+    progress_col, cancel_col = st.columns([5, 1])
+    progress_col.progress(job.fraction() or 0.0, text=f"{job.label}: {message or 'starting'}... ({job.seconds():.0f}s)")
+    if cancel_col.button("Cancel", key="cancel_job_button", disabled=job.cancel_requested): job.cancel()
+
+def get_integrity_report():
+    """The session's integrity report, recomputed after loads and undo/redo reset it."""
+    if st.session_state.integrity_report is None:
+        st.session_state.integrity_report = check_integrity(st.session_state.reference_index, st.session_state.read_only_files)
+    return st.session_state.integrity_report
+
+# Rows shown per dependency table; the counts above them are complete
+MAX_PREVIEW_ROWS = 1000
+
+def get_reference_graph():
+    """The session's dependency graph, rebuilt lazily after loads, renames and undo/redo."""
+    if st.session_state.reference_graph is None:
+        index = st.session_state.reference_index
+        base_graph = load_base_graph(base_corpus) if base_corpus and index.base is not None else None
+        st.session_state.reference_graph = ReferenceGraph.build(index, base_graph)
+    return st.session_state.reference_graph
+
+def show_impact_preview(old_base_id, new_base_id):
+    """What renaming old_base_id touches: the IDs depending on it (from the dependency graph) and
+    a dry run of the rename as a per-file diff. Nothing is modified, so it runs on every selection."""
+    index, graph = st.session_state.reference_index, get_reference_graph()
+    dependents, dependencies = graph.dependents(old_base_id), graph.dependencies(old_base_id)
+    direct_count = sum(1 for distance in dependents.values() if distance == 1)
+    st.write(f"**Impact:** {len(index.references.get(old_base_id, ()))} indexed references, "
+             f"{direct_count} definitions use `{old_base_id}` directly and {len(dependents) - direct_count} more through them; "
+             f"it depends on {len(dependencies)} IDs.")
+    for message in find_read_only_conflicts([old_base_id], index, st.session_state.read_only_files): st.warning(message)
+    touched_streamed_files = index.unbound_files_for([old_base_id])
+    if touched_streamed_files:
+        with st.spinner(f"Loading {len(touched_streamed_files)} streamed files touched by this rename..."):
+            for message in materialize_files(touched_streamed_files, st.session_state.parsed_xml_data, index, st.session_state.file_contents): st.error(message)
+    change_set = []
+    perform_refactor(old_base_id, new_base_id, st.session_state.parsed_xml_data, index.definitions, index.references, change_set, index.values, dry_run=True)
+    diff_rows = describe_changes(change_set)
+    diff_tab, dependents_tab, dependencies_tab = st.tabs([
+        f"Dry run: {len(diff_rows)} edits in {len(set(row['file'] for row in diff_rows))} files",
+        f"Used by ({len(dependents)})", f"Uses ({len(dependencies)})"])
+    with diff_tab:
+        if diff_rows: st.dataframe(diff_rows, height=300)
+        else: st.write("Nothing would change.")
+    for tab, related in ((dependents_tab, dependents), (dependencies_tab, dependencies)):
+        with tab:
+            if not related: st.write("None.")
+            else:
+                st.caption("Distance 1: direct; higher: through the IDs in between.")
+                st.dataframe([{'id': base_id, 'distance': distance, 'defined_in': (index.definitions.get(base_id) or {}).get('file_name', '')}
+                              for base_id, distance in sorted(related.items(), key=lambda item: (item[1], item[0]))[:MAX_PREVIEW_ROWS]], height=300)
+
+# Rows per page of the attribute browser
+BROWSE_PAGE_SIZES = [50, 100, 200, 500]
+# Widget keys of the attribute browser's filters, cleared when another file is browsed
+BROWSE_FILTER_KEYS = ('browse_tags', 'browse_attributes', 'browse_prefixes', 'browse_search', 'browse_anywhere', 'browse_page')
+
+def get_reference_browser(file_name):
+    """The ReferenceBrowser of file_name, derived from the index and rebuilt only after the index
+    changed (its references are grouped by file once per index revision)."""
+    index = st.session_state.reference_index
+    cache = st.session_state.reference_browsers
+    if cache.get('index') is not index or cache.get('revision') != index.revision:
+        cache.clear()
+        cache.update(index=index, revision=index.revision, groups=group_references_by_file(index), browsers={})
+    browser = cache['browsers'].get(file_name)
+    if browser is None: browser = cache['browsers'][file_name] = ReferenceBrowser(file_name, cache['groups'].get(file_name, []))
+    return browser
+
+def get_loaded_file_names():
+    """Names of all successfully loaded files in upload order, whether parsed or only streamed."""
+    index = st.session_state.reference_index
+    unbound = index.unbound if index else {}
+    file_names = [name for name in st.session_state.uploaded_files_data if st.session_state.parsed_xml_data.get(name) or name in unbound]
+    # Files created by clones of read-only definitions
+    return file_names + [name for name, tree in st.session_state.parsed_xml_data.items() if tree is not None and name not in st.session_state.uploaded_files_data]
+
+def get_element_path(element):
+    """Helper to create a simple path string for an element."""
+    # Use lxml's .get method
+    elem_id = element.get('id')
+    if elem_id:
+         return f"{element.tag}[id={elem_id}]"
+    return element.tag
+
+# --- Streamlit App ---
+# (The Streamlit UI part remains largely the same, just ensure it uses
+#  the variables/functions modified above correctly)
+st.set_page_config(layout="wide")
+
+st.title("Bannerlord Mod XML ID Refactor Tool (Attribute-Focused)")
+st.warning("⚠️ **Prototype Limitations:** Basic ID detection. **Backup files!** Uses lxml for formatting.")
+
+# --- Session State Initialization ---
+default_state = {
+    'uploaded_files_data': {}, 'parsed_xml_data': {}, 'reference_index': None, 'change_journal': None,
+    'primary_file': None, 'selected_attribute_key': None,
+    'selected_ref_info': None, 'new_id_input_value': "",
+    'refactor_results': [], 'show_download': False,
+    'file_contents': {}, 'loaded_streaming_mode': False, 'output_cache': None,
+    'upload_signature': {}, 'read_only_files': frozenset(), 'performance_records': [],
+    'integrity_report': None, 'integrity_new_dangling': [], 'reference_graph': None,
+    'active_job': None, 'active_job_done': None, 'job_messages': [], 'reference_browsers': {}
+}
+for key, value in default_state.items():
+    if key not in st.session_state:
+        st.session_state[key] = value
+# Survives resets: unchanged files are not parsed or indexed again when the upload changes
+if 'parse_cache' not in st.session_state: st.session_state.parse_cache = ParseCache(PARSE_CACHE_DIR)
+
+# --- Base Corpus ---
+base_corpus = load_base_corpus(BASE_GAME_DIR) if BASE_GAME_DIR else None
+if base_corpus:
+    if base_corpus.file_names:
+        st.caption(f"Base game: {len(base_corpus.file_names)} read-only files from `{base_corpus.directory}` are indexed. Upload only your mod's files.")
+    else: st.warning(f"No base game XML files could be loaded from '{base_corpus.directory}'.")
+    if base_corpus.errors: st.warning(f"{len(base_corpus.errors)} base game files failed to parse and are ignored.")
+
+# --- Background Job ---
+finish_session_job()
+
+# --- File Uploader ---
+uploaded_files = st.file_uploader(
+    "Upload ALL relevant XML files (incl. spcultures.xml)", type=['xml'],
+    accept_multiple_files=True, key="file_uploader",
+    help="Select spcultures.xml and files defining/referencing IDs (troops, characters, etc.)"
+)
+streaming_mode = st.checkbox(
+    "Streaming mode (for very large files)", key="streaming_mode",
+    help="Index files without keeping their XML trees in memory. A file is only fully loaded when you browse it or a rename touches it; untouched files are downloaded unchanged."
+)
+if st.session_state.active_job is not None: show_job_progress()
+for level, message in st.session_state.job_messages: getattr(st, level)(message)
+
+# --- Main Logic ---
+if uploaded_files:
+    # A re-upload under the same name gets a new file_id, so replaced files are detected too
+    new_signature = {f.name: getattr(f, 'file_id', None) or content_hash(f.getvalue()) for f in uploaded_files}
+
+    if new_signature != st.session_state.upload_signature or streaming_mode != st.session_state.loaded_streaming_mode:
+        st.info(f"New file upload detected ({len(uploaded_files)} files). Reprocessing...")
+        cancel_session_job()
+        current_uploaded_data = {f.name: f for f in uploaded_files}
+        # Unchanged files get their (reverted) trees and shards back from the parse cache
+        st.session_state.parse_cache.release(st.session_state.parsed_xml_data, st.session_state.change_journal)
+        for key in default_state: st.session_state[key] = default_state[key]
+        st.session_state.uploaded_files_data = current_uploaded_data
+        st.session_state.upload_signature = new_signature
+        st.session_state.loaded_streaming_mode = streaming_mode
+        st.session_state.read_only_files = base_corpus.file_names if base_corpus else frozenset()
+        file_contents = {file_name: uploaded_file_obj.getvalue() for file_name, uploaded_file_obj in current_uploaded_data.items()}
+        parse_cache, base_index = st.session_state.parse_cache, base_corpus.index if base_corpus else None # The job has no session
+
+        def on_loaded(result, messages):
+            temp_parsed_data, loaded_index, load_errors = result
+            messages.extend(('error', message) for message in load_errors)
+            files_failed_count = sum(1 for tree in temp_parsed_data.values() if tree is None)
+            files_processed_count = len(file_contents) - files_failed_count
+            st.session_state.parsed_xml_data = temp_parsed_data
+            st.session_state.file_contents = file_contents
+            if files_processed_count > 0:
+                st.session_state.reference_index = loaded_index
+                st.session_state.change_journal = ChangeJournal()
+                messages.append(('success', f"Processed {files_processed_count} files. Found global definitions/references."))
+                if files_failed_count > 0: messages.append(('warning', f"{files_failed_count} files failed to parse."))
+                valid_files = get_loaded_file_names()
+                if "spcultures.xml" in valid_files: st.session_state.primary_file = "spcultures.xml"
+                elif valid_files: st.session_state.primary_file = valid_files[0]
+            elif files_failed_count > 0: messages.append(('error', "All uploaded files failed to parse."))
+
+        # Parse and index every file in parallel, in the background; per-file parse errors are reported as before
+        start_session_job(f"Processing {len(file_contents)} files",
+                          lambda: load_xml_files(file_contents, streaming=streaming_mode, cache=parse_cache, base_index=base_index),
+                          on_loaded)
+        st.rerun()
+
+    has_valid_data = bool(st.session_state.reference_index and get_loaded_file_names())
+    if not has_valid_data:
+        if st.session_state.get('uploaded_files_data') and not job_running():
+            st.error("XML data could not be parsed.")
+            if st.button("Process the files again", key="reload_button"): # e.g. after cancelling the load
+                st.session_state.upload_signature = {}
+                st.rerun()
+    else:
+        parsed_file_names = get_loaded_file_names()
+        if not parsed_file_names: st.warning("No files parsed successfully.")
+        else:
+            if st.session_state.primary_file not in parsed_file_names: st.session_state.primary_file = parsed_file_names[0]
+            selected_primary_file = st.selectbox("Select primary file to browse:", parsed_file_names, index=parsed_file_names.index(st.session_state.primary_file), key="primary_file_selector")
+            if selected_primary_file != st.session_state.primary_file:
+                st.session_state.primary_file = selected_primary_file
+                st.session_state.selected_attribute_key, st.session_state.selected_ref_info, st.session_state.new_id_input_value = None, None, ""
+                for key in BROWSE_FILTER_KEYS: st.session_state.pop(key, None)
+                st.rerun()
+            if st.session_state.primary_file in st.session_state.reference_index.unbound: # Streamed: load its DOM to browse it
+                with st.spinner(f"Loading '{st.session_state.primary_file}'..."):
+                    for message in materialize_files([st.session_state.primary_file], st.session_state.parsed_xml_data, st.session_state.reference_index, st.session_state.file_contents): st.error(message)
+
+            st.subheader(f"Select Attribute to Refactor in '{st.session_state.primary_file}'")
+            attribute_options = {"<Select an attribute>": None}
+            browser = None
+            if st.session_state.parsed_xml_data.get(st.session_state.primary_file) is not None:
+                browser = get_reference_browser(st.session_state.primary_file)
+            if browser is not None and browser.rows:
+                # Options only for the current page of the filtered references, so huge files stay responsive
+                tag_col, attribute_col, prefix_col = st.columns(3)
+                # Filter values the file no longer has (e.g. after an undone clone) stay selectable
+                browse_tags = tag_col.multiselect("Tags:", sorted(set(browser.by_tag) | set(st.session_state.get('browse_tags', ()))), key="browse_tags")
+                browse_attributes = attribute_col.multiselect("Attributes:", sorted(set(browser.by_attribute) | set(st.session_state.get('browse_attributes', ()))), key="browse_attributes")
+                browse_prefixes = prefix_col.multiselect("Prefixes:", sorted(set(browser.by_prefix) | set(st.session_state.get('browse_prefixes', ()))), key="browse_prefixes")
+                search_col, anywhere_col = st.columns([3, 1])
+                browse_search = search_col.text_input("Search IDs:", key="browse_search", help="Matches the start of the base ID (case-insensitive).")
+                browse_anywhere = anywhere_col.checkbox("Match anywhere in the value", key="browse_anywhere")
+                matches = browser.search(browse_tags, browse_attributes, browse_prefixes, browse_search, browse_anywhere)
+                size_col, page_col = st.columns(2)
+                page_size = size_col.selectbox("References per page:", BROWSE_PAGE_SIZES, index=1, key="browse_page_size")
+                page_count = max(1, -(-len(matches) // page_size))
+                if st.session_state.get('browse_page', 1) > page_count: st.session_state.browse_page = page_count
+                page = page_col.number_input(f"Page (of {page_count}):", min_value=1, max_value=page_count, step=1, key="browse_page")
+                st.caption(f"{len(matches)} of {len(browser.rows)} references match.")
+                page_rows = matches[(page - 1) * page_size:page * page_size]
+                selected_info = st.session_state.selected_ref_info
+                if (selected_info and selected_info['file'] == st.session_state.primary_file and selected_info['row'] not in page_rows
+                        and selected_info['row'] < len(browser.rows)):
+                    page_rows = [selected_info['row']] + page_rows # Keep the selection when paging or filtering
+                for row in page_rows:
+                    ref = browser.rows[row]
+                    if ref['element'] is None: continue # Only until the file is materialized
+                    elem_path_str = get_element_path(ref['element'])
+                    display_text = f'#{row + 1} {elem_path_str} | {ref["attribute_name"]}="{ref["original_value"]}"' # Unique per row
+                    attribute_options[display_text] = {
+                        "key": f"{st.session_state.primary_file}-{row}", "row": row, "file": st.session_state.primary_file,
+                        "element_repr": elem_path_str, "attribute_name": ref['attribute_name'],
+                        "original_value": ref['original_value'], "old_id": ref['base_id'], "prefix": ref['prefix']
+                    }
+
+            if browser is None or not browser.rows: st.info(f"No potential ID references found in '{st.session_state.primary_file}'.")
+            elif len(attribute_options) <= 1: st.info("No references match the filters.")
+            else:
+                 option_keys = list(attribute_options.keys())
+                 current_attr_index = 0
+                 if st.session_state.selected_attribute_key:
+                      try: current_attr_index = next(i for i, k in enumerate(option_keys) if attribute_options[k] and attribute_options[k]['key'] == st.session_state.selected_attribute_key)
+                      except (StopIteration, ValueError): current_attr_index = 0
+                 selected_attr_display = st.selectbox("Select attribute to modify:", option_keys, index=current_attr_index, key="attribute_selector")
+                 selected_info = attribute_options.get(selected_attr_display)
+                 if selected_info: st.session_state.selected_attribute_key, st.session_state.selected_ref_info = selected_info['key'], selected_info
+                 else: st.session_state.selected_attribute_key, st.session_state.selected_ref_info = None, None
+
+                 if st.session_state.selected_ref_info:
+                     ref_info = st.session_state.selected_ref_info
+                     st.write(f"**Selected:** Attribute `{ref_info['attribute_name']}` = `{ref_info['original_value']}`")
+                     st.write(f"(Element: `{ref_info['element_repr']}`, Base ID: `{ref_info['old_id']}`, Prefix: `{ref_info['prefix'] or '(None)'}`)")
+                     new_id_input = st.text_input(f"Enter New Base ID for '{ref_info['old_id']}':", key="new_id_input", value=st.session_state.new_id_input_value)
+                     st.session_state.new_id_input_value = new_id_input
+                     with st.expander("Impact preview", expanded=True):
+                         preview_new_id = new_id_input.strip() or "<new id>"
+                         for message in find_rename_conflicts({ref_info['old_id']: preview_new_id}, st.session_state.reference_index.definitions): st.warning(message)
+                         show_impact_preview(ref_info['old_id'], preview_new_id)
+                     if st.button("Refactor This Attribute Globally", key="refactor_button", disabled=job_running()):
+                         new_base_id = st.session_state.new_id_input_value.strip()
+                         old_base_id = ref_info['old_id']
+                         invalid_id = new_base_id and new_base_id != old_base_id and find_rename_conflicts({old_base_id: new_base_id}, {})
+                         if invalid_id: st.error(invalid_id[0])
+                         elif old_base_id and new_base_id and new_base_id != old_base_id:
+                             if run_session_refactor(
+                                     lambda xml_data, index, change_set, dry_run: perform_refactor(old_base_id, new_base_id, xml_data, index.definitions, index.references, change_set, index.values, dry_run),
+                                     f"Rename '{old_base_id}' -> '{new_base_id}'", [old_base_id]):
+                                 st.rerun()
+                         elif not new_base_id: st.warning("Please enter a New ID.")
+                         elif new_base_id == old_base_id: st.warning("New ID cannot be the same as the Old ID.")
+
+            # --- Batch Rename ---
+            st.subheader("Batch Rename")
+            with st.expander("Rename many IDs at once from a CSV/JSON mapping"):
+                mapping_file = st.file_uploader("Upload mapping (CSV lines 'old,new' or JSON {\"old\": \"new\"})", type=['csv', 'json', 'txt'], key="mapping_uploader")
+                mapping_text = st.text_area("...or paste the mapping here:", key="mapping_text", height=150)
+                if st.button("Apply Batch Rename", key="batch_refactor_button", disabled=job_running()):
+                    if mapping_file is not None: mapping_source = mapping_file.getvalue().decode('utf-8-sig')
+                    else: mapping_source = mapping_text
+                    mapping, mapping_errors = parse_rename_mapping(mapping_source)
+                    conflicts = find_rename_conflicts(mapping, st.session_state.reference_index.definitions)
+                    if mapping_errors or conflicts:
+                        for message in mapping_errors + conflicts: st.error(message)
+                    elif not mapping: st.warning("The mapping is empty.")
+                    else:
+                        if run_session_refactor(
+                                lambda xml_data, index, change_set, dry_run: perform_batch_refactor(mapping, xml_data, index.definitions, index.references, change_set, index.values, dry_run),
+                                f"Batch rename ({len(mapping)} IDs)", mapping):
+                            st.rerun()
+
+            # --- Pattern Rename ---
+            st.subheader("Pattern Rename")
+            with st.expander("Rename every ID matching a pattern (e.g. empire_* -> myculture_*)"):
+                pattern_mode = st.radio("Pattern type:", ["Prefix", "Regex"], horizontal=True, key="pattern_mode")
+                pattern_col, replacement_col = st.columns(2)
+                rename_pattern = pattern_col.text_input("Old prefix / regex:", key="rename_pattern", help="Regex mode replaces the first match; use groups like \\1 in the replacement.")
+                rename_replacement = replacement_col.text_input("New prefix / replacement:", key="rename_replacement")
+                if rename_pattern:
+                    index = st.session_state.reference_index
+                    pattern_mapping, pattern_preview, pattern_errors = plan_pattern_rename(
+                        rename_pattern, rename_replacement, index.definitions, index.references,
+                        mode='prefix' if pattern_mode == "Prefix" else 'regex', read_only_files=st.session_state.read_only_files)
+                    for message in pattern_errors: st.error(message)
+                    if not pattern_errors:
+                        total_refs = sum(row['references'] for row in pattern_preview)
+                        st.write(f"**{len(pattern_mapping)}** IDs match, with **{total_refs}** indexed references.")
+                        if pattern_preview: st.dataframe(pattern_preview, height=300)
+                        pattern_conflicts = find_rename_conflicts(pattern_mapping, index.definitions)
+                        pattern_conflicts += find_read_only_conflicts(pattern_mapping, index, st.session_state.read_only_files)
+                        for message in pattern_conflicts: st.error(message)
+                        if pattern_mapping and not pattern_conflicts and st.button(f"Apply Pattern Rename ({len(pattern_mapping)} IDs)", key="pattern_refactor_button", disabled=job_running()):
+                            if run_session_refactor(
+                                    lambda xml_data, index, change_set, dry_run: perform_batch_refactor(pattern_mapping, xml_data, index.definitions, index.references, change_set, index.values, dry_run),
+                                    f"Pattern rename '{rename_pattern}' -> '{rename_replacement}' ({len(pattern_mapping)} IDs)", pattern_mapping):
+                                st.rerun()
+
+            # --- Clone ---
+            st.subheader("Clone")
+            with st.expander("Copy a definition (e.g. a culture) with its troops, rosters and party templates under new IDs"):
+                clone_col, new_clone_col = st.columns(2)
+                clone_root_id = clone_col.text_input("ID to clone:", key="clone_root_id", help="e.g. empire").strip()
+                clone_new_id = new_clone_col.text_input("New ID:", key="clone_new_id").strip()
+                pattern_col, replacement_col = st.columns(2)
+                clone_pattern = pattern_col.text_input("Rename regex (optional):", key="clone_pattern",
+                                                       help="Applied to every copied ID it matches, e.g. ^imperial -> vakken. Other IDs containing the cloned ID get it replaced by the new ID; the rest get the new ID as a prefix.")
+                clone_replacement = replacement_col.text_input("Replacement:", key="clone_replacement")
+                clone_tags = st.multiselect("Also copy the definitions it reaches with these tags:", sorted(set(CLONE_TAGS) | {'Culture', 'Item', 'SkillSet'}),
+                                            default=list(CLONE_TAGS), key="clone_tags")
+                if clone_root_id and clone_new_id:
+                    clone_plan = get_clone_plan(clone_root_id, clone_new_id, clone_pattern, clone_replacement, clone_tags)
+                    for message in clone_plan['errors']: st.error(message)
+                    if clone_plan['elements']:
+                        st.write(f"**{len(clone_plan['elements'])}** elements will be copied with **{len(clone_plan['mapping'])}** new IDs.")
+                        if clone_plan['new_files']: st.caption(f"Copies of read-only base definitions go to new files: {', '.join(clone_plan['new_files'])}.")
+                        st.dataframe(clone_plan['preview'], height=300)
+                    if clone_plan['elements'] and not clone_plan['errors'] and st.button(f"Apply Clone ({len(clone_plan['mapping'])} IDs)", key="clone_button", disabled=job_running()):
+                        run_session_clone(clone_plan, f"Clone '{clone_root_id}' as '{clone_new_id}' ({len(clone_plan['mapping'])} IDs)")
+                        st.rerun()
+
+    journal = st.session_state.change_journal
+    if journal and (journal.undo_stack or journal.redo_stack):
+         st.subheader("History")
+         undo_col, redo_col = st.columns(2)
+         undo_label = journal.undo_stack[-1][0] if journal.undo_stack else None
+         redo_label = journal.redo_stack[-1][0] if journal.redo_stack else None
+         if undo_col.button(f"↶ Undo: {undo_label}" if undo_label else "↶ Undo", key="undo_button", disabled=not undo_label or job_running()):
+              label = journal.undo(st.session_state.reference_index)
+              st.session_state.refactor_results = [f"UNDONE: {label}"]
+              st.session_state.integrity_report, st.session_state.integrity_new_dangling, st.session_state.reference_graph = None, [], None
+              st.rerun()
+         if redo_col.button(f"↷ Redo: {redo_label}" if redo_label else "↷ Redo", key="redo_button", disabled=not redo_label or job_running()):
+              label = journal.redo(st.session_state.reference_index)
+              st.session_state.refactor_results = [f"REDONE: {label}"]
+              st.session_state.integrity_report, st.session_state.integrity_new_dangling, st.session_state.reference_graph = None, [], None
+              st.rerun()
+         st.caption(f"{len(journal.undo_stack)} step(s) to undo, {len(journal.redo_stack)} to redo.")
+
+    if has_valid_data:
+         integrity = get_integrity_report()
+         integrity_counts, new_dangling = integrity['counts'], st.session_state.integrity_new_dangling
+         with st.expander(f"Integrity: {integrity_counts['dangling_references']} dangling references, "
+                          f"{integrity_counts['duplicates']} duplicate definitions, {integrity_counts['orphans']} unreferenced IDs",
+                          expanded=bool(new_dangling)):
+              if new_dangling:
+                   st.error("The last change left references to undefined IDs: " +
+                            ", ".join(f"`{prefix if prefix != NO_PREFIX else ''}{base_id}` ({count})" for prefix, base_id, count in new_dangling))
+              if st.session_state.read_only_files: st.caption("Only your own files are checked; the base game files are read-only.")
+              dangling_tab, duplicates_tab, orphans_tab = st.tabs(["Dangling references", "Duplicate definitions", "Unreferenced IDs"])
+              with dangling_tab:
+                   if not integrity['dangling']: st.write("Every reference points at a loaded definition.")
+                   for prefix, entries in integrity['dangling'].items():
+                        st.write(f"**{prefix}** {len(entries)} undefined IDs, {sum(entry['references'] for entry in entries)} references")
+                        st.dataframe([{'id': entry['id'], 'references': entry['references'],
+                                       'locations': ', '.join(f"{file_name}:{line}" for file_name, line in entry['locations'])} for entry in entries])
+              with duplicates_tab:
+                   if not integrity['duplicates']: st.write("No ID is defined twice.")
+                   else:
+                        st.caption("The first location is the definition in use.")
+                        st.dataframe([{'id': entry['id'], 'locations': ', '.join(f"{file_name}:{line}" for file_name, line in entry['locations'])}
+                                      for entry in integrity['duplicates']])
+              with orphans_tab:
+                   if not integrity['orphans']: st.write("Every defined ID is referenced.")
+                   else:
+                        st.caption("Defined but not referenced by any loaded file. The game may still use them directly.")
+                        st.dataframe(integrity['orphans'])
+    if st.session_state.refactor_results:
+         st.subheader("Refactoring Summary:")
+         st.text_area("Changes Made:", "\n".join(st.session_state.refactor_results), height=300, key="results_area")
+    if st.session_state.show_download:
+         st.subheader("Download Modified Files")
+         # Untouched files (including never materialized streamed ones) are shipped byte for byte;
+         # edited files get only their changed attribute values spliced into the original bytes.
+         # Both the rendered files and the ZIP are cached, so reruns do not rebuild them.
+         if st.session_state.output_cache is None: st.session_state.output_cache = OutputCache()
+         output_cache = st.session_state.output_cache
+         output_files = output_cache.render(
+             get_loaded_file_names(), st.session_state.parsed_xml_data, st.session_state.file_contents,
+             st.session_state.reference_index, st.session_state.change_journal)
+         changed_files = [file_name for file_name, (_, status) in output_files.items() if status != OUTPUT_ORIGINAL]
+         reserialized_files = [file_name for file_name, (_, status) in output_files.items() if status == OUTPUT_RESERIALIZED]
+         if output_files:
+             zip_col1, zip_col2, zip_col3 = st.columns(3)
+             changed_only = zip_col1.checkbox(f"Only changed files ({len(changed_files)})", key="zip_changed_only")
+             compresslevel = zip_col2.select_slider("Compression level", options=list(range(10)), value=6, key="zip_compresslevel",
+                                                    help="Deflate level for changed files; 0 stores them uncompressed.")
+             compress_untouched = zip_col3.checkbox("Compress unchanged files too", key="zip_compress_untouched",
+                                                    help="By default unchanged files are stored without compression, which is much faster for large projects.")
+             try:
+                  zip_bytes = output_cache.get_zip(output_files, compresslevel, compress_untouched, changed_only)
+                  st.download_button("Download Modified Files as ZIP", zip_bytes, "refactored_xml_files.zip", "application/zip", key="download_button")
+                  if reserialized_files: st.warning(f"Could not edit {', '.join(reserialized_files)} in place; these files were re-serialized with lxml formatting.")
+                  st.info("Download ZIP and replace original files (after backup!).")
+             except Exception as e: st.error(f"Error creating ZIP: {e}"); st.exception(e)
+         else: st.warning("No valid XML data to download.")
+
+elif not uploaded_files:
+     if not st.session_state.get('parsed_xml_data'): st.info("Please upload XML files to begin.")
+     if st.session_state.get('uploaded_files_data'):
+          st.info("File selection cleared. Resetting state.")
+          cancel_session_job()
+          st.session_state.parse_cache.release(st.session_state.parsed_xml_data, st.session_state.change_journal)
+          for key in default_state: st.session_state[key] = default_state[key]
+          st.rerun()
+
+# --- Performance ---
+with st.expander("Performance"):
+    st.checkbox("Trace memory allocations (slower)", key="trace_memory",
+                help="Records the peak Python allocation of each stage with tracemalloc. lxml's own memory is not included; see the process peak (max RSS) for it.")
+    performance_records = st.session_state.get('performance_records')
+    if not performance_records: st.caption("No stages recorded yet. Load files or run a rename.")
+    else:
+        st.write("**Totals per stage**")
+        st.dataframe([{
+            'stage': total['stage'], 'calls': total['calls'], 'seconds': total['seconds'], 'peak MB': total['peak_mb'],
+            **total['counts'],
+        } for total in summarize_stages(performance_records)])
+        st.write("**Recent stages** (newest first)")
+        st.dataframe([{
+            'stage': entry['stage'], 'seconds': entry['seconds'], 'peak MB': entry.get('peak_mb'), 'max RSS MB': entry['max_rss_mb'],
+            'counts': ', '.join(f"{name}={value}" for name, value in entry['counts'].items()), 'error': entry.get('error'),
+        } for entry in reversed(performance_records[-50:])])
+        if st.button("Clear", key="clear_performance"):
+            st.session_state.performance_records = []
+            st.rerun()